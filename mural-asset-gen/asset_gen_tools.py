@@ -5,18 +5,21 @@ This file houses a collection of tool functions. It is a utility collection.
 """
 from __future__ import unicode_literals
 
-import json
 import os
-import shlex
 import shutil
-import subprocess
 from xml.dom import minidom
 from xml.etree import ElementTree
-from zipfile import ZipFile
 
 import sys
 
-import shell_commands
+import config_registry
+import file_copy
+import image_probe
+import large_images
+import mutex_index
+import raster_backend
+import zip_stream
+from environmentals import get_environ_val_default
 
 FILE_NOT_FOUND = "{path} not found"
 IS_WIN = (sys.platform == 'win32')
@@ -83,16 +86,15 @@ def save_lines(path, output):
             output_file.writelines(output.encode('utf-8'))
 
 
-def zip_directory(path):
+def zip_directory(path, delete_source=True):
     """
     :param path: directory to be zipped
+    :param delete_source: whether the directory is removed once archived
     :return: nothing
     """
-    with ZipFile("{0}.zip".format(path), "w") as output_file:
-        for root, _, files in os.walk(path):
-            for my_file in files:
-                output_file.write(os.path.join(root, my_file), os.path.join(remove_prefix(root, path), my_file))
-    shutil.rmtree(path)
+    zip_stream.write_zip(path, "{0}.zip".format(path))
+    if delete_source:
+        shutil.rmtree(path)
 
 
 def file_exist(path):
@@ -125,17 +127,56 @@ def file_exist_custom_error(path, error_message):
         return False
 
 
-def resize_image(command_string, input_path, output_path, size):
+def resize_image(command_string, input_path, output_path, size, background=None):
     """
     :param command_string: commandline to be executed
     :param input_path: the file to be converted
     :param output_path: the path where the output should be written
     :param size: image size for the output image
+    :param background: background color for commands that flatten (e.g. IMAGE_MAGICK_SQUARE_FLATTEN_COMMAND)
     :return: nothing
     """
-    create_needed_dirs(output_path)
-    command = shlex.split(command_string.format(input=input_path, size=size, output=output_path))
-    subprocess.check_output(command, env=shell_commands.ENV)
+    prepare_output(input_path, output_path)
+    input_path = large_images.reduced_input(command_string, input_path, [size])
+    if image_probe.can_copy(command_string, input_path, output_path, size):
+        file_copy.copy_file(input_path, output_path)
+        return
+    backend = select_backend(command_string, input_path)
+    backend.resize(command_string, input_path, output_path, size, background)
+
+
+def resize_image_batch(command_string, input_path, outputs, background=None):
+    """
+    :param command_string: single-output commandline template of the density set
+    :param input_path: the file to be converted
+    :param outputs: list of (output_path, size) tuples, one per density
+    :param background: background color for commands that flatten
+    :return: nothing
+    """
+    input_path = large_images.reduced_input(command_string, input_path, [size for _, size in outputs])
+    pending = []
+    for output_path, size in outputs:
+        prepare_output(input_path, output_path)
+        if image_probe.can_copy(command_string, input_path, output_path, size):
+            file_copy.copy_file(input_path, output_path)
+        else:
+            pending.append((output_path, size))
+    if len(pending) > 0:
+        backend = select_backend(command_string, input_path)
+        backend.resize_batch(command_string, input_path, pending, background)
+
+
+def select_backend(command_string, input_path):
+    """
+    :param command_string: commandline template
+    :param input_path: the file to be converted
+    :return: the raster backend, the memory-bounded cli backend for inputs over the RENDER_MEMORY_MB budget unless
+    RASTER_BACKEND forces a backend
+    """
+    forced = get_environ_val_default(raster_backend.RASTER_BACKEND_KEY, raster_backend.BACKEND_AUTO)
+    if forced == raster_backend.BACKEND_AUTO and large_images.over_budget(input_path):
+        return raster_backend.CLI_BACKEND
+    return raster_backend.select_backend(command_string, input_path)
 
 
 def convert_flatten_image(command_string, input_path, output_path):
@@ -145,9 +186,9 @@ def convert_flatten_image(command_string, input_path, output_path):
     :param output_path: path to write flattened file to
     :return: nothing
     """
-    create_needed_dirs(output_path)
-    command = shlex.split(command_string.format(input=input_path, output=output_path))
-    subprocess.check_output(command, env=shell_commands.ENV)
+    prepare_output(input_path, output_path)
+    backend = select_backend(command_string, input_path)
+    backend.flatten(command_string, input_path, output_path)
 
 
 def copy(input_path, output_path, print_path=False):
@@ -158,7 +199,9 @@ def copy(input_path, output_path, print_path=False):
     :return: nothing
     """
     create_needed_dirs(output_path)
-    shutil.copy(input_path, output_path)
+    if os.path.isdir(output_path):
+        output_path = os.path.join(output_path, os.path.basename(input_path))
+    file_copy.copy_file(input_path, output_path)
 
     if print_path:
         the_idx = output_path.rfind('/')
@@ -166,14 +209,37 @@ def copy(input_path, output_path, print_path=False):
         print('The Dir: \n{0}'.format(os.listdir(the_dir)))
 
 
+def link_or_copy(input_path, output_path):
+    """
+    :param input_path: finished build artifact, never rewritten in place
+    :param output_path: where the file should also appear
+    :return: nothing, hard links (or clones) the file where possible
+    """
+    create_needed_dirs(output_path)
+    file_copy.copy_file(input_path, output_path, immutable=True)
+
+
+def prepare_output(input_path, output_path):
+    """
+    :param input_path: the file the output is rendered from
+    :param output_path: the render about to be written
+    :return: nothing, creates the directory and removes a previous output, which may be a hard link to a render cache
+    entry, so the tool writes a new file instead of rewriting the shared one in place
+    """
+    create_needed_dirs(output_path)
+    if os.path.lexists(output_path) and os.path.abspath(output_path) != os.path.abspath(input_path):
+        os.remove(output_path)
+
+
 def create_needed_dirs(path):
     """
     :param path: the path
     :return: nothing
     """
     path_dir = os.path.dirname(path)
-    if not os.path.exists(path_dir):
-        os.makedirs(path_dir)
+    if path_dir and not os.path.exists(path_dir):
+        # exist_ok, render workers may create the same density directory concurrently
+        os.makedirs(path_dir, exist_ok=True)
 
 
 def remove_prefix(text, prefix):
@@ -194,25 +260,31 @@ def copytree(src, dst, symlinks=False, ignore=None):
     :return: nothing
     """
     create_needed_dirs(dst)
-    for item in os.listdir(src):
+    if not os.path.isdir(dst):
+        os.makedirs(dst, exist_ok=True)
+    items = os.listdir(src)
+    ignored = ignore(src, items) if ignore is not None else set()
+    for item in items:
+        if item in ignored:
+            continue
         source = os.path.join(src, item)
         destination = os.path.join(dst, item)
 
-        if os.path.isdir(source):
-            shutil.copytree(source, destination, symlinks, ignore)
+        if symlinks and os.path.islink(source):
+            os.symlink(os.readlink(source), destination)
+        elif os.path.isdir(source):
+            copytree(source, destination, symlinks, ignore)
         else:
-            shutil.copy2(source, destination)
+            file_copy.copy_file(source, destination, metadata=True)
 
 
 def get_json_array_from_file(file, data_tag):
     """
     :param file: file to read
     :param data_tag: tag to parse
-    :return: file contents as array of values
+    :return: file contents as an immutable array (tuple) of values, parsed once per run
     """
-    json_data = read(file)
-    json_dictionary = json.loads(json_data)
-    return json_dictionary[data_tag]
+    return config_registry.get_registry().get(file, data_tag)
 
 
 # Utility wrapper to make return type more explicit to readers of the code.
@@ -220,7 +292,7 @@ def get_json_dictionary_from_file(file, data_tag):
     """
     :param file: file to read
     :param data_tag: tag to parse
-    :return: file contents as json dictionary
+    :return: file contents as a read-only json dictionary
     """
     return get_json_array_from_file(file, data_tag)
 
@@ -240,13 +312,7 @@ def get_build_config_mutex_id_dict(file, data_tag):
     :param data_tag: the root tag of the json file
     :return: dictionary of mutex names with associated ids
     """
-    mutex_ids_by_key = dict()
-    mutex_configs = get_json_array_from_file(file, data_tag)
-
-    for mutex_config in mutex_configs:
-        mutex_ids_by_key[mutex_config["name"]] = mutex_config["mutex_id"]
-
-    return mutex_ids_by_key
+    return mutex_index.get_index(file, data_tag).ids_by_name
 
 
 def get_mutexes_by_id(mutex_id, file, data_tag):
@@ -256,10 +322,7 @@ def get_mutexes_by_id(mutex_id, file, data_tag):
     :param data_tag: the root tag of the json file
     :return: array of incompatible config mutex ids
     """
-    mutex_configs = get_json_array_from_file(file, data_tag)
-    for mutex_config in mutex_configs:
-        if mutex_id == mutex_config["mutex_id"]:
-            return mutex_config["mutex_with"]
+    return mutex_index.get_index(file, data_tag).mutexes_by_id.get(mutex_id)
 
 
 def get_mutex_name_from_id(mutex_id, file, data_tag):
@@ -269,10 +332,55 @@ def get_mutex_name_from_id(mutex_id, file, data_tag):
     :param data_tag: the root tag of the json file
     :return: the mutex config that matches the supplied ID
     """
-    mutex_configs = get_json_array_from_file(file, data_tag)
-    for mutex_config in mutex_configs:
-        if mutex_id == mutex_config["mutex_id"]:
-            return mutex_config["name"]
+    return mutex_index.get_index(file, data_tag).names_by_id.get(mutex_id)
+
+
+def report_mutex_conflicts(index, active_components, description, message, error, **values):
+    """
+    :param index: the MutexIndex of the mutex file
+    :param active_components: ids of the enabled components
+    :param description: what kind of values are in conflict
+    :param message: message template for one conflict, given bf_one, bf_two and values
+    :param error: message of the ValueError raised when there is any conflict
+    :param values: further values of the message template
+    :return: nothing, raises ValueError after printing every conflicting pair
+    """
+    conflicts = index.conflicts(active_components)
+    if len(conflicts) == 0:
+        return
+    print("A configuration anomaly has been detected.")
+    print(description)
+    for mutex_one, mutex_two in conflicts:
+        print(message.format(bf_one=index.name_of(mutex_one), bf_two=index.name_of(mutex_two), **values))
+    raise ValueError(error)
+
+
+def get_active_strings(mutex_tags, strings, index):
+    """
+    :param mutex_tags: tags being evaluated
+    :param strings: localisation strings, name -> text
+    :param index: the MutexIndex of the mutex file
+    :return: ids of the tags that have a value
+    """
+    return [index.ids_by_name[tag] for tag in mutex_tags if tag in index.ids_by_name and len(strings.get(tag, "")) > 0]
+
+
+def get_string_mutex_problems(mutex_tags, strings, lang, file):
+    """
+    :param mutex_tags: tags being evaluated
+    :param strings: localisation strings, name -> text
+    :param lang: language
+    :param file: the file location where the mutexes are defined
+    :return: list of problems, empty when exactly a compatible set of the tags has values
+    """
+    index = mutex_index.get_index(file, "data")
+    active_components = get_active_strings(mutex_tags, strings, index)
+    if len(active_components) == 0:
+        return ["Some required strings are empty, check {tags} strings for language {lang}".format(tags=mutex_tags,
+                                                                                                 lang=lang)]
+    return ["Mutually exclusive strings {bf_one} and {bf_two} both have values for language {lang}".format(
+        bf_one=index.name_of(mutex_one), bf_two=index.name_of(mutex_two), lang=lang)
+        for mutex_one, mutex_two in index.conflicts(active_components)]
 
 
 def check_string_mutexes(mutex_tags, strings, lang, file):
@@ -283,14 +391,8 @@ def check_string_mutexes(mutex_tags, strings, lang, file):
     :param file: the file location where the mutexes are defined
     :return: nothing
     """
-    # Dictionary of mutexed feature names with associated ids
-    mutex_id_dict = get_build_config_mutex_id_dict(file, "data")
-    active_components = []
-    for tag, value in strings.items():
-        if tag in mutex_tags:
-            if tag in mutex_id_dict:
-                if len(value) > 0:
-                    active_components.append(mutex_id_dict[tag])
+    index = mutex_index.get_index(file, "data")
+    active_components = get_active_strings(mutex_tags, strings, index)
 
     if len(active_components) == 0:
         print("A configuration anomaly has been detected.")
@@ -301,26 +403,26 @@ def check_string_mutexes(mutex_tags, strings, lang, file):
         raise ValueError('Required strings missing from data.json')
 
     # Check if any of the active components are in conflict with any of the other active components
-    for active_component in active_components:
-        mutexes = get_mutexes_by_id(active_component, file, "data")
-        for mutex in mutexes:
-            if mutex in active_components:
-                print("A configuration anomaly has been detected.")
-                print("Mutually exclusive build system strings have been given values.")
-                message = "Check strings {bf_one} and {bf_two} for language {lang}"
-
-                build_flag_one = get_mutex_name_from_id(active_component,
-                                                        file,
-                                                        "data")
-
-                build_flag_two = get_mutex_name_from_id(mutex,
-                                                        file,
-                                                        "data")
-                message = message.format(bf_one=build_flag_one,
-                                         bf_two=build_flag_two,
-                                         lang=lang)
-                print(message)
-                raise ValueError('Incompatible build configurations in data.json file')
+    report_mutex_conflicts(index, active_components,
+                           "Mutually exclusive build system strings have been given values.",
+                           "Check strings {bf_one} and {bf_two} for language {lang}",
+                           'Incompatible build configurations in data.json file', lang=lang)
+
+
+def get_active_flags(app_components, attribute, index):
+    """
+    :param app_components: list of build flags specified for this flavour
+    :param attribute: the build attribute holding the single-item flag dictionaries
+    :param index: the MutexIndex of the mutex file
+    :return: ids of the enabled flags of the attribute
+    """
+    active_components = []
+    for each in app_components.get(attribute, []):
+        for sub_attribute, sub_value in each.items():
+            if sub_value:
+                # Build a list of components to be enable in the app
+                active_components.append(index.ids_by_name[sub_attribute])
+    return active_components
 
 
 def check_app_location_flags(app_components, flavour_name, file):
@@ -328,18 +430,10 @@ def check_app_location_flags(app_components, flavour_name, file):
     :param app_components: list of build flags specified for this flavour
     :param flavour_name: name of the flavour
     :param file: the file location where the mutexes are defined
-    :return: nothing
+    :return: ids of the enabled geo-location components
     """
-    # Dictionary of mutexed feature names with associated ids
-    mutex_id_dict = get_build_config_mutex_id_dict(file, "data")
-    active_components = []
-    for attribute, value in app_components.items():
-        if attribute == 'geo_location':
-            for each in value:
-                for sub_attribute, sub_value in each.items():
-                    if sub_value:
-                        # Build a list of components to be enable in the app
-                        active_components.append(mutex_id_dict[sub_attribute])
+    index = mutex_index.get_index(file, "data")
+    active_components = get_active_flags(app_components, 'geo_location', index)
 
     if len(active_components) == 0:
         print("A configuration anomaly has been detected.")
@@ -350,24 +444,9 @@ def check_app_location_flags(app_components, flavour_name, file):
         raise ValueError('No geo-location mechanism enabled in targets file')
 
     # Check if any of the active components are in conflict with any of the other active components
-    for active_component in active_components:
-        mutexes = get_mutexes_by_id(active_component, file, "data")
-        for mutex in mutexes:
-            if mutex in active_components:
-                print("A configuration anomaly has been detected.")
-                print("Mutually exclusive build system flags have been enabled.")
-                message = "Check app variant {variant} for flags {bf_one} and {bf_two}"
-                build_flag_one = get_mutex_name_from_id(active_component,
-                                                        file,
-                                                        "data")
-                build_flag_two = get_mutex_name_from_id(mutex,
-                                                        file,
-                                                        "data")
-                message = message.format(variant=flavour_name,
-                                         bf_one=build_flag_one,
-                                         bf_two=build_flag_two)
-                print(message)
-                raise ValueError('Incompatible build configurations in targets file')
+    report_mutex_conflicts(index, active_components, "Mutually exclusive build system flags have been enabled.",
+                           "Check app variant {variant} for flags {bf_one} and {bf_two}",
+                           'Incompatible build configurations in targets file', variant=flavour_name)
     return active_components
 
 
@@ -378,16 +457,8 @@ def check_app_registration_flags(app_components, flavour_name, file):
     :param file: the file location where the mutexes are defined
     :return: nothing
     """
-    # Dictionary of mutexed feature names with associated ids
-    mutex_id_dict = get_build_config_mutex_id_dict(file, "data")
-    active_components = []
-    for attribute, value in app_components.items():
-        if attribute == 'registration':
-            for each in value:
-                for sub_attribute, sub_value in each.items():
-                    if sub_value:
-                        # Build a list of components to be enable in the app
-                        active_components.append(mutex_id_dict[sub_attribute])
+    index = mutex_index.get_index(file, "data")
+    active_components = get_active_flags(app_components, 'registration', index)
 
     if len(active_components) == 0:
         print("A configuration anomaly has been detected.")
@@ -398,24 +469,9 @@ def check_app_registration_flags(app_components, flavour_name, file):
         raise ValueError('No registration mechanism enabled in targets file')
 
     # Check if any of the active components are in conflict with any of the other active components
-    for active_component in active_components:
-        mutexes = get_mutexes_by_id(active_component, file, "data")
-        for mutex in mutexes:
-            if mutex in active_components:
-                print("A configuration anomaly has been detected.")
-                print("Mutually exclusive build system flags have been enabled.")
-                message = "Check app variant {variant} for flags {bf_one} and {bf_two}"
-                build_flag_one = get_mutex_name_from_id(active_component,
-                                                        file,
-                                                        "data")
-                build_flag_two = get_mutex_name_from_id(mutex,
-                                                        file,
-                                                        "data")
-                message = message.format(variant=flavour_name,
-                                         bf_one=build_flag_one,
-                                         bf_two=build_flag_two)
-                print(message)
-                raise ValueError('Incompatible build configurations in targets file')
+    report_mutex_conflicts(index, active_components, "Mutually exclusive build system flags have been enabled.",
+                           "Check app variant {variant} for flags {bf_one} and {bf_two}",
+                           'Incompatible build configurations in targets file', variant=flavour_name)
 
 
 def check_call_support_flags(app_components, flavour_name, call_support_strings_all_present):
@@ -0,0 +1,254 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+This file houses the stage dependency manifest used for incremental builds.
+
+Every stage of process_client declares its inputs: data.json sections, image files, density JSON files, templates and
+defaults directories. The manifest records a fingerprint of those inputs and the output files the stage produced. On
+the next run with INCREMENTAL_BUILD=1 a stage whose inputs are unchanged, and whose outputs are still on disk, is
+skipped. A stage that reruns first forces the stages it requires (stages whose in-memory side effects, such as Swift
+bookkeeping, it depends on) and removes its previous outputs. A change to the global inputs (generator sources,
+client, platform, defaults) turns the run into a full rebuild.
+"""
+import hashlib
+import json
+import os
+import shutil
+from collections import namedtuple
+
+import asset_gen_tools
+import render_cache
+from environmentals import get_environ_val_default
+
+INCREMENTAL_BUILD_KEY = 'INCREMENTAL_BUILD'
+MANIFEST_FILE = '.build_manifest.json'
+MANIFEST_VERSION = 1
+# top level output directories removed by finish(), never recorded as stage outputs
+TRANSIENT_PREFIX = 'temp_'
+
+INPUT_JSON = 'json'
+INPUT_ITEMS = 'items'
+INPUT_FILE = 'file'
+INPUT_DIR = 'dir'
+
+# inputs is a list of input specs, or None for a stage that always runs; requires names earlier stages
+Stage = namedtuple('Stage', ['name', 'action', 'inputs', 'requires'])
+
+
+def is_incremental():
+    """
+    :return: whether INCREMENTAL_BUILD is enabled
+    """
+    return get_environ_val_default(INCREMENTAL_BUILD_KEY, '0') == '1'
+
+
+def json_input(label, value):
+    """
+    :param label: name of the data section
+    :param value: json serialisable value of the section
+    :return: input spec
+    """
+    return INPUT_JSON, label, value
+
+
+def items_input(label, items):
+    """
+    :param label: name of the data section
+    :param items: callable returning an iterable of json serialisable values, hashed one at a time
+    :return: input spec
+    """
+    return INPUT_ITEMS, label, items
+
+
+def file_input(path):
+    """
+    :param path: path to an input file
+    :return: input spec
+    """
+    return INPUT_FILE, path, None
+
+
+def dir_input(path):
+    """
+    :param path: path to an input directory
+    :return: input spec
+    """
+    return INPUT_DIR, path, None
+
+
+def _hash_dir(path):
+    """
+    :param path: directory to fingerprint
+    :return: digest of the relative paths and contents of every file under path
+    """
+    sha = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for input_file in sorted(files):
+            file_path = os.path.join(root, input_file)
+            sha.update(os.path.relpath(file_path, path).encode('utf-8'))
+            sha.update(render_cache.hash_file(file_path).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def fingerprint(inputs):
+    """
+    :param inputs: list of input specs, None for a stage that always runs
+    :return: digest over every input, missing files and directories fingerprint as missing
+    """
+    if inputs is None:
+        return None
+    sha = hashlib.sha256()
+    for kind, label, value in inputs:
+        if kind == INPUT_JSON:
+            digest = hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        elif kind == INPUT_ITEMS:
+            item_sha = hashlib.sha256()
+            for item in value() or []:
+                item_sha.update(json.dumps(item, sort_keys=True, default=str).encode('utf-8'))
+                item_sha.update(b'\n')
+            digest = item_sha.hexdigest()
+        elif kind == INPUT_FILE:
+            digest = render_cache.hash_file(label) if os.path.isfile(label) else 'missing'
+        else:
+            digest = _hash_dir(label) if os.path.isdir(label) else 'missing'
+        sha.update('{kind}:{label}={digest}\n'.format(kind=kind, label=label, digest=digest).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def snapshot(path):
+    """
+    :param path: output directory
+    :return: dict of relative file path -> (size, modification time)
+    """
+    files = {}
+    for root, _, names in os.walk(path):
+        for name in names:
+            file_path = os.path.join(root, name)
+            relative = os.path.relpath(file_path, path)
+            if relative == MANIFEST_FILE or relative.startswith(TRANSIENT_PREFIX):
+                continue
+            stat = os.stat(file_path)
+            files[relative] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+class BuildManifest:
+    """
+    A class used to decide which stages of process_client need to run, and to record what they produced.
+
+    Methods
+    -------
+    run_stages(stages, settle)
+        Runs the dirty stages in order, skips the clean ones, and saves the manifest.
+    """
+    def __init__(self, output_dir, global_inputs):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_FILE)
+        self.global_fingerprint = fingerprint(global_inputs)
+        self.stages = {}
+        previous = self._load()
+        if previous.get('global') == self.global_fingerprint:
+            self.stages = previous.get('stages', {})
+        elif os.path.isdir(output_dir):
+            print('Incremental build: global inputs changed, full rebuild')
+            shutil.rmtree(output_dir, True)
+
+    def _load(self):
+        """
+        :return: the previous manifest, empty when absent, unreadable or of another version
+        """
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            previous = json.loads(asset_gen_tools.read(self.path))
+        except ValueError:
+            return {}
+        if previous.get('version') != MANIFEST_VERSION:
+            return {}
+        return previous
+
+    def _is_clean(self, name, input_fingerprint):
+        """
+        :param name: stage name
+        :param input_fingerprint: fingerprint of the stage inputs for this run
+        :return: whether the recorded stage matches and all of its outputs are still present
+        """
+        record = self.stages.get(name)
+        if input_fingerprint is None or record is None or record.get('inputs') != input_fingerprint:
+            return False
+        for relative, size in record.get('outputs', {}).items():
+            output_path = os.path.join(self.output_dir, relative)
+            if not os.path.isfile(output_path) or os.path.getsize(output_path) != size:
+                return False
+        return True
+
+    def _remove_outputs(self, name):
+        """
+        :param name: stage name
+        :return: nothing, removes the outputs recorded for the stage by the previous run
+        """
+        for relative in self.stages.get(name, {}).get('outputs', {}):
+            output_path = os.path.join(self.output_dir, relative)
+            if os.path.isfile(output_path):
+                os.remove(output_path)
+
+    def run_stages(self, stages, settle):
+        """
+        :param stages: list of Stage, in execution order
+        :param settle: callable without arguments, waits until the outputs of a stage are on disk
+        :return: nothing
+        """
+        fingerprints = dict((stage.name, fingerprint(stage.inputs)) for stage in stages)
+        dirty = set(stage.name for stage in stages if not self._is_clean(stage.name, fingerprints[stage.name]))
+
+        # a rerun stage needs the side effects of the stages it requires
+        changed = True
+        while changed:
+            changed = False
+            for stage in stages:
+                if stage.name in dirty:
+                    for required in stage.requires:
+                        if required not in dirty:
+                            dirty.add(required)
+                            changed = True
+
+        for stage in stages:
+            if stage.name not in dirty:
+                print('Incremental build: skipping {0}, inputs unchanged'.format(stage.name))
+                continue
+            self._remove_outputs(stage.name)
+            before = snapshot(self.output_dir)
+            stage.action()
+            settle()
+            after = snapshot(self.output_dir)
+            outputs = dict((relative, stat[0]) for relative, stat in after.items() if before.get(relative) != stat)
+            # an output rewritten by this stage now belongs to it
+            for record in self.stages.values():
+                for relative in outputs:
+                    record.get('outputs', {}).pop(relative, None)
+            self.stages[stage.name] = {'inputs': fingerprints[stage.name], 'outputs': outputs}
+            self._save()
+
+    def _save(self):
+        """
+        :return: nothing
+        """
+        output = json.dumps({'version': MANIFEST_VERSION, 'global': self.global_fingerprint, 'stages': self.stages},
+                            indent=2, sort_keys=True)
+        asset_gen_tools.save(self.path, output)
+
+
+def run_stages(stages, settle, output_dir, global_inputs):
+    """
+    :param stages: list of Stage, in execution order
+    :param settle: callable without arguments, waits until the outputs of a stage are on disk
+    :param output_dir: directory holding every stage output and the manifest
+    :param global_inputs: input specs shared by every stage, a change rebuilds everything
+    :return: nothing
+    """
+    if not is_incremental():
+        for stage in stages:
+            stage.action()
+        return
+    BuildManifest(output_dir, global_inputs).run_stages(stages, settle)
@@ -3,13 +3,26 @@ Author/Engineer: Lerato Mokoena
 
 This file houses the code class ClientData, and its purpose is to convert client input from Excel format into usable
 data structures for white-labelling apps.
+
+The workbook is opened in read-only (streaming) mode and every sheet is walked exactly once, row by row, filling all
+language columns together, so peak memory is one row of cells plus the values collected. The getters return the same
+structures as the JSON ClientData (client_data_json), strings and faqs as generators of one language at a time. The
+parsed form is kept in a client_snapshot next to the workbook, a later run of the same workbook loads it instead of
+opening the workbook.
 """
 import openpyxl
 
+import client_snapshot
+import translation_table
+
 STRINGS_SHEET = 'text'
 FAQS_SHEET = 'faqs'
 COLORS_SHEET = 'colors'
 
+# bump whenever the parsed form changes, snapshots of older versions are then parsed again
+LOADER_NAME = 'xlsx'
+LOADER_VERSION = 1
+
 
 class ClientData:
     """
@@ -22,32 +35,64 @@ class ClientData:
     Methods
     -------
     get_strings()
-        getter that returns the client strings loaded from workbook in __init__
+        generator of the client strings loaded from workbook in __init__, one language at a time
+    get_translations()
+        the client strings of every language as one TranslationTable
     get_faqs()
-        getter that returns the client faqs loaded from workbook in __init__
+        generator of the client faqs loaded from workbook in __init__, one language at a time
     get_colors()
         getter that returns the client colors loaded from workbook in __init__
     get_name()
         getter that returns the name we use for the client
+    get_version()
+        the workbook carries no version, always None
+    get_image_types()
+        the workbook carries no image types, always empty
     """
     def __init__(self, path_to_file, client):
-        workbook = openpyxl.load_workbook(path_to_file)
-        self.strings = _load_strings(workbook, client)
-        self.faqs = _load_faqs(workbook, client)
-        self.colors = _load_colors(workbook, client)
         self.name = client
+        # versions and image types are only given in data.json
+        self.version = None
+        self.image_types = {}
+        state = client_snapshot.load(path_to_file, LOADER_NAME, LOADER_VERSION)
+        if state is not None:
+            self.version = state[client_snapshot.STATE_VERSION]
+            self.image_types = state[client_snapshot.STATE_IMAGE_TYPES]
+            self.colors = state[client_snapshot.STATE_COLORS]
+            self.translations = translation_table.from_state(state[client_snapshot.STATE_TRANSLATIONS])
+            self.faqs = state[client_snapshot.STATE_FAQS]
+            print('Loaded snapshot of workbook: "{0}"'.format(path_to_file))
+            return
+
+        workbook = openpyxl.load_workbook(path_to_file, read_only=True, data_only=True)
+        try:
+            self.translations = translation_table.from_localised(_load_strings(workbook, client))
+            self.faqs = _load_faqs(workbook, client)
+            self.colors = _load_colors(workbook, client)
+        finally:
+            # read-only workbooks keep the file open until closed
+            workbook.close()
+        client_snapshot.save(path_to_file, LOADER_NAME, LOADER_VERSION,
+                             client_snapshot.make_state(self.version, self.image_types, self.colors,
+                                                        self.translations, self.faqs))
 
     def get_strings(self):
         """
-        :return: localisation strings
+        :return: generator of (language, [(name, text)], is default) per language, None when there is no text sheet
+        """
+        return self.translations.localised() if self.translations is not None else None
+
+    def get_translations(self):
+        """
+        :return: TranslationTable of the strings of every language, None when there is no text sheet
         """
-        return self.strings
+        return self.translations
 
     def get_faqs(self):
         """
-        :return: client frequently asked questions
+        :return: generator of (language, [(title, text)], is default) per language, None when there is no faqs sheet
         """
-        return self.faqs
+        return iter(self.faqs) if self.faqs is not None else None
 
     def get_colors(self):
         """
@@ -61,6 +106,27 @@ class ClientData:
         """
         return self.name
 
+    def get_version(self):
+        """
+        :return: None, versions are only given in data.json
+        """
+        return self.version
+
+    def get_image_types(self):
+        """
+        :return: empty dictionary, image types are only given in data.json
+        """
+        return self.image_types
+
+
+def _cell(row, column):
+    """
+    :param row: tuple of cell values
+    :param column: column index
+    :return: value of the column, None past the end of a short row
+    """
+    return row[column] if column < len(row) else None
+
 
 def _load_strings(workbook, client):
     """
@@ -72,20 +138,18 @@ def _load_strings(workbook, client):
         print('No sheet named "{0}" was found, strings files not created for "{1}"'.format(STRINGS_SHEET, client))
         return None
 
-    sheet = workbook.get_sheet_by_name(STRINGS_SHEET)
-
-    localised_strings = []
-    for i in range(1, len(sheet.rows[0])):
-        lang = sheet.rows[0][i].value
-
-        strings_list = []
-        for row in sheet.rows[1:]:
-            name = row[0].value
-            if name is not None:
-                text = row[i].value.strip() if row[i].value is not None else ''
-                strings_list.append((name, text))
-        localised_strings.append((lang, strings_list, i == 1))
-    return localised_strings
+    rows = workbook[STRINGS_SHEET].iter_rows(values_only=True)
+    header = next(rows, ())
+    languages = list(header[1:])
+    strings_lists = [[] for _ in languages]
+    for row in rows:
+        name = _cell(row, 0)
+        if name is None:
+            continue
+        for i, strings_list in enumerate(strings_lists, 1):
+            text = _cell(row, i)
+            strings_list.append((name, text.strip() if text is not None else ''))
+    return [(lang, strings_list, i == 1) for i, (lang, strings_list) in enumerate(zip(languages, strings_lists), 1)]
 
 
 def _load_faqs(workbook, client):
@@ -98,26 +162,33 @@ def _load_faqs(workbook, client):
         print('No sheet named "{0}" was found, faq files not created for "{1}"'.format(FAQS_SHEET, client))
         return None
 
-    sheet = workbook.get_sheet_by_name(FAQS_SHEET)
-
-    localised_faqs = []
-    for i in range(1, len(sheet.rows[0])):
-        lang = sheet.rows[0][i].value
+    rows = workbook[FAQS_SHEET].iter_rows(values_only=True)
+    header = next(rows, ())
+    # languages end at the first empty header cell
+    languages = []
+    for lang in header[1:]:
         if lang is None:
             break
-
-        rows = sheet.rows[1:]
-
-        faqs_list = []
-        for j in range(0, len(rows), 2):
-            if rows[j][i].value is None:
+        languages.append(lang)
+
+    # rows come in question/answer pairs, a language ends at its first empty question
+    faqs_lists = [[] for _ in languages]
+    open_columns = set(range(1, len(languages) + 1))
+    question_row = None
+    for row in rows:
+        if question_row is None:
+            question_row = row
+            for i in list(open_columns):
+                if _cell(question_row, i) is None:
+                    open_columns.discard(i)
+            if len(open_columns) == 0:
                 break
-
-            text = rows[j + 1][i].value.replace('\n', '\\n')
-            faqs_list.append((rows[j][i].value, text))
-
-        localised_faqs.append((lang, faqs_list, i == 1))
-    return localised_faqs
+            continue
+        for i in open_columns:
+            text = _cell(row, i).replace('\n', '\\n')
+            faqs_lists[i - 1].append((_cell(question_row, i), text))
+        question_row = None
+    return [(lang, faqs_list, i == 1) for i, (lang, faqs_list) in enumerate(zip(languages, faqs_lists), 1)]
 
 
 def _load_colors(workbook, client):
@@ -130,12 +201,10 @@ def _load_colors(workbook, client):
         print('No sheet named "{0}" was found, colors files not created for "{1}"'.format(COLORS_SHEET, client))
         return None
 
-    sheet = workbook.get_sheet_by_name(COLORS_SHEET)
-
     colors = {}
-    for row in sheet.rows:
-        name = row[0].value
+    for row in workbook[COLORS_SHEET].iter_rows(values_only=True):
+        name = _cell(row, 0)
         if name is not None:
-            text = row[1].value if row[1].value is not None else ''
-            colors[name] = text
+            text = _cell(row, 1)
+            colors[name] = text if text is not None else ''
     return colors
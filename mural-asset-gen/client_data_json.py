@@ -3,8 +3,24 @@ Author/Engineer: Lerato Mokoena
 
 This file houses the code class ClientData, and its purpose is to convert client input from JSON format into usable
 data structures for white-labelling apps.
+
+The document is scanned once, straight from a read-only memory map, without building it: the scan only records where
+each top-level section and, for every language, the strings and faqs sections sit in the file. The small sections
+(version, colors, image types, language codes) are decoded right away, the rest from its byte range on demand, and
+the file is never open between reads. The faqs of a language are decoded when get_faqs() reaches that language, so
+only one language of faqs is held at a time. The strings of every language are decoded together on the first
+get_strings()/get_translations() call into one compact TranslationTable, kept for the stages. With CLIENT_SNAPSHOT=1
+(off by default for data.json, see client_snapshot) the parsed form is kept in a snapshot next to data.json, which
+decodes every language when it is written and loads them all when it is restored.
 """
 import json
+import mmap
+import os
+import re
+from collections import namedtuple
+
+import client_snapshot
+import translation_table
 
 VERSION_KEY = 'version'
 LANGUAGES_KEY = 'languages'
@@ -17,6 +33,21 @@ FAQ_TEXT_KEY = 'answer'
 COLORS_KEY = 'app_colors'
 IMAGES_TYPE_KEY = 'app_images'
 
+# bump whenever the parsed form changes, snapshots of older versions are then parsed again
+LOADER_NAME = 'json'
+LOADER_VERSION = 1
+
+WHITESPACE = re.compile(rb'[ \t\r\n]*')
+STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+SCALAR = re.compile(rb'-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?|true|false|null')
+# strings are matched whole so the brackets inside them are skipped
+CONTAINER_TOKEN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}]', re.DOTALL)
+OPENERS = (ord('['), ord('{'))
+CLOSERS = (ord(']'), ord('}'))
+
+# language code, and section key -> (start, end) byte range of the sections of that language
+LanguageSection = namedtuple('LanguageSection', ['language', 'spans'])
+
 
 class ClientData:
     """
@@ -29,9 +60,11 @@ class ClientData:
     Methods
     -------
     get_strings()
-        getter that returns the client strings loaded from JSON in __init__
+        generator of the client strings, one language at a time
+    get_translations()
+        the client strings of every language as one TranslationTable
     get_faqs()
-        getter that returns the client faqs loaded from JSON in __init__
+        generator of the client faqs, one language at a time
     get_colors()
         getter that returns the client colors loaded from JSON in __init__
     get_name()
@@ -43,27 +76,60 @@ class ClientData:
         getter that returns the image types loaded from JSON in __init__
     """
     def __init__(self, path_to_file, client):
-        file_pointer = open(path_to_file)
-        dict_json = json.load(file_pointer)
-        print('Loaded JSON from file: "{0}"'.format(path_to_file))
-        self.version = dict_json[VERSION_KEY]
-        self.strings = _load_strings(dict_json, client)
-        self.faqs = _load_faqs(dict_json, client)
-        self.colors = _load_colors(dict_json, client)
+        self.path = path_to_file
         self.name = client
-        self.image_types = dict_json[IMAGES_TYPE_KEY]
+        self.translations = None
+        self.faqs = None
+        state = client_snapshot.load(path_to_file, LOADER_NAME, LOADER_VERSION)
+        if state is not None:
+            self._restore(state)
+            print('Loaded snapshot of file: "{0}"'.format(path_to_file))
+            self._report_missing_languages()
+            return
+        with open(path_to_file, 'rb') as file_pointer:
+            stat = os.fstat(file_pointer.fileno())
+            if stat.st_size == 0:
+                raise ValueError('{0} is empty'.format(path_to_file))
+            self.stamp = (stat.st_mtime_ns, stat.st_size)
+            with mmap.mmap(file_pointer.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                spans, _ = _object_spans(buffer, _skip_whitespace(buffer, 0))
+                self.version = _decode(buffer, spans[VERSION_KEY])
+                self.image_types = _decode(buffer, spans[IMAGES_TYPE_KEY])
+                self.colors = _load_colors(_decode(buffer, spans[COLORS_KEY]), client)
+                self.languages = _index_languages(buffer, spans[LANGUAGES_KEY])
+                self.default_lang = _decode(buffer, spans[DEFAULT_LANG_KEY]) if self.languages is not None else None
+        print('Loaded JSON from file: "{0}"'.format(path_to_file))
+        self._report_missing_languages()
+        if client_snapshot.use_snapshots(LOADER_NAME):
+            client_snapshot.save(path_to_file, LOADER_NAME, LOADER_VERSION, self._capture())
 
     def get_strings(self):
         """
-        :return: localisation strings
+        :return: generator of (language, [(name, text)], is default) per language, None when there are no languages
         """
-        return self.strings
+        translations = self.get_translations()
+        return translations.localised() if translations is not None else None
+
+    def get_translations(self):
+        """
+        :return: TranslationTable of the strings of every language, built on first use, None when there are none
+        """
+        if self.translations is None and self.languages is not None:
+            self.translations = translation_table.from_localised(
+                _load_strings(self._read(section, STRINGS_KEY), section.language, self.default_lang)
+                for section in self.languages)
+        return self.translations
 
     def get_faqs(self):
         """
-        :return: client frequently asked questions
+        :return: generator of (language, [(title, text)], is default) per language, None when there are no languages
         """
-        return self.faqs
+        if self.faqs is not None:
+            return iter(self.faqs)
+        if self.languages is None:
+            return None
+        return (_load_faqs(self._read(section, FAQS_KEY), section.language, self.default_lang)
+                for section in self.languages)
 
     def get_colors(self):
         """
@@ -89,66 +155,222 @@ class ClientData:
         """
         return self.image_types
 
+    def _report_missing_languages(self):
+        """
+        :return: nothing, reports once at load time, so the getters stay silent when the build manifest calls them
+        """
+        if self.languages is None and self.translations is None:
+            print('No key named "{0}" was found, strings files not created for "{1}"'.format(LANGUAGES_KEY, self.name))
+        if self.languages is None and self.faqs is None:
+            print('No key named "{0}" was found, faq files not created for "{1}"'.format(LANGUAGES_KEY, self.name))
+
+    def _capture(self):
+        """
+        :return: the client_snapshot state of the whole document, every language decoded
+        """
+        faqs = None
+        if self.languages is not None:
+            faqs = [_load_faqs(self._read(section, FAQS_KEY), section.language, self.default_lang)
+                    for section in self.languages]
+        return client_snapshot.make_state(self.version, self.image_types, self.colors, self.get_translations(), faqs)
 
-def _load_strings(dict_json, client):
+    def _restore(self, state):
+        """
+        :param state: client_snapshot state, written by either loader
+        :return: nothing
+        """
+        self.version = state[client_snapshot.STATE_VERSION]
+        self.image_types = state[client_snapshot.STATE_IMAGE_TYPES]
+        self.colors = state[client_snapshot.STATE_COLORS]
+        self.translations = translation_table.from_state(state[client_snapshot.STATE_TRANSLATIONS])
+        self.faqs = state[client_snapshot.STATE_FAQS]
+        self.languages = None
+        self.default_lang = None
+
+    def _read(self, section, key):
+        """
+        :param section: LanguageSection of the language
+        :param key: section key, STRINGS_KEY or FAQS_KEY
+        :return: the decoded section of the language
+        """
+        start, end = section.spans[key]
+        with open(self.path, 'rb') as file_pointer:
+            stat = os.fstat(file_pointer.fileno())
+            if (stat.st_mtime_ns, stat.st_size) != self.stamp:
+                raise RuntimeError('{0} changed after it was loaded'.format(self.path))
+            file_pointer.seek(start)
+            return json.loads(file_pointer.read(end - start))
+
+
+def _skip_whitespace(buffer, position):
     """
-    :param dict_json: the dictionary where the strings are located
-    :param client: the client
-    :return: the localised strings
+    :param buffer: the document
+    :param position: byte offset
+    :return: offset of the first non-whitespace byte at or after position
     """
-    if dict_json[LANGUAGES_KEY] is None:
-        print('No key named "{0}" was found, strings files not created for "{1}"'.format(LANGUAGES_KEY, client))
-        return None
+    return WHITESPACE.match(buffer, position).end()
 
-    localised_strings = []
-    default_lang = dict_json[DEFAULT_LANG_KEY]
-    for language_entry in dict_json[LANGUAGES_KEY]:
-        lang = language_entry[LANGUAGE_KEY]
-        strings_list = []
-        for name, text in language_entry[STRINGS_KEY].items():
-            text = text.strip() if text is not None else ''
-            strings_list.append((name, text))
-        localised_strings.append((lang, strings_list, default_lang == lang))
-    return localised_strings
 
+def _syntax_error(buffer, position, expected):
+    """
+    :param buffer: the document
+    :param position: byte offset of the problem
+    :param expected: what was expected there
+    :return: ValueError to raise
+    """
+    found = buffer[position:position + 20]
+    return ValueError('Malformed JSON at byte {0}: expected {1}, found {2!r}'.format(position, expected, found))
 
-def _load_faqs(dict_json, client):
+
+def _value_end(buffer, position):
     """
-    :param dict_json: the dictionary where the faqs are located
-    :param client: the client
-    :return: the localised faqs
+    :param buffer: the document
+    :param position: byte offset of a value
+    :return: offset just past the value, nested values are skipped without being decoded
+    """
+    first = buffer[position:position + 1]
+    if first == b'"':
+        match = STRING.match(buffer, position)
+    elif first in (b'[', b'{'):
+        depth = 0
+        for match in CONTAINER_TOKEN.finditer(buffer, position):
+            token = buffer[match.start()]
+            if token in OPENERS:
+                depth += 1
+            elif token in CLOSERS:
+                depth -= 1
+                if depth == 0:
+                    return match.end()
+        raise _syntax_error(buffer, position, 'a closed array or object')
+    else:
+        match = SCALAR.match(buffer, position)
+    if match is None:
+        raise _syntax_error(buffer, position, 'a value')
+    return match.end()
+
+
+def _object_spans(buffer, position):
+    """
+    :param buffer: the document
+    :param position: byte offset of an object
+    :return: (dict of key -> (start, end) of its value, offset just past the object)
+    """
+    if buffer[position:position + 1] != b'{':
+        raise _syntax_error(buffer, position, 'an object')
+    spans = {}
+    position = _skip_whitespace(buffer, position + 1)
+    if buffer[position:position + 1] == b'}':
+        return spans, position + 1
+    while True:
+        match = STRING.match(buffer, position)
+        if match is None:
+            raise _syntax_error(buffer, position, 'a key')
+        key = json.loads(buffer[match.start():match.end()])
+        position = _skip_whitespace(buffer, match.end())
+        if buffer[position:position + 1] != b':':
+            raise _syntax_error(buffer, position, '":"')
+        start = _skip_whitespace(buffer, position + 1)
+        end = _value_end(buffer, start)
+        spans[key] = (start, end)
+        position = _skip_whitespace(buffer, end)
+        separator = buffer[position:position + 1]
+        if separator == b'}':
+            return spans, position + 1
+        if separator != b',':
+            raise _syntax_error(buffer, position, '"," or "}"')
+        position = _skip_whitespace(buffer, position + 1)
+
+
+def _array_spans(buffer, position):
+    """
+    :param buffer: the document
+    :param position: byte offset of an array
+    :return: list of (start, end) of its elements
+    """
+    if buffer[position:position + 1] != b'[':
+        raise _syntax_error(buffer, position, 'an array')
+    spans = []
+    position = _skip_whitespace(buffer, position + 1)
+    if buffer[position:position + 1] == b']':
+        return spans
+    while True:
+        end = _value_end(buffer, position)
+        spans.append((position, end))
+        position = _skip_whitespace(buffer, end)
+        separator = buffer[position:position + 1]
+        if separator == b']':
+            return spans
+        if separator != b',':
+            raise _syntax_error(buffer, position, '"," or "]"')
+        position = _skip_whitespace(buffer, position + 1)
+
+
+def _decode(buffer, span):
     """
-    if dict_json[LANGUAGES_KEY] is None:
-        print('No key named "{0}" was found, faq files not created for "{1}"'.format(LANGUAGES_KEY, client))
+    :param buffer: the document
+    :param span: (start, end) of a value
+    :return: the decoded value
+    """
+    return json.loads(buffer[span[0]:span[1]])
+
+
+def _index_languages(buffer, span):
+    """
+    :param buffer: the document
+    :param span: (start, end) of the languages value
+    :return: list of LanguageSection in document order, None when languages is null
+    """
+    if buffer[span[0]:span[1]] == b'null':
         return None
+    sections = []
+    for start, _ in _array_spans(buffer, span[0]):
+        spans, _ = _object_spans(buffer, start)
+        sections.append(LanguageSection(_decode(buffer, spans[LANGUAGE_KEY]), spans))
+    return sections
+
 
-    localised_faqs = []
-    default_lang = dict_json[DEFAULT_LANG_KEY]
-    for language_entry in dict_json[LANGUAGES_KEY]:
-        lang = language_entry[LANGUAGE_KEY]
-        faqs_list = []
-        for faq_entry in language_entry[FAQS_KEY]:
-            if faq_entry[FAQ_TITLE_KEY] is None:
-                break
-            title = faq_entry[FAQ_TITLE_KEY].strip()
-            text = faq_entry[FAQ_TEXT_KEY]
-            faqs_list.append((title, text))
-        localised_faqs.append((lang, faqs_list, default_lang == lang))
-    return localised_faqs
+def _load_strings(app_strings, lang, default_lang):
+    """
+    :param app_strings: the decoded strings of one language
+    :param lang: the language
+    :param default_lang: the default language of the client
+    :return: the localised strings of the language
+    """
+    strings_list = []
+    for name, text in app_strings.items():
+        text = text.strip() if text is not None else ''
+        strings_list.append((name, text))
+    return lang, strings_list, default_lang == lang
+
+
+def _load_faqs(faqs, lang, default_lang):
+    """
+    :param faqs: the decoded faqs of one language
+    :param lang: the language
+    :param default_lang: the default language of the client
+    :return: the localised faqs of the language
+    """
+    faqs_list = []
+    for faq_entry in faqs:
+        if faq_entry[FAQ_TITLE_KEY] is None:
+            break
+        title = faq_entry[FAQ_TITLE_KEY].strip()
+        text = faq_entry[FAQ_TEXT_KEY]
+        faqs_list.append((title, text))
+    return lang, faqs_list, default_lang == lang
 
 
-def _load_colors(dict_json, client):
+def _load_colors(color_entry, client):
     """
-    :param dict_json: the dictionary where the colors are located
+    :param color_entry: the decoded colors section
     :param client: the client
     :return: the color schemes of the app
     """
-    if dict_json[COLORS_KEY] is None:
+    if color_entry is None:
         print('No key named "{0}" was found, color files not created for "{1}"'.format(COLORS_KEY, client))
         return None
 
     colors = {}
-    color_entry = dict_json[COLORS_KEY]
     for name, text in color_entry.items():
         if name is not None:
             text = text if text is not None else ''
@@ -0,0 +1,144 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+This file houses the binary snapshot cache of parsed client data.
+
+After a ClientData loader has parsed data.json or the client workbook it writes the parsed form next to the input
+(<input>.snapshot). The next run of the same client (another flavour, another platform) loads the snapshot instead of
+parsing the input again. Both loaders write the same state (version, image types, colors, the translation table and
+the faqs), so the rest of the generator cannot tell a snapshot from a fresh parse.
+
+A snapshot file is the SNAPSHOT_MAGIC, the SNAPSHOT_SCHEMA of its layout, its key and a marshal payload. The key holds
+the content hash of the input, the loader and its version, and the marshal/array formats of the interpreter. A
+snapshot whose schema or key does not match, or that cannot be read, is ignored and written again.
+
+CLIENT_SNAPSHOT=1 turns snapshots on for both loaders and CLIENT_SNAPSHOT=0 turns them off. When it is not set they are
+only used for workbooks (SNAPSHOT_BY_DEFAULT), where they replace seconds of openpyxl parsing. The data.json loader
+scans the document and decodes one language at a time, while writing a snapshot decodes every language up front and
+restoring one loads every language into memory, so for data.json a snapshot trades memory for a parse that is
+already cheap.
+"""
+import json
+import marshal
+import os
+import struct
+import sys
+import threading
+from array import array
+
+import render_cache
+from environmentals import get_environ_val_default
+
+CLIENT_SNAPSHOT_KEY = 'CLIENT_SNAPSHOT'
+SNAPSHOT_SUFFIX = '.snapshot'
+SNAPSHOT_MAGIC = b'MURALCD\x00'
+# bump when the layout of the state changes, older snapshots are then parsed again
+SNAPSHOT_SCHEMA = 1
+# schema, key length
+HEADER = struct.Struct('<HI')
+
+# loaders that snapshot when CLIENT_SNAPSHOT is not set
+SNAPSHOT_BY_DEFAULT = ('xlsx',)
+
+STATE_VERSION = 'version'
+STATE_IMAGE_TYPES = 'image_types'
+STATE_COLORS = 'colors'
+STATE_TRANSLATIONS = 'translations'
+STATE_FAQS = 'faqs'
+
+
+def make_state(version, image_types, colors, translations, faqs):
+    """
+    :param version: version of the client data, None when the input has none
+    :param image_types: client image name -> type
+    :param colors: client color name -> color code, None when the input has none
+    :param translations: TranslationTable of the strings, None when the input has none
+    :param faqs: list of (language, [(title, text)], is default), None when the input has none
+    :return: the snapshot state
+    """
+    return {STATE_VERSION: version, STATE_IMAGE_TYPES: image_types, STATE_COLORS: colors,
+            STATE_TRANSLATIONS: translations.to_state() if translations is not None else None, STATE_FAQS: faqs}
+
+
+def use_snapshots(loader):
+    """
+    :param loader: name of the loader
+    :return: whether CLIENT_SNAPSHOT is enabled for the loader, see SNAPSHOT_BY_DEFAULT when it is not set
+    """
+    default = '1' if loader in SNAPSHOT_BY_DEFAULT else '0'
+    return get_environ_val_default(CLIENT_SNAPSHOT_KEY, default) == '1'
+
+
+def snapshot_path(input_path):
+    """
+    :param input_path: data.json or client workbook
+    :return: path of its snapshot
+    """
+    return input_path + SNAPSHOT_SUFFIX
+
+
+def snapshot_key(input_path, loader, loader_version):
+    """
+    :param input_path: data.json or client workbook
+    :param loader: name of the loader that parsed the input
+    :param loader_version: version of that loader, bumped whenever its output changes
+    :return: key bytes, any change to the input, the loader or the interpreter formats changes it
+    """
+    return json.dumps({'hash': render_cache.hash_file(input_path), 'loader': loader, 'loader_version': loader_version,
+                       'marshal': marshal.version, 'python': list(sys.version_info[:2]), 'byteorder': sys.byteorder,
+                       'itemsize': array('I').itemsize}, sort_keys=True).encode('utf-8')
+
+
+def load(input_path, loader, loader_version):
+    """
+    :param input_path: data.json or client workbook
+    :param loader: name of the loader
+    :param loader_version: version of the loader
+    :return: the snapshot state, None when there is no valid snapshot
+    """
+    path = snapshot_path(input_path)
+    if not use_snapshots(loader) or not os.path.isfile(path):
+        return None
+    key = snapshot_key(input_path, loader, loader_version)
+    try:
+        with open(path, 'rb') as snapshot_file:
+            if snapshot_file.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                return None
+            header = snapshot_file.read(HEADER.size)
+            if len(header) != HEADER.size:
+                return None
+            schema, key_length = HEADER.unpack(header)
+            # the schema is checked before anything else is read, a different layout is never decoded
+            if schema != SNAPSHOT_SCHEMA or snapshot_file.read(key_length) != key:
+                return None
+            state = marshal.loads(snapshot_file.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        print('Ignoring unreadable snapshot {0}'.format(path))
+        return None
+    return state if isinstance(state, dict) else None
+
+
+def save(input_path, loader, loader_version, state):
+    """
+    :param input_path: data.json or client workbook
+    :param loader: name of the loader
+    :param loader_version: version of the loader
+    :param state: dictionary of builtin values, see the STATE_ keys
+    :return: nothing, a snapshot that cannot be written only costs the next run a parse
+    """
+    if not use_snapshots(loader):
+        return
+    path = snapshot_path(input_path)
+    key = snapshot_key(input_path, loader, loader_version)
+    temp_path = '{path}.{pid}.{thread}.tmp'.format(path=path, pid=os.getpid(), thread=threading.get_ident())
+    try:
+        with open(temp_path, 'wb') as snapshot_file:
+            snapshot_file.write(SNAPSHOT_MAGIC)
+            snapshot_file.write(HEADER.pack(SNAPSHOT_SCHEMA, len(key)))
+            snapshot_file.write(key)
+            snapshot_file.write(marshal.dumps(state))
+        os.replace(temp_path, path)
+    except OSError as error:
+        print('Could not write snapshot {path}: {error}'.format(path=path, error=error))
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
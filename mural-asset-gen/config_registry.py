@@ -0,0 +1,116 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+This file houses the process-wide registry of the json configuration files (densities, mutexes, reserved words, ...).
+
+Each file is parsed once and handed out as an immutable view: lists become tuples and dictionaries read-only
+mappings, so one caller cannot change what the next one reads. Every lookup checks the modification time and size of
+the file and parses it again only when it has changed. The number of parses per file is printed at the end of the
+run, a file parsed more than once was rewritten while the run was going.
+"""
+import json
+import os
+import threading
+from types import MappingProxyType
+
+_REGISTRY = None
+_REGISTRY_LOCK = threading.Lock()
+
+
+def freeze(value):
+    """
+    :param value: parsed json value
+    :return: the value with lists turned into tuples and dictionaries into read-only mappings, recursively
+    """
+    if isinstance(value, dict):
+        return MappingProxyType(dict((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def file_stamp(path):
+    """
+    :param path: configuration file
+    :return: (modification time, size) of the file
+    """
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ConfigRegistry:
+    """
+    A class used to hold the parsed configuration files of the run.
+
+    Attributes
+    ----------
+    entries : dict
+        absolute path -> (stamp, frozen contents)
+    loads : dict
+        absolute path -> number of times the file was parsed
+    hits : int
+        number of lookups answered without parsing
+
+    Methods
+    -------
+    get(path, data_tag)
+        Immutable view of a tag of a configuration file.
+    report()
+        Prints the parse count of every file.
+    """
+    def __init__(self):
+        self.entries = {}
+        self.loads = {}
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def get(self, path, data_tag):
+        """
+        :param path: configuration file, relative to the working directory
+        :param data_tag: root tag to return
+        :return: immutable view of the tag
+        """
+        key = os.path.abspath(path)
+        stamp = file_stamp(key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.hits += 1
+                return entry[1][data_tag]
+            with open(key, "r") as input_file:
+                contents = freeze(json.load(input_file))
+            self.entries[key] = (stamp, contents)
+            self.loads[key] = self.loads.get(key, 0) + 1
+            return contents[data_tag]
+
+    def report(self):
+        """
+        :return: nothing
+        """
+        if len(self.loads) == 0:
+            return
+        reloaded = ['{0} ({1})'.format(os.path.relpath(path), count)
+                    for path, count in sorted(self.loads.items()) if count > 1]
+        print('Config files: {files} parsed, {hits} lookups from memory'.format(files=len(self.loads),
+                                                                              hits=self.hits))
+        if len(reloaded) > 0:
+            print('Config files changed during the run and parsed again: ' + ', '.join(reloaded))
+
+
+def get_registry():
+    """
+    :return: the process-wide configuration registry
+    """
+    global _REGISTRY
+    with _REGISTRY_LOCK:
+        if _REGISTRY is None:
+            _REGISTRY = ConfigRegistry()
+        return _REGISTRY
+
+
+def report_configs():
+    """
+    :return: nothing
+    """
+    if _REGISTRY is not None:
+        _REGISTRY.report()
@@ -13,3 +13,13 @@ def get_environ_val(key):
     :return: the value stored under that key
     """
     return os.environ[key]
+
+
+def get_environ_val_default(key, default):
+    """
+    :param key: the key to look up in environment
+    :param default: value returned when the key is not set or blank (docker passes unset -e variables as blank)
+    :return: the value stored under that key, or the default
+    """
+    value = os.environ.get(key, '')
+    return value if value.strip() != '' else default
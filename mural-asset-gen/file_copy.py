@@ -0,0 +1,167 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+This file houses the file copy layer used for the defaults tree, rendered images and cache entries.
+
+A copy tries the strategies configured in COPY_STRATEGIES, in order (default reflink,hardlink,kernel,buffered):
+    reflink   copy-on-write clone of the extents (FICLONE, btrfs/xfs/overlayfs on such), no bytes moved
+    hardlink  only for immutable build artifacts (renders nobody rewrites in place), no bytes moved
+    kernel    copy_file_range, or sendfile, the bytes never pass through user space
+    buffered  plain read/write copy, always the last resort
+A strategy that is not supported for a given pair of files (other filesystem, old kernel, ...) falls through to the
+next one. Per-strategy counters of files, bytes moved and bytes placed are printed at the end of the run.
+"""
+import os
+import shutil
+import sys
+import threading
+
+from environmentals import get_environ_val_default
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+COPY_STRATEGIES_KEY = 'COPY_STRATEGIES'
+
+STRATEGY_REFLINK = 'reflink'
+STRATEGY_HARDLINK = 'hardlink'
+STRATEGY_KERNEL = 'kernel'
+STRATEGY_BUFFERED = 'buffered'
+STRATEGIES = [STRATEGY_REFLINK, STRATEGY_HARDLINK, STRATEGY_KERNEL, STRATEGY_BUFFERED]
+
+# linux _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+BUFFER_SIZE = 1024 * 1024
+
+_COUNTERS = dict((strategy, [0, 0, 0]) for strategy in STRATEGIES)
+_COUNTERS_LOCK = threading.Lock()
+
+
+def get_strategies():
+    """
+    :return: the configured strategies in order, buffered always last
+    """
+    value = get_environ_val_default(COPY_STRATEGIES_KEY, ','.join(STRATEGIES))
+    strategies = [name.strip() for name in value.split(',') if name.strip() != '']
+    unknown = [name for name in strategies if name not in STRATEGIES]
+    if len(unknown) > 0:
+        raise ValueError('Unknown {key} strategies {unknown}, expected some of {known}'.format(
+            key=COPY_STRATEGIES_KEY, unknown=unknown, known=STRATEGIES))
+    if STRATEGY_BUFFERED not in strategies:
+        strategies.append(STRATEGY_BUFFERED)
+    return strategies
+
+
+def _reflink(input_path, output_path):
+    """
+    :param input_path: file to clone
+    :param output_path: clone to create
+    :return: nothing, raises OSError where cloning is not supported
+    """
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError('reflink not supported on {0}'.format(sys.platform))
+    with open(input_path, 'rb') as input_file, open(output_path, 'wb') as output_file:
+        fcntl.ioctl(output_file.fileno(), FICLONE, input_file.fileno())
+
+
+def _hardlink(input_path, output_path):
+    """
+    :param input_path: immutable file to link
+    :param output_path: link to create
+    :return: nothing, raises OSError across filesystems
+    """
+    if os.path.lexists(output_path):
+        # left behind by a strategy that failed half way
+        os.remove(output_path)
+    os.link(input_path, output_path)
+
+
+def _kernel(input_path, output_path):
+    """
+    :param input_path: file to copy
+    :param output_path: copy to create
+    :return: nothing, raises OSError when neither copy_file_range nor sendfile can copy these files
+    """
+    copy_range = getattr(os, 'copy_file_range', None)
+    send_file = getattr(os, 'sendfile', None)
+    if copy_range is None and send_file is None:
+        raise OSError('no kernel copy available on {0}'.format(sys.platform))
+    with open(input_path, 'rb') as input_file, open(output_path, 'wb') as output_file:
+        remaining = os.fstat(input_file.fileno()).st_size
+        offset = 0
+        while remaining > 0:
+            if copy_range is not None:
+                copied = copy_range(input_file.fileno(), output_file.fileno(), remaining)
+            else:
+                copied = send_file(output_file.fileno(), input_file.fileno(), offset, remaining)
+            if copied == 0:
+                raise OSError('kernel copy of {0} stopped early'.format(input_path))
+            offset += copied
+            remaining -= copied
+
+
+def _buffered(input_path, output_path):
+    """
+    :param input_path: file to copy
+    :param output_path: copy to create
+    :return: nothing
+    """
+    with open(input_path, 'rb') as input_file, open(output_path, 'wb') as output_file:
+        shutil.copyfileobj(input_file, output_file, BUFFER_SIZE)
+
+
+_COPIERS = {STRATEGY_REFLINK: _reflink, STRATEGY_HARDLINK: _hardlink, STRATEGY_KERNEL: _kernel,
+            STRATEGY_BUFFERED: _buffered}
+
+
+def copy_file(input_path, output_path, immutable=False, metadata=False):
+    """
+    :param input_path: file to copy
+    :param output_path: destination file, its directory must exist
+    :param immutable: whether both files are build artifacts nobody rewrites in place, allows hard links
+    :param metadata: also copy modification times and flags (copy2), the permission bits are always copied
+    :return: the strategy that placed the file
+    """
+    size = os.stat(input_path).st_size
+    if os.path.lexists(output_path):
+        if os.path.exists(output_path) and os.path.samefile(input_path, output_path):
+            return STRATEGY_HARDLINK
+        # never write through an existing file, it may be a hard link to another artifact
+        os.remove(output_path)
+    for strategy in get_strategies():
+        if strategy == STRATEGY_HARDLINK and not immutable:
+            continue
+        try:
+            _COPIERS[strategy](input_path, output_path)
+        except OSError:
+            if strategy == STRATEGY_BUFFERED:
+                raise
+            continue
+        if strategy != STRATEGY_HARDLINK:
+            if metadata:
+                shutil.copystat(input_path, output_path)
+            else:
+                shutil.copymode(input_path, output_path)
+        moved = size if strategy in (STRATEGY_KERNEL, STRATEGY_BUFFERED) else 0
+        with _COUNTERS_LOCK:
+            counters = _COUNTERS[strategy]
+            counters[0] += 1
+            counters[1] += moved
+            counters[2] += size
+        return strategy
+
+
+def report_copies():
+    """
+    :return: nothing
+    """
+    lines = []
+    for strategy in STRATEGIES:
+        files, moved, placed = _COUNTERS[strategy]
+        if files > 0:
+            lines.append('{strategy} {files} files ({moved:.1f} MB moved of {placed:.1f} MB)'.format(
+                strategy=strategy, files=files, moved=moved / (1024 * 1024), placed=placed / (1024 * 1024)))
+    if len(lines) > 0:
+        print('File copies: ' + ', '.join(lines))
@@ -10,14 +10,30 @@ import shutil
 import ios
 import shell_commands
 import asset_gen_tools
+import build_manifest
+import config_registry
+import file_copy
+import inkscape_shell
+import large_images
+import preflight
+import render_cache
+import render_scheduler
+import toolchain
+import webp_encoder
 from android import Android
 from client_data_json import ClientData
 from environmentals import get_environ_val
 from ios import Ios
-from ios_common import IOS_APP_MODULE_IMAGE, IOS_COMMON_MODULE_IMAGE
+from build_manifest import Stage, json_input, items_input, file_input, dir_input
+from ios_common import FA_IOS_DEFAULTS_DIR, FA_IOS_RESERVED_WORDS, \
+    FA_INFOPLIST_STRINGS_CONFIG_FILE, FA_IOS_LAUNCHER_DENSITIES, LAUNCHER_CONTENTS, FA_IOS_IMAGE_DENSITIES, \
+    FA_IOS_WELCOME_SCREEN_DENSITIES, FA_ICON_DENSITIES, FA_NAV_ICON_DENSITIES, FA_AUX_IMAGE_DENSITIES, \
+    FA_QR_FRAME_DENSITIES, FA_SBE_DENSITIES, FA_IOS_VECTORS_DIR
 
 from ios_swift import Swift
-from platforms_common import OUTPUT_DIR, CLIENT_DATA_FILE, IMAGE, AUTH_APP_WELCOME_IMAGES, AUTH_APP_IMAGES
+from platforms_common import OUTPUT_DIR, CLIENT_DATA_FILE, IMAGE, AUTH_APP_WELCOME_IMAGES, AUTH_APP_IMAGES, \
+    SHARED_DIR, FINANCIAL_APP_WELCOME_IMAGES, FINANCIAL_APP_ALL_COMMON_IMAGES_DIR, FINANCIAL_APP_DEF_LOCALISATION, \
+    FINANCIAL_APP_BUILD_FLAG_MUTEXES
 
 FAQ_TITLE = 'title'
 FAQ_TEXT = 'text'
@@ -26,6 +42,15 @@ FAQ_ITEMS = 'items'
 SVG = 'svg'
 PNG = 'png'
 WEBP = "webp"
+# raster sources are decoded and resized with the ImageMagick templates (in-process by Pillow where possible)
+RASTER_TYPES = (PNG, WEBP)
+
+# optional data.json app_colors entry, the launcher icon transparency is flattened onto it
+LAUNCHER_BACKGROUND_COLOR = 'launcher_background'
+DEFAULT_LAUNCHER_BACKGROUND = '#FFFFFF'
+
+# build target definitions copied in by start.sh, read when the build system files are generated
+BUILD_TARGETS_DIR = 'targets'
 
 SWIFT = Swift()
 
@@ -40,14 +65,26 @@ def main():
 
     print('printing: "{0}"'.format(client_key))
     print('printing: "{0}"'.format(platform))
+    print('render workers: "{0}"'.format(render_scheduler.get_render_workers()))
     print('Starting up')
     file_path = os.path.dirname(os.path.realpath(__file__))
     if file_path != os.getcwd():
         os.chdir(file_path)
-
-    shutil.rmtree(OUTPUT_DIR, True)
-
-    process_client(client_key, platform)
+    toolchain.get_registry().report()
+
+    if not build_manifest.is_incremental():
+        shutil.rmtree(OUTPUT_DIR, True)
+
+    try:
+        process_client(client_key, platform)
+    finally:
+        render_scheduler.shutdown_scheduler()
+        webp_encoder.shutdown_encoder()
+        inkscape_shell.shutdown_pool()
+        large_images.cleanup_reduced()
+        render_cache.report_cache()
+        file_copy.report_copies()
+        config_registry.report_configs()
 
     print('All done')
 
@@ -77,19 +114,118 @@ def process_client(client, platform):
     else:
         print("ALL Platforms")
 
-    copy_defaults(platforms)
-    create_strings_files(platforms, client_data)
-    create_faqs(platforms, client_data)
-    create_launcher_icons(platforms, client_data)
-    create_notify_icons(platforms, client_data)
-    create_colors(platforms, client_data)
-    create_images(platforms, client_data)
-    generate_build_system_files(platforms)
+    preflight_client(platforms, client_data)
+
+    scheduler = render_scheduler.get_scheduler()
+    build_manifest.run_stages(get_stages(platforms, client_data), scheduler.drain, OUTPUT_DIR,
+                              get_global_inputs(platforms, client))
+    scheduler.drain()
     finish(platforms)
     print('Done with client data')
     print('------------------------------------')
 
 
+def preflight_client(platforms, client_data):
+    """
+    :param platforms: platforms to be processed, Android, iOS, or both
+    :param client_data: the client-provided data, strings, faqs, colors, and images
+    :return: nothing, raises ValueError listing every problem of the bundle before anything is rendered
+    """
+    client = client_data.get_name()
+    image_types = client_data.get_image_types()
+    images = ('launcher', 'notify') + asset_gen_tools.get_json_array_from_file(AUTH_APP_IMAGES, "data")
+    required_colors = []
+    if 'welcome_1' in image_types:
+        images = images + asset_gen_tools.get_json_array_from_file(AUTH_APP_WELCOME_IMAGES, "data")
+    else:
+        # the welcome screens are recoloured from the shared templates
+        required_colors = ['primary', 'secondary']
+
+    problems = preflight.check_images(image_types, images, (SVG,) + RASTER_TYPES,
+                                      lambda image, ext: IMAGE.format(client=client, ext=ext, image=image))
+    problems.extend(preflight.check_colors(client_data.get_colors(), required_colors))
+    ios_platforms = [platform for platform in platforms if isinstance(platform, ios.Ios)]
+    for lang, strings, _ in client_data.get_strings() or []:
+        for platform in ios_platforms:
+            problems.extend(platform.preflight_strings(lang, strings))
+    preflight.report(client, problems)
+
+
+def get_global_inputs(platforms, client):
+    """
+    :param platforms: platforms to be processed, Android, iOS, or both
+    :param client: client name
+    :return: input specs shared by every stage, a change to any of them rebuilds everything
+    """
+    file_path = os.path.dirname(os.path.realpath(__file__))
+    sources = sorted(name for name in os.listdir(file_path) if name.endswith('.py'))
+    inputs = [json_input('client', client),
+              json_input('platforms', [type(platform).__name__ for platform in platforms]),
+              dir_input(FA_IOS_DEFAULTS_DIR)]
+    inputs.extend(file_input(os.path.join(file_path, source)) for source in sources)
+    return inputs
+
+
+def get_image_inputs(client, image_types, images):
+    """
+    :param client: client name
+    :param image_types: client image name -> type
+    :param images: client images used by the stage
+    :return: file input specs of the client images
+    """
+    return [file_input(IMAGE.format(client=client, ext=image_types[image], image=image))
+            for image in images if image in image_types]
+
+
+def get_stages(platforms, client_data):
+    """
+    :param platforms: platforms to be processed, Android, iOS, or both
+    :param client_data: the client-provided data, strings, faqs, colors, and images
+    :return: the process_client stages in order, with the inputs each of them reads
+    """
+    client = client_data.get_name()
+    image_types = client_data.get_image_types()
+    colors = client_data.get_colors() or {}
+    images = asset_gen_tools.get_json_array_from_file(AUTH_APP_IMAGES, "data")
+    if 'welcome_1' in image_types:
+        images = images + asset_gen_tools.get_json_array_from_file(AUTH_APP_WELCOME_IMAGES, "data")
+
+    strings_inputs = [items_input('strings', client_data.get_strings),
+                      file_input(FINANCIAL_APP_DEF_LOCALISATION), file_input(FA_IOS_RESERVED_WORDS),
+                      file_input(FA_INFOPLIST_STRINGS_CONFIG_FILE), file_input(FINANCIAL_APP_BUILD_FLAG_MUTEXES)]
+    launcher_inputs = [json_input('launcher', image_types.get('launcher')),
+                       json_input('launcher_background', colors.get(LAUNCHER_BACKGROUND_COLOR)),
+                       file_input(FA_IOS_LAUNCHER_DENSITIES), file_input(LAUNCHER_CONTENTS)]
+    launcher_inputs.extend(get_image_inputs(client, image_types, ['launcher']))
+    notify_inputs = [json_input('notify', image_types.get('notify'))]
+    notify_inputs.extend(get_image_inputs(client, image_types, ['notify']))
+    colors_inputs = [json_input('colors', colors), json_input('welcome', 'welcome_1' in image_types),
+                     file_input(FINANCIAL_APP_WELCOME_IMAGES), file_input(FA_IOS_WELCOME_SCREEN_DENSITIES),
+                     dir_input(SHARED_DIR)]
+    images_inputs = [json_input('images', dict((image, image_types.get(image)) for image in images)),
+                     file_input(AUTH_APP_IMAGES), file_input(AUTH_APP_WELCOME_IMAGES),
+                     file_input(FA_IOS_IMAGE_DENSITIES), file_input(FA_ICON_DENSITIES),
+                     file_input(FA_NAV_ICON_DENSITIES), file_input(FA_AUX_IMAGE_DENSITIES),
+                     file_input(FA_QR_FRAME_DENSITIES), file_input(FA_SBE_DENSITIES),
+                     dir_input(FA_IOS_VECTORS_DIR), dir_input(FINANCIAL_APP_ALL_COMMON_IMAGES_DIR)]
+    images_inputs.extend(get_image_inputs(client, image_types, images))
+    # the build system files read the infoplist strings gathered by the strings stage and the build targets
+    build_system_inputs = strings_inputs + [dir_input(BUILD_TARGETS_DIR)]
+
+    # the build system files are written into the app project, outside the manifest's reach, so they rerun (with the
+    # strings stage) whenever the strings or the targets change; the images stage writes out the Swift images
+    # appended by the colors stage
+    return [Stage('copy_defaults', lambda: copy_defaults(platforms), [], []),
+            Stage('strings', lambda: create_strings_files(platforms, client_data), strings_inputs, []),
+            Stage('faqs', lambda: create_faqs(platforms, client_data),
+                  [items_input('faqs', client_data.get_faqs)], []),
+            Stage('launcher', lambda: create_launcher_icons(platforms, client_data), launcher_inputs, []),
+            Stage('notify', lambda: create_notify_icons(platforms, client_data), notify_inputs, []),
+            Stage('colors', lambda: create_colors(platforms, client_data), colors_inputs, []),
+            Stage('images', lambda: create_images(platforms, client_data), images_inputs, ['colors']),
+            Stage('build_system', lambda: generate_build_system_files(platforms), build_system_inputs, ['strings'])]
+
+
 def copy_defaults(platforms):
     """
     :param platforms: platforms to be processed, Android, iOS, or both
@@ -143,15 +279,34 @@ def create_launcher_icons(platforms, client_data):
     client = client_data.get_name()
     image_types = client_data.get_image_types()
     image_type = image_types[image]
+    colors = client_data.get_colors() or {}
+    background = colors.get(LAUNCHER_BACKGROUND_COLOR) or DEFAULT_LAUNCHER_BACKGROUND
 
     if image_type == SVG:
         svg_file = IMAGE.format(client=client, ext=SVG, image=image)
         for platform in platforms:
-            platform.create_launcher_icons(shell_commands.INKSCAPE_SQUARE_COMMAND, svg_file)
-    elif image_type == PNG:
-        png_file = IMAGE.format(client=client, ext=PNG, image=image)
+            create_platform_launcher_icons(platform, shell_commands.INKSCAPE_SQUARE_COMMAND, svg_file, background)
+    elif image_type in RASTER_TYPES:
+        raster_file = IMAGE.format(client=client, ext=image_type, image=image)
         for platform in platforms:
-            platform.create_launcher_icons(shell_commands.IMAGE_MAGICK_SQUARE_COMMAND, png_file)
+            create_platform_launcher_icons(platform, shell_commands.IMAGE_MAGICK_SQUARE_COMMAND, raster_file,
+                                           background)
+    else:
+        unsupported_image_type(image, image_type)
+
+
+def create_platform_launcher_icons(platform, command, input_path, background):
+    """
+    :param platform: platform being processed
+    :param command: command to be used for rendering the icon
+    :param input_path: the client launcher image
+    :param background: color the iOS launcher transparency is flattened onto
+    :return: nothing
+    """
+    if isinstance(platform, ios.Ios):
+        platform.create_launcher_icons(command, input_path, background)
+    else:
+        platform.create_launcher_icons(command, input_path)
 
 
 def create_notify_icons(platforms, client_data):
@@ -170,10 +325,12 @@ def create_notify_icons(platforms, client_data):
         svg_file = IMAGE.format(client=client, ext=SVG, image=image)
         for platform in platforms:
             platform.create_notify_icons(shell_commands.INKSCAPE_SQUARE_COMMAND, svg_file)
-    elif image_type == PNG:
-        png_file = IMAGE.format(client=client, ext=PNG, image=image)
+    elif image_type in RASTER_TYPES:
+        raster_file = IMAGE.format(client=client, ext=image_type, image=image)
         for platform in platforms:
-            platform.create_notify_icons(shell_commands.IMAGE_MAGICK_SQUARE_COMMAND, png_file)
+            platform.create_notify_icons(shell_commands.IMAGE_MAGICK_SQUARE_COMMAND, raster_file)
+    else:
+        unsupported_image_type(image, image_type)
 
 
 def create_images(platforms, client_data):
@@ -184,8 +341,7 @@ def create_images(platforms, client_data):
     """
     images = asset_gen_tools.get_json_array_from_file(AUTH_APP_IMAGES, "data")
     if 'welcome_1' in client_data.get_image_types():
-        extended_images = asset_gen_tools.get_json_array_from_file(AUTH_APP_WELCOME_IMAGES, "data")
-        images.extend(extended_images)
+        images = images + asset_gen_tools.get_json_array_from_file(AUTH_APP_WELCOME_IMAGES, "data")
 
     print('Create ' + ','.join(images) + ' icons...')
     client = client_data.get_name()
@@ -193,18 +349,33 @@ def create_images(platforms, client_data):
 
     for image in images:
         image_type = image_types[image]
-        command = ""
         if image_type == SVG:
             command = shell_commands.INKSCAPE_COMMAND
-        elif image_type == PNG:
+        elif image_type in RASTER_TYPES:
             command = shell_commands.IMAGE_MAGICK_COMMAND
+        else:
+            unsupported_image_type(image, image_type)
         handle_image(client, platforms, image_type, image, command)
+    scheduler = render_scheduler.get_scheduler()
     for platform in platforms:
         platform.create_other_images(shell_commands.INKSCAPE_COMMAND)
         if isinstance(platform, ios.Ios):
+            # Swift image bookkeeping is appended by completion callbacks, wait for them before writing out.
+            scheduler.drain()
             SWIFT.write_out_images()
 
 
+def unsupported_image_type(image, image_type):
+    """
+    :param image: image variant being processed
+    :param image_type: the type given in the client data
+    :return: nothing, raises ValueError
+    """
+    print('Image "{0}" has unsupported type "{1}", expected one of {2}'.format(image, image_type,
+                                                                              [SVG] + list(RASTER_TYPES)))
+    raise ValueError('Unsupported image type {0} for {1}'.format(image_type, image))
+
+
 def handle_image(client, platforms, image_type, image, command):
     """
     :param client: name of the client
@@ -214,20 +385,15 @@ def handle_image(client, platforms, image_type, image, command):
     :param command: command to be used for processing the image
     :return: nothing
     """
+    scheduler = render_scheduler.get_scheduler()
     image_file = IMAGE.format(client=client, ext=image_type, image=image)
     for platform in platforms:
-        platform.create_image(command, image_file, image)
+        futures = platform.create_image(command, image_file, image)
         if isinstance(platform, ios.Ios):
-            # also add launch screen image
-            if image == "home":
-                ios.IMAGES_SOURCE = IOS_APP_MODULE_IMAGE
-                new_image_file = IMAGE.format(client=client, ext=image_type, image="launch")
-                shutil.copyfile(image_file, new_image_file)
-                image_file = IMAGE.format(client=client, ext=image_type, image="launch")
-                platform.create_image(command, image_file, "launch")
-                SWIFT.append_image("launch")
-                ios.IMAGES_SOURCE = IOS_COMMON_MODULE_IMAGE
-            SWIFT.append_image(image)
+            # aliases (the launch screen image) are placed from these renders, see ios.IMAGE_ALIASES
+            for alias in ios.IMAGE_ALIASES.get(image, []):
+                scheduler.after(futures, lambda name=alias.name: SWIFT.append_image(name))
+            scheduler.after(futures, lambda: SWIFT.append_image(image))
 
 
 def create_colors(platforms, client_data):
@@ -245,10 +411,13 @@ def create_colors(platforms, client_data):
             SWIFT.write_out_colors()
 
     if 'welcome_1' not in client_data.get_image_types():
+        scheduler = render_scheduler.get_scheduler()
         for platform in platforms:
             welcome_paths = platform.create_welcome_screens(client_data.get_name(), colors['primary'],
                                                             colors['secondary'])
-            platform.copy_welcome_screen(welcome_paths, None)
+            # copy once the welcome renders submitted so far are on disk
+            scheduler.after(None, lambda platform=platform, paths=welcome_paths:
+                            platform.copy_welcome_screen(paths, None))
         SWIFT.append_image('image_1')
         SWIFT.append_image('image_2')
         SWIFT.append_image('image_3')
@@ -17,6 +17,10 @@ GIT_COMMIT_SHORT_HASH = GIT_BIN + ' rev-parse --short HEAD'
 GIT_CLONE = GIT_BIN + ' clone {url} clients'
 GIT_BRANCH = GIT_BIN + ' branch'
 
+# argv templates for shell_commands.run_commands
+GIT_COMMIT_COUNT_ARGV = [GIT_BIN, 'rev-list', '--count', 'HEAD']
+GIT_COMMIT_HASH_ARGV = [GIT_BIN, 'rev-parse', 'HEAD']
+
 
 def work_dir(path=""):
     """
@@ -69,6 +73,17 @@ def get_short_hash(path=""):
     return subprocess.check_output(command, env=shell_commands.ENV, cwd=work_dir_path).decode("utf-8").strip()
 
 
+def get_build_info(path=""):
+    """
+    :param path: possible relative path
+    :return: (commit count, hash) of the current checked-out branch, both queries run concurrently
+    """
+    work_dir_path = work_dir(path)
+    count, commit_hash = shell_commands.run_commands([shell_commands.ShellCall(GIT_COMMIT_COUNT_ARGV, work_dir_path),
+                                                      shell_commands.ShellCall(GIT_COMMIT_HASH_ARGV, work_dir_path)])
+    return int(count.decode("utf-8").strip()), commit_hash.decode("utf-8").strip()
+
+
 def clone(url):
     """
     :param url: git url to clone
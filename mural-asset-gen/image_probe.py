@@ -0,0 +1,215 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+This file houses the header-only image probe.
+
+The dimensions of PNG and WebP files are read from their headers, those of SVG files from the width/height (or
+viewBox) attributes of the root element, without decoding the image. Results are memoized per file, path, size and
+modification time. resize_image uses the probe to copy inputs that already have the requested dimensions instead of
+running a converter, and to catch raster inputs that would be upscaled: RENDER_UPSCALE=warn (default) prints a
+warning, refuse raises, allow renders silently.
+"""
+import os
+import re
+import struct
+from collections import namedtuple
+
+import shell_commands
+from environmentals import get_environ_val_default
+
+RENDER_UPSCALE_KEY = 'RENDER_UPSCALE'
+UPSCALE_WARN = 'warn'
+UPSCALE_REFUSE = 'refuse'
+UPSCALE_ALLOW = 'allow'
+
+FORMAT_PNG = 'png'
+FORMAT_WEBP = 'webp'
+FORMAT_SVG = 'svg'
+RASTER_FORMATS = (FORMAT_PNG, FORMAT_WEBP)
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+SVG_HEADER_LIMIT = 64 * 1024
+SVG_ROOT_PATTERN = re.compile(r'<svg\b[^>]*>', re.IGNORECASE | re.DOTALL)
+SVG_ATTRIBUTE_PATTERN = '\\b{name}\\s*=\\s*["\']([^"\']*)["\']'
+SVG_LENGTH_PATTERN = re.compile(r'^\s*([0-9.]+)\s*(px)?\s*$')
+
+# command template -> whether the output keeps the aspect ratio (width resize) or is forced square
+WIDTH_COMMANDS = {shell_commands.IMAGE_MAGICK_COMMAND, shell_commands.INKSCAPE_COMMAND}
+SQUARE_COMMANDS = {shell_commands.IMAGE_MAGICK_SQUARE_COMMAND, shell_commands.INKSCAPE_SQUARE_COMMAND,
+                   shell_commands.IMAGE_MAGICK_SQUARE_FLATTEN_COMMAND}
+# commands that do nothing but resize, an input of the requested dimensions can be copied instead
+COPYABLE_COMMANDS = {shell_commands.IMAGE_MAGICK_COMMAND, shell_commands.IMAGE_MAGICK_SQUARE_COMMAND}
+
+ImageInfo = namedtuple('ImageInfo', ['format', 'width', 'height'])
+
+_PROBES = {}
+_WARNED = set()
+
+
+def probe(path):
+    """
+    :param path: image file
+    :return: ImageInfo of the file, None when the format is unknown or the header gives no dimensions
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _PROBES:
+        with open(path, 'rb') as image_file:
+            header = image_file.read(32)
+            if header.startswith(PNG_SIGNATURE):
+                info = _probe_png(header)
+            elif header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+                info = _probe_webp(header)
+            else:
+                info = _probe_svg(header + image_file.read(SVG_HEADER_LIMIT))
+        _PROBES[memo_key] = info
+    return _PROBES[memo_key]
+
+
+def _probe_png(header):
+    """
+    :param header: first bytes of the file
+    :return: ImageInfo from the IHDR chunk
+    """
+    if len(header) < 24 or header[12:16] != b'IHDR':
+        return None
+    width, height = struct.unpack('>II', header[16:24])
+    return ImageInfo(FORMAT_PNG, width, height)
+
+
+def _probe_webp(header):
+    """
+    :param header: first bytes of the file
+    :return: ImageInfo from the VP8, VP8L or VP8X chunk
+    """
+    chunk = header[12:16]
+    if chunk == b'VP8 ' and len(header) >= 30:
+        width, height = struct.unpack('<HH', header[26:30])
+        return ImageInfo(FORMAT_WEBP, width & 0x3fff, height & 0x3fff)
+    if chunk == b'VP8L' and len(header) >= 25:
+        bits = struct.unpack('<I', header[21:25])[0]
+        return ImageInfo(FORMAT_WEBP, (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1)
+    if chunk == b'VP8X' and len(header) >= 30:
+        width = int.from_bytes(header[24:27], 'little') + 1
+        height = int.from_bytes(header[27:30], 'little') + 1
+        return ImageInfo(FORMAT_WEBP, width, height)
+    return None
+
+
+def _probe_svg(header):
+    """
+    :param header: first bytes of the file, up to the root element
+    :return: ImageInfo from the width/height attributes, or the viewBox when they are missing or relative
+    """
+    match = SVG_ROOT_PATTERN.search(header.decode('utf-8', 'replace'))
+    if match is None:
+        return None
+    root = match.group(0)
+    width = _svg_length(_svg_attribute(root, 'width'))
+    height = _svg_length(_svg_attribute(root, 'height'))
+    if width is None or height is None:
+        view_box = _svg_attribute(root, 'viewBox')
+        values = view_box.replace(',', ' ').split() if view_box is not None else []
+        if len(values) != 4:
+            return None
+        try:
+            width, height = float(values[2]), float(values[3])
+        except ValueError:
+            return None
+    if width <= 0 or height <= 0:
+        return None
+    return ImageInfo(FORMAT_SVG, width, height)
+
+
+def _svg_attribute(root, name):
+    """
+    :param root: text of the svg start tag
+    :param name: attribute name
+    :return: the attribute value, None when absent
+    """
+    match = re.search(SVG_ATTRIBUTE_PATTERN.format(name=name), root)
+    return match.group(1) if match is not None else None
+
+
+def _svg_length(value):
+    """
+    :param value: svg width or height attribute
+    :return: the length in user units, None for missing, relative or physical lengths
+    """
+    if value is None:
+        return None
+    match = SVG_LENGTH_PATTERN.match(value)
+    return float(match.group(1)) if match is not None else None
+
+
+def target_size(command_string, input_path, size):
+    """
+    :param command_string: resize commandline template
+    :param input_path: the file to be converted
+    :param size: requested size
+    :return: (width, height) the command will produce, None when it cannot be told from the header
+    """
+    info = probe(input_path)
+    if info is None:
+        return None
+    size = int(size)
+    if command_string in SQUARE_COMMANDS:
+        return size, size
+    if command_string in WIDTH_COMMANDS:
+        return size, max(1, int(round(info.height * size / float(info.width))))
+    return None
+
+
+def get_upscale_policy():
+    """
+    :return: the RENDER_UPSCALE policy
+    """
+    policy = get_environ_val_default(RENDER_UPSCALE_KEY, UPSCALE_WARN)
+    if policy not in (UPSCALE_WARN, UPSCALE_REFUSE, UPSCALE_ALLOW):
+        raise ValueError('{key} must be one of {choices}, got {value}'.format(
+            key=RENDER_UPSCALE_KEY, choices=[UPSCALE_WARN, UPSCALE_REFUSE, UPSCALE_ALLOW], value=policy))
+    return policy
+
+
+def can_copy(command_string, input_path, output_path, size):
+    """
+    :param command_string: resize commandline template
+    :param input_path: the file to be converted
+    :param output_path: the path where the output should be written
+    :param size: requested size
+    :return: True when the input already has the requested dimensions and format and can be copied as is;
+        raster inputs that would be upscaled are reported according to RENDER_UPSCALE
+    """
+    info = probe(input_path)
+    if info is None or info.format not in RASTER_FORMATS:
+        return False
+    target = target_size(command_string, input_path, size)
+    if target is None:
+        return False
+    if target[0] > info.width or target[1] > info.height:
+        _report_upscale(input_path, info, target)
+        return False
+    output_format = os.path.splitext(output_path)[1].lower().lstrip('.')
+    return command_string in COPYABLE_COMMANDS and output_format == info.format and \
+        target == (info.width, info.height)
+
+
+def _report_upscale(input_path, info, target):
+    """
+    :param input_path: the file to be converted
+    :param info: ImageInfo of the input
+    :param target: (width, height) requested
+    :return: nothing, raises ValueError when upscales are refused
+    """
+    policy = get_upscale_policy()
+    if policy == UPSCALE_ALLOW:
+        return
+    message = '{input} is {width}x{height}, upscaling it to {target_width}x{target_height}'.format(
+        input=input_path, width=info.width, height=info.height, target_width=target[0], target_height=target[1])
+    if policy == UPSCALE_REFUSE:
+        print(message + ' refused, supply a larger image or set {key}={allow}'.format(key=RENDER_UPSCALE_KEY,
+                                                                                       allow=UPSCALE_ALLOW))
+        raise ValueError('Upscale of {0} refused'.format(input_path))
+    if input_path not in _WARNED:
+        _WARNED.add(input_path)
+        print('Warning: ' + message + ', the output will be blurry')
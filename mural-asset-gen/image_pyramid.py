@@ -0,0 +1,117 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+This file houses the single-decode density pyramid. Instead of rasterizing a source once per density, the render
+stages can rasterize it once at the largest density of its set and derive the smaller densities in-process by
+downsampling that buffer.
+
+The mode is selected per asset class with RENDER_PYRAMID, a comma separated list of classes (or 'all', or 'none'),
+because some classes (nav icons for instance) may need the renderer's hinting at small sizes. Only the large welcome
+screens use it by default. It requires Pillow, without it every
+density is rendered by the external tool as before.
+"""
+from environmentals import get_environ_val_default
+from raster_backend import HAS_PILLOW, Image
+
+RENDER_PYRAMID_KEY = 'RENDER_PYRAMID'
+PYRAMID_ALL = 'all'
+PYRAMID_NONE = 'none'
+
+ASSET_IMAGES = 'images'
+ASSET_ICONS = 'icons'
+ASSET_NAV_ICONS = 'nav_icons'
+ASSET_OTHER = 'other'
+ASSET_COMMON = 'common'
+ASSET_LAUNCHER = 'launcher'
+ASSET_WELCOME = 'welcome'
+
+ASSET_CLASSES = [ASSET_IMAGES, ASSET_ICONS, ASSET_NAV_ICONS, ASSET_OTHER, ASSET_COMMON, ASSET_LAUNCHER, ASSET_WELCOME]
+DEFAULT_PYRAMID_CLASSES = ASSET_WELCOME
+
+# bump whenever downscale() writes different pixels, cached derived densities of older versions are then rendered again
+PYRAMID_VERSION = 1
+PYRAMID_COMMAND = '{command} #pyramid v{version} from {source_size} pillow {pillow}'
+
+_WARNED = []
+
+
+def get_pyramid_classes():
+    """
+    :return: set of asset classes rendered through the pyramid
+    """
+    value = get_environ_val_default(RENDER_PYRAMID_KEY, DEFAULT_PYRAMID_CLASSES)
+    classes = set(name.strip() for name in value.split(',') if name.strip() != '')
+    if PYRAMID_ALL in classes:
+        return set(ASSET_CLASSES)
+    if PYRAMID_NONE in classes:
+        return set()
+    unknown = classes.difference(ASSET_CLASSES)
+    if len(unknown) > 0:
+        raise ValueError('Unknown {key} asset classes {unknown}, expected some of {known}'.format(
+            key=RENDER_PYRAMID_KEY, unknown=sorted(unknown), known=ASSET_CLASSES))
+    return classes
+
+
+def use_pyramid(asset_class):
+    """
+    :param asset_class: the asset class of a density set, None for unclassified sets
+    :return: whether the density set should be rendered once and downsampled in-process
+    """
+    if asset_class is None or asset_class not in get_pyramid_classes():
+        return False
+    if not HAS_PILLOW:
+        if len(_WARNED) == 0:
+            print('Pillow not found, {key} ignored, rendering every density'.format(key=RENDER_PYRAMID_KEY))
+            _WARNED.append(True)
+        return False
+    return True
+
+
+def split_largest(jobs):
+    """
+    :param jobs: render jobs of one density set
+    :return: the job with the largest size, and the remaining jobs
+    """
+    largest = max(jobs, key=lambda job: job.size)
+    return largest, [job for job in jobs if job is not largest]
+
+
+def cache_command(command, source_size):
+    """
+    :param command: command template of the density set
+    :param source_size: size of the largest render the density is derived from
+    :return: the command the derived density is cached under, apart from external renders of the same size
+    """
+    return PYRAMID_COMMAND.format(command=command, version=PYRAMID_VERSION, source_size=source_size,
+                                  pillow=getattr(Image, '__version__', 'unknown'))
+
+
+def derived_size(source_size, size):
+    """
+    :param source_size: (width, height) of the largest render
+    :param size: target width, every density command constrains the width and keeps the aspect ratio
+    :return: (width, height) of the derived density
+    """
+    width, height = source_size
+    return size, max(1, int(round(height * size / float(width))))
+
+
+def downscale(source, output_path, size):
+    """
+    :param source: loaded PIL image of the largest render
+    :param output_path: the path where the derived density should be written
+    :param size: target width
+    :return: nothing
+    """
+    resized = source.resize(derived_size(source.size, size), Image.LANCZOS)
+    resized.save(output_path)
+
+
+def open_render(path):
+    """
+    :param path: the largest render of a density set
+    :return: the decoded image, kept in memory for all derived densities
+    """
+    source = Image.open(path)
+    source.load()
+    return source
@@ -0,0 +1,228 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+This file houses the persistent Inkscape shell worker pool.
+
+Inkscape startup (extension system, fonts) costs far more than rasterizing one of our icons, so instead of one
+process per export the pool keeps long-lived `inkscape --shell` workers and feeds them export requests over stdin.
+A request is complete when the worker prints its prompt again and the output file exists. Workers that die, hang past
+the timeout or fail an export are killed and replaced; every worker is also recycled after a fixed number of jobs.
+
+The pool is enabled with INKSCAPE_SHELL_WORKERS=<count>; the request templates live in shell_commands.
+"""
+import os
+import queue
+import shlex
+import subprocess
+import threading
+
+import shell_commands
+from environmentals import get_environ_val_default
+
+INKSCAPE_SHELL_WORKERS_KEY = 'INKSCAPE_SHELL_WORKERS'
+INKSCAPE_SHELL_TIMEOUT_KEY = 'INKSCAPE_SHELL_TIMEOUT'
+
+DEFAULT_TIMEOUT = 60
+MAX_JOBS_PER_WORKER = 500
+PROMPT = b'>'
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+class InkscapeShellWorker:
+    """
+    A class used to drive a single `inkscape --shell` process.
+
+    Methods
+    -------
+    start()
+        Spawns the process and waits for its first prompt.
+    request(line, output_path)
+        Sends one request line and waits for the prompt, raises RuntimeError when the output was not written.
+    is_healthy()
+        Whether the process is still running and under its job budget.
+    stop()
+        Terminates the process.
+    """
+    def __init__(self, command, timeout):
+        self.command = command
+        self.timeout = timeout
+        self.process = None
+        self.output = None
+        self.jobs = 0
+
+    def start(self):
+        """
+        :return: nothing
+        """
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, env=shell_commands.ENV)
+        self.output = queue.Queue()
+        reader = threading.Thread(target=_read_stream, args=(self.process.stdout, self.output), daemon=True)
+        reader.start()
+        self.jobs = 0
+        self._wait_prompt()
+
+    def _wait_prompt(self):
+        """
+        :return: nothing, raises RuntimeError when the worker exits or stays silent past the timeout
+        """
+        buffer = b''
+        while not buffer.rstrip().endswith(PROMPT):
+            try:
+                chunk = self.output.get(timeout=self.timeout)
+            except queue.Empty:
+                raise RuntimeError('Inkscape shell worker did not answer within {0}s'.format(self.timeout))
+            if chunk is None:
+                raise RuntimeError('Inkscape shell worker exited with code {0}'.format(self.process.wait()))
+            buffer += chunk
+
+    def request(self, line, output_path):
+        """
+        :param line: the shell request, one line
+        :param output_path: the file the request must produce
+        :return: nothing
+        """
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        self.process.stdin.write((line + '\n').encode('utf-8'))
+        self.process.stdin.flush()
+        self._wait_prompt()
+        self.jobs += 1
+        if not os.path.isfile(output_path):
+            raise RuntimeError('Inkscape shell worker did not write {0}'.format(output_path))
+
+    def is_healthy(self):
+        """
+        :return: whether the worker can take another request
+        """
+        return self.process is not None and self.process.poll() is None and self.jobs < MAX_JOBS_PER_WORKER
+
+    def stop(self):
+        """
+        :return: nothing
+        """
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+
+def _read_stream(stream, output):
+    """
+    :param stream: stdout of a worker
+    :param output: queue receiving the chunks, None once the stream is closed
+    :return: nothing
+    """
+    while True:
+        chunk = os.read(stream.fileno(), 4096)
+        if not chunk:
+            output.put(None)
+            return
+        output.put(chunk)
+
+
+class InkscapeShellPool:
+    """
+    A class used to share a fixed number of Inkscape shell workers between render threads.
+
+    Methods
+    -------
+    export(request_template, input_path, output_path, size, background=None)
+        Formats and runs one export request on an idle worker, restarting the worker when it misbehaves.
+    shutdown()
+        Stops every worker.
+    """
+    def __init__(self, workers, command=None, timeout=DEFAULT_TIMEOUT):
+        self.command = command if command else [shlex.split(shell_commands.INKSCAPE_BIN)[0], '--shell']
+        self.timeout = timeout
+        self.idle = queue.Queue()
+        self.restarts = 0
+        for _ in range(workers):
+            self.idle.put(InkscapeShellWorker(self.command, self.timeout))
+
+    def export(self, request_template, input_path, output_path, size, background=None):
+        """
+        :param request_template: shell request template with {input}, {output}, {size} and optionally {background}
+        :param input_path: the svg to be rasterized
+        :param output_path: the path where the png should be written
+        :param size: image size for the output image
+        :param background: background color for requests that flatten, ignored by the others
+        :return: nothing
+        """
+        line = request_template.format(input=input_path, output=output_path, size=size, background=background)
+        worker = self.idle.get()
+        try:
+            if not worker.is_healthy():
+                self._restart(worker)
+            try:
+                worker.request(line, output_path)
+            except (OSError, RuntimeError) as first_exception:
+                # a hung or crashed worker gets one fresh replacement before the job fails
+                print('Inkscape shell worker failed ({0}), restarting'.format(first_exception))
+                self._restart(worker)
+                worker.request(line, output_path)
+        finally:
+            self.idle.put(worker)
+
+    def _restart(self, worker):
+        """
+        :param worker: worker to (re)start
+        :return: nothing
+        """
+        if worker.process is not None:
+            self.restarts += 1
+            if worker.process.poll() is None:
+                worker.process.kill()
+            worker.process.wait()
+            worker.process = None
+        worker.start()
+
+    def shutdown(self):
+        """
+        :return: nothing
+        """
+        while not self.idle.empty():
+            self.idle.get().stop()
+
+
+def get_shell_workers():
+    """
+    :return: number of Inkscape shell workers, 0 when the pool is disabled
+    """
+    return int(get_environ_val_default(INKSCAPE_SHELL_WORKERS_KEY, 0))
+
+
+def get_pool():
+    """
+    :return: the process-wide Inkscape shell pool, None when disabled
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            workers = get_shell_workers()
+            if workers <= 0:
+                return None
+            timeout = int(get_environ_val_default(INKSCAPE_SHELL_TIMEOUT_KEY, DEFAULT_TIMEOUT))
+            _POOL = InkscapeShellPool(workers, timeout=timeout)
+        return _POOL
+
+
+def shutdown_pool():
+    """
+    :return: nothing
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown()
+            _POOL = None
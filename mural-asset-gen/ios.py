@@ -11,14 +11,17 @@ are typically outside the class.
 import json
 import os
 from abc import ABCMeta
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 from xml.etree import ElementTree
 
 import shell_commands
 import git_operations
 import asset_gen_tools
+import image_pyramid
+import localisation_store
+import render_scheduler
 from ios_common import IOS_STRINGS, IOS_STRINGS_DIR, IOS_LAUNCHER, LAUNCHER_CONTENTS, IOS_LAUNCHER_DIR, \
-    IOS_COMMON_MODULE_IMAGE, IOS_OUTPUT_DIR, FA_IOS_RESERVED_WORDS, FA_IOS_LAUNCHER_DENSITIES, \
+    IOS_COMMON_MODULE_IMAGE, IOS_APP_MODULE_IMAGE, IOS_OUTPUT_DIR, FA_IOS_RESERVED_WORDS, FA_IOS_LAUNCHER_DENSITIES, \
     FA_IOS_IMAGE_DENSITIES, FA_IOS_WELCOME_SCREEN_DENSITIES, FA_ICON_DENSITIES, FA_NAV_ICON_DENSITIES, \
     FA_AUX_IMAGE_DENSITIES, FA_QR_FRAME_DENSITIES, FA_SBE_DENSITIES, FA_IOS_DEFAULTS_DIR, FA_IOS_VECTORS_DIR, \
     FA_INFOPLIST_STRINGS_CONFIG_FILE, IOS_LOCALIZABLE_STRINGS_DIR, IOS_INFOPLIST_FILE, \
@@ -27,10 +30,21 @@ from ios_swift import Swift
 from mobileplatform import MobilePlatform
 from platforms_common import SHARED_DIR, OUTPUT_DIR, FINANCIAL_APP_WELCOME_IMAGES, \
     FINANCIAL_APP_ALL_COMMON_IMAGES_DIR, FINANCIAL_APP_DEF_LOCALISATION, FINANCIAL_APP_BUILD_FLAG_MUTEXES
+from render_scheduler import RenderJob
+from welcome_screens import WelcomeScreenEngine
 
 INFO = {'version': 1, 'author': 'xcode'}
 IMAGES_SOURCE = IOS_COMMON_MODULE_IMAGE
 
+# string tags of which exactly a compatible set must have a value in every language
+STRING_MUTEX_TAGS = [["privacy_policy", "privacy_policy_url"], ["terms_and_conditions", "terms_and_conditions_url"]]
+
+# An alias receives the finished density renders of its image, renamed, at its own location with its own
+# Contents.json; it is never rendered itself.
+ImageAlias = namedtuple('ImageAlias', ['name', 'sources'])
+# image -> aliases, the launch screen shows the home image from the app module
+IMAGE_ALIASES = {'home': [ImageAlias('launch', IOS_APP_MODULE_IMAGE)]}
+
 
 class Ios(MobilePlatform):
     """
@@ -51,9 +65,11 @@ class Ios(MobilePlatform):
         Copies the default android assets into the output folder structure.
     process_localizations(lang, strings, default)
         Process the data.json file into multiple strings.xml files.
+    preflight_strings(lang, strings)
+        Problems in the strings of a language, found before anything is written.
     save_faqs(lang, output, default)
         Processes the FAQ blocks of data.json into faqs.json
-    create_launcher_icons(command, input_path)
+    create_launcher_icons(command, input_path, background=None)
         Creates the launcher icons of various densities.
     create_image(command, input_path, image)
         Creates/processes all images given from config.
@@ -71,7 +87,7 @@ class Ios(MobilePlatform):
         Creates welcome screens according to default images and color schemes of the client.
     add_dict_values(key, value, dictionary_data)
         Builds up a dictionary (unique set) of string key/value pairs.
-    image_loop(command, input_path, densities, idiom, swift)
+    image_loop(command, input_path, densities, idiom, swift, asset_class=None)
         Sequence of procedures to execute on every image.
     fmt_lang(lang)
         Format the language code to a format that iOS will accept.
@@ -82,6 +98,9 @@ class Ios(MobilePlatform):
         super().__init__(client_data)
 
         self.reserved = asset_gen_tools.get_json_array_from_file(FA_IOS_RESERVED_WORDS, "data")
+        file_path = os.path.dirname(os.path.realpath(__file__))
+        self.localisations = localisation_store.get_store(os.path.join(file_path, FINANCIAL_APP_DEF_LOCALISATION),
+                                                          self.reserved)
 
         self.swift = Swift()
 
@@ -98,40 +117,23 @@ class Ios(MobilePlatform):
         :param default: indication of whether or not the passed language is considered the default for this app
         :return: nothing
         """
-        file_path = os.path.dirname(os.path.realpath(__file__))
-        if file_path != os.getcwd():
-            os.chdir(file_path)
-
         # Determine the relevant file path to be written (language dependent)
         dictionary_lang = lang
         lang = self.format_language(lang)
 
         output_kv_path = IOS_STRINGS.format(lang=lang)
 
-        json_languages = asset_gen_tools.read(os.path.join(file_path, FINANCIAL_APP_DEF_LOCALISATION))
-        json_languages_dictionary = json.loads(json_languages)["languages"]
-        json_by_language = json_languages_dictionary[dictionary_lang]
-
-        # prepare empty dictionary
-        data = dict()
-
-        for key, value in json_by_language.items():
-            self.add_dict_values(key, value, data)
+        # client strings over the defaults of the language, the default table is loaded and prepared once
+        data = self.localisations.merged(dictionary_lang, strings)
 
         output = ''
 
-        for name, text in strings:
-            self.add_dict_values(name, text, data)
-
         # populate the InfoPlist Localizable strings files.
         self.process_infoplist_strings_localised(data, lang, default)
 
         # Check mutexes
-        asset_gen_tools.check_string_mutexes(["privacy_policy", "privacy_policy_url"], data, lang,
-                                             FINANCIAL_APP_BUILD_FLAG_MUTEXES)
-
-        asset_gen_tools.check_string_mutexes(["terms_and_conditions", "terms_and_conditions_url"], data, lang,
-                                             FINANCIAL_APP_BUILD_FLAG_MUTEXES)
+        for mutex_tags in STRING_MUTEX_TAGS:
+            asset_gen_tools.check_string_mutexes(mutex_tags, data, lang, FINANCIAL_APP_BUILD_FLAG_MUTEXES)
 
         # create file output from dictionary
         for key, val in data.items():
@@ -153,6 +155,27 @@ class Ios(MobilePlatform):
             print(output)
             raise RuntimeError("There is a problem with the input encoding") from main_exception
 
+    def preflight_strings(self, lang, strings):
+        """
+        :param lang: language being considered
+        :param strings: the strings of aforementioned language
+        :return: list of problems process_localizations would raise on, or leave empty InfoPlist entries for
+        """
+        if not self.localisations.has_language(lang):
+            return ['Language {lang} has no default strings in {path}'.format(lang=lang, path=self.localisations.path)]
+        data = self.localisations.merged(lang, strings)
+        problems = []
+        mapping = asset_gen_tools.get_json_array_from_file(FA_INFOPLIST_STRINGS_CONFIG_FILE, "data")
+        for entry in mapping:
+            for key, value in entry.items():
+                if value not in data:
+                    problems.append('InfoPlist key {key} maps to string {value}, missing for language {lang}'.format(
+                        key=key, value=value, lang=lang))
+        for mutex_tags in STRING_MUTEX_TAGS:
+            problems.extend(asset_gen_tools.get_string_mutex_problems(mutex_tags, data, lang,
+                                                                      FINANCIAL_APP_BUILD_FLAG_MUTEXES))
+        return problems
+
     def process_infoplist_strings_localised(self, data, lang, default):
         """
         :param data: the string data in a dictionary
@@ -190,18 +213,8 @@ class Ios(MobilePlatform):
         :param dictionary_data: the dictionary containing the result data
         :return: nothing
         """
-        # add suffix for reserved words
-        if key in self.reserved:
-            key += "_string"
-
-        # add suffix for short words (linting rules)
-        if len(key) < 3:
-            key += "_string"
-
-        # Escape double quotes and newlines
-        value = value.replace('"', '\\"').replace('\n', '\\n').replace("'", "\\'")
-
-        dictionary_data[key] = value
+        # suffix reserved and short keys, escape double quotes and newlines
+        self.localisations.rules.add(key, value, dictionary_data)
 
     def save_faqs(self, lang, faqs, default):
         """
@@ -227,41 +240,51 @@ class Ios(MobilePlatform):
             color = '0x' + string.lstrip('#')
             self.swift.append_color(key, color)
 
-    def create_launcher_icons(self, command, input_path):
+    def create_launcher_icons(self, command, input_path, background=None):
         """
         :param command: the command line to use when running image creation process
         :param input_path: input image to be used
-        :return: nothing
+        :param background: color the icon transparency is flattened onto, white when not given
+        :return: futures of the submitted launcher set
         """
         sizes = asset_gen_tools.get_json_array_from_file(FA_IOS_LAUNCHER_DENSITIES, "data")
-        temp_out = os.path.join(OUTPUT_DIR, "temp_ios")
-        for size in sizes:
-            output = os.path.join(temp_out, str(size) + '.png')
-            asset_gen_tools.resize_image(command, input_path, output, size)
 
-            output_path = IOS_LAUNCHER.format(size=size)
-            asset_gen_tools.convert_flatten_image(shell_commands.IMAGE_MAGICK_FLATTEN_COMMAND, output, output_path)
+        # Square resize (or rasterization) and alpha removal happen in one operation straight into IOS_LAUNCHER.
+        fused_command = shell_commands.FLATTEN_FUSED_COMMANDS.get(command)
+        if fused_command is None:
+            print('No fused flatten template for the launcher command {0}'.format(command))
+            raise ValueError('Unsupported launcher command')
+        jobs = [RenderJob(fused_command, input_path, IOS_LAUNCHER.format(size=size), size, background)
+                for size in sizes]
+        futures = render_scheduler.get_scheduler().submit_set(jobs, None, image_pyramid.ASSET_LAUNCHER)
 
         asset_gen_tools.copy(LAUNCHER_CONTENTS, IOS_LAUNCHER_DIR.format(client=self.client))
+        return futures
 
     def create_image(self, command, input_path, image):
         """
         :param command: the command line to use when running image creation process
         :param input_path: input image to be used
         :param image: which image in the set is being produced
-        :return: nothing
+        :return: futures of the submitted density set, the aliases of the image are placed once it has finished
         """
         output_densities = asset_gen_tools.get_json_array_from_file(FA_IOS_IMAGE_DENSITIES, "data")
 
-        i = 0
-        final_path = ""
-        for image_path in IMAGES_SOURCE:
+        jobs = []
+        for i, image_path in enumerate(IMAGES_SOURCE):
             output_path = image_path.format(image=image)
-            asset_gen_tools.resize_image(command, input_path, output_path, output_densities[i])
-            i = i + 1
-            final_path = output_path
+            jobs.append(RenderJob(command, input_path, output_path, output_densities[i]))
+
+        final_dir = os.path.dirname(jobs[-1].output_path)
+        total = len(jobs)
+        output_paths = [job.output_path for job in jobs]
+
+        def on_complete():
+            create_image_content_json(image, final_dir, total)
+            for alias in IMAGE_ALIASES.get(image, []):
+                place_alias(alias, output_paths)
 
-        create_image_content_json(image, os.path.dirname(final_path), i)
+        return render_scheduler.get_scheduler().submit_set(jobs, on_complete, image_pyramid.ASSET_IMAGES)
 
     def create_other_images(self, command):
         """
@@ -291,51 +314,57 @@ class Ios(MobilePlatform):
         universal_idiom = 'universal'
 
         for icon in icons:
-            self.image_loop(command, icons_path + "/" + icon, icon_densities, universal_idiom, self.swift)
+            self.image_loop(command, icons_path + "/" + icon, icon_densities, universal_idiom, self.swift,
+                            image_pyramid.ASSET_ICONS)
 
         for nav_icon in nav_icons:
-            self.image_loop(command, nav_icons_path + "/" + nav_icon, nav_icon_densities, universal_idiom, self.swift)
+            self.image_loop(command, nav_icons_path + "/" + nav_icon, nav_icon_densities, universal_idiom, self.swift,
+                            image_pyramid.ASSET_NAV_ICONS)
 
         for other in others:
-            self.image_loop(command, others_path + "/" + other, aux_image_densities, universal_idiom, self.swift)
+            self.image_loop(command, others_path + "/" + other, aux_image_densities, universal_idiom, self.swift,
+                            image_pyramid.ASSET_OTHER)
 
         for common in commons:
             if 'qr' in common:
                 self.image_loop(shell_commands.IMAGE_MAGICK_COMMAND, common_images_path + "/" + common,
-                                qr_frame_density, universal_idiom, self.swift)
+                                qr_frame_density, universal_idiom, self.swift, image_pyramid.ASSET_COMMON)
             if 'secured' in common:
                 self.image_loop(shell_commands.IMAGE_MAGICK_COMMAND, common_images_path + "/" + common, sbe_density,
-                                universal_idiom, self.swift)
+                                universal_idiom, self.swift, image_pyramid.ASSET_COMMON)
 
-    def image_loop(self, command, input_path, densities, idiom, swift):
+    def image_loop(self, command, input_path, densities, idiom, swift, asset_class=None):
         """
         :param command: the command line to use when running image creation process
         :param input_path: input image to be used
         :param densities: list of image densities to be created (for different mobile screen sizes/pixel densities)
         :param idiom: for which device is it being made (mac/iphone/ipad/universal)
         :param swift: instance object of the swift class (ios_swift.py)
-        :return: nothing
+        :param asset_class: asset class of the image, selects the pyramid mode (image_pyramid.py)
+        :return: futures of the submitted density set
         """
-        i = 0
-        final_path = ""
         image_temp = os.path.basename(input_path).split(".")
         if len(image_temp) < 2:
-            return
+            return []
         if len(image_temp[0]) < 1:
-            return
+            return []
         if len(image_temp[1]) > 4:
-            return
+            return []
         image = image_temp[0]
 
-        for image_path in IMAGES_SOURCE:
+        jobs = []
+        for i, image_path in enumerate(IMAGES_SOURCE):
             output_path = image_path.format(image=image)
-            asset_gen_tools.resize_image(command, input_path, output_path, densities[i])
-            i = i + 1
-            final_path = output_path
+            jobs.append(RenderJob(command, input_path, output_path, densities[i]))
 
-        create_image_content_json(image, os.path.dirname(final_path), i, idiom)
+        final_dir = os.path.dirname(jobs[-1].output_path)
+        total = len(jobs)
 
-        swift.append_image(image)
+        def on_complete():
+            create_image_content_json(image, final_dir, total, idiom)
+            swift.append_image(image)
+
+        return render_scheduler.get_scheduler().submit_set(jobs, on_complete, asset_class)
 
     def copy_welcome_screen(self, input_paths, image):
         """
@@ -353,7 +382,8 @@ class Ios(MobilePlatform):
                 density_track = 0
 
             output_path = IMAGES_SOURCE[density_track].format(image=real_image)
-            asset_gen_tools.copy(input_path, output_path)
+            # the temp welcome renders are removed by finish(), nothing rewrites them
+            asset_gen_tools.link_or_copy(input_path, output_path)
             density_track += 1
             final_path = output_path
             final_real_image = real_image
@@ -422,23 +452,46 @@ class Ios(MobilePlatform):
         output_densities = asset_gen_tools.get_json_array_from_file(FA_IOS_WELCOME_SCREEN_DENSITIES, "data")
 
         paths = []
+        scheduler = render_scheduler.get_scheduler()
+        engine = WelcomeScreenEngine({'primary': color_primary, 'secondary': color_secondary})
 
         for image in images:
-            i = 0
-            for unformatted_output_path in unformatted_output_paths:
-                temp_path = temp_path.format(image=image)
+            # One recoloured temp file per image, its density set is rendered as a whole from it.
+            image_temp_path = temp_path.format(image=image)
+            engine.write_recolored(input_path.format(image=image), image_temp_path)
+
+            jobs = []
+            for i, unformatted_output_path in enumerate(unformatted_output_paths):
                 output_path = unformatted_output_path.format(image=image)
-                with open(input_path.format(image=image), 'r') as welcome_file:
-                    welcome = welcome_file.read().replace("#DD4814", color_primary).replace("#002244", color_secondary)
-                    asset_gen_tools.save(temp_path, welcome)
-                    asset_gen_tools.resize_image(shell_commands.INKSCAPE_COMMAND, temp_path, output_path,
-                                                 output_densities[i])
+                jobs.append(RenderJob(shell_commands.INKSCAPE_COMMAND, image_temp_path, output_path,
+                                      output_densities[i]))
                 paths.append([output_path, image])
-                i = i + 1
+            scheduler.submit_set(jobs, None, image_pyramid.ASSET_WELCOME)
 
         return paths
 
 
+def place_alias(alias, output_paths):
+    """
+    :param alias: ImageAlias to place
+    :param output_paths: finished density outputs of the aliased image, smallest density first
+    :return: nothing, Contents.json lists the densities actually placed
+    """
+    alias_paths = [image_path.format(image=alias.name) for image_path in alias.sources]
+    placed = 0
+    for output_path, alias_path in zip(output_paths, alias_paths):
+        if not os.path.isfile(output_path):
+            # Contents.json numbers the scales from 1x, so placement stops at the first missing density
+            print('Alias {alias} stops at {scale}x, {path} not found'.format(alias=alias.name, scale=placed + 1,
+                                                                            path=output_path))
+            break
+        asset_gen_tools.link_or_copy(output_path, alias_path)
+        placed += 1
+    if placed == 0:
+        return
+    create_image_content_json(alias.name, os.path.dirname(alias_paths[0]), placed)
+
+
 def create_image_content_json(image_name, path, total, idiom='universal'):
     """
     :param image_name: name of image that content is being created for
@@ -473,14 +526,15 @@ def save_git_info():
     """
     :return:
     """
+    commit_count, commit_hash = git_operations.get_build_info()
     plist = ElementTree.Element('plist', {'version': '1.0'})
     dict_element = ElementTree.SubElement(plist, 'dict')
 
     ElementTree.SubElement(dict_element, 'key').text = 'commit_count'
-    ElementTree.SubElement(dict_element, 'string').text = str(git_operations.get_commit_count())
+    ElementTree.SubElement(dict_element, 'string').text = str(commit_count)
 
     ElementTree.SubElement(dict_element, 'key').text = 'commit_hash'
-    ElementTree.SubElement(dict_element, 'string').text = git_operations.get_hash()
+    ElementTree.SubElement(dict_element, 'string').text = commit_hash
 
     output = asset_gen_tools.prettify(plist, '    ')
     path = os.path.join(IOS_OUTPUT_DIR, 'AssetsVersion.plist')
@@ -0,0 +1,158 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+This file houses the memory-bounded handling of very large raster sources.
+
+A PNG/WebP source whose longest side exceeds RENDER_REDUCE_PX (4096 by default, 0 disables) is reduced once to that
+size, so the densities of every set decode the small copy instead of the original. The reduction runs through
+ImageMagick, which keeps within the resource limits given to it. The reduced copy is stored in the render cache like any
+render, so it counts towards RENDER_CACHE_MAX_MB and is evicted with the other entries; the copy the run reads lives in
+a temporary directory removed by cleanup_reduced().
+
+RENDER_MEMORY_MB sets a per-process memory budget: it is passed to ImageMagick as MAGICK_MEMORY_LIMIT/MAGICK_MAP_LIMIT
+(shell_commands.update_env), which spills the pixel cache to disk instead of growing, and sources that would not fit
+the budget once decoded are kept away from the in-process Pillow backend.
+"""
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+
+import image_probe
+import render_cache
+import shell_commands
+from environmentals import get_environ_val_default
+
+RENDER_REDUCE_PX_KEY = 'RENDER_REDUCE_PX'
+DEFAULT_REDUCE_PX = 4096
+REDUCED_DIR_PREFIX = 'reduced_'
+# bytes per decoded pixel, RGBA at 8 bits per channel
+DECODED_PIXEL_BYTES = 4
+
+_LOCKS = {}
+_LOCKS_LOCK = threading.Lock()
+_REDUCED_DIR = None
+_REDUCED_DIR_LOCK = threading.Lock()
+
+
+def get_reduce_px():
+    """
+    :return: longest side above which raster sources are reduced, 0 when disabled
+    """
+    return int(get_environ_val_default(RENDER_REDUCE_PX_KEY, DEFAULT_REDUCE_PX))
+
+
+def get_memory_budget():
+    """
+    :return: per-process memory budget in bytes, None when unbounded
+    """
+    memory_mb = shell_commands.get_render_memory_mb()
+    return memory_mb * 1024 * 1024 if memory_mb is not None else None
+
+
+def over_budget(input_path):
+    """
+    :param input_path: the file to be converted
+    :return: whether decoding the raster input in-process would exceed the memory budget
+    """
+    budget = get_memory_budget()
+    if budget is None:
+        return False
+    info = image_probe.probe(input_path)
+    if info is None or info.format not in image_probe.RASTER_FORMATS:
+        return False
+    return info.width * info.height * DECODED_PIXEL_BYTES > budget
+
+
+def reduced_size(info, limit):
+    """
+    :param info: ImageInfo of the source
+    :param limit: longest side of the reduced copy
+    :return: (width, height) of the reduced copy
+    """
+    scale = limit / float(max(info.width, info.height))
+    return max(1, int(round(info.width * scale))), max(1, int(round(info.height * scale)))
+
+
+def reduced_input(command_string, input_path, sizes):
+    """
+    :param command_string: resize commandline template
+    :param input_path: the file to be converted
+    :param sizes: sizes that will be rendered from the input
+    :return: path of the reduced copy when the input is over RENDER_REDUCE_PX and every size fits the copy,
+        input_path otherwise
+    """
+    limit = get_reduce_px()
+    if limit <= 0:
+        return input_path
+    info = image_probe.probe(input_path)
+    if info is None or info.format not in image_probe.RASTER_FORMATS or max(info.width, info.height) <= limit:
+        return input_path
+    width, height = reduced_size(info, limit)
+    for size in sizes:
+        target = image_probe.target_size(command_string, input_path, size)
+        if target is None or target[0] > width or target[1] > height:
+            return input_path
+    return _reduce(input_path, info, limit)
+
+
+def _reduce(input_path, info, limit):
+    """
+    :param input_path: raster source over the limit
+    :param info: ImageInfo of the source
+    :param limit: longest side of the reduced copy
+    :return: path of the reduced copy, fetched from the render cache or created on first use
+    """
+    output_path = os.path.join(_reduced_dir(), '{hash}_{limit}.{ext}'.format(
+        hash=render_cache.hash_file(input_path), limit=limit, ext=info.format))
+    command_string = shell_commands.IMAGE_MAGICK_REDUCE_COMMAND
+    cache = render_cache.get_cache()
+    with _lock_for(output_path):
+        if os.path.isfile(output_path):
+            return output_path
+        if cache is not None and cache.fetch(command_string, input_path, output_path, limit):
+            return output_path
+        print('Reducing {input} ({width}x{height}) to {limit}px once'.format(input=input_path, width=info.width,
+                                                                            height=info.height, limit=limit))
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        temp_path = '{path}.{thread}.tmp.{ext}'.format(path=output_path, thread=threading.get_ident(),
+                                                        ext=info.format)
+        command = shlex.split(command_string.format(input=input_path, output=temp_path, size=limit))
+        subprocess.check_output(command, env=shell_commands.ENV, stderr=subprocess.STDOUT)
+        os.replace(temp_path, output_path)
+        if cache is not None:
+            cache.store(command_string, input_path, output_path, limit)
+    return output_path
+
+
+def _reduced_dir():
+    """
+    :return: the temporary directory holding the reduced copies of this run, created on first use
+    """
+    global _REDUCED_DIR
+    with _REDUCED_DIR_LOCK:
+        if _REDUCED_DIR is None:
+            _REDUCED_DIR = tempfile.mkdtemp(prefix=REDUCED_DIR_PREFIX)
+        return _REDUCED_DIR
+
+
+def cleanup_reduced():
+    """
+    :return: nothing, removes the reduced copies of this run, the render cache keeps its own
+    """
+    global _REDUCED_DIR
+    with _REDUCED_DIR_LOCK:
+        if _REDUCED_DIR is not None:
+            shutil.rmtree(_REDUCED_DIR, True)
+            _REDUCED_DIR = None
+
+
+def _lock_for(path):
+    """
+    :param path: reduced copy path
+    :return: the lock serialising the creation of that copy
+    """
+    with _LOCKS_LOCK:
+        return _LOCKS.setdefault(path, threading.Lock())
@@ -0,0 +1,166 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+This file houses the store of the default localisation table (FINANCIAL_APP_DEF_LOCALISATION) used for the iOS
+strings files.
+
+The default table is parsed once through config_registry and indexed by language; the defaults of a language are
+keyed and escaped once, on first use. Reserved words are held in a set and the key rules (reserved word and short
+key suffixes) are applied once per distinct key. The strings of a language are returned as a merged view of the
+client strings over the prepared defaults, the default table is never copied per language.
+"""
+import os
+import threading
+from collections import ChainMap
+
+import config_registry
+
+LANGUAGES_TAG = "languages"
+KEY_SUFFIX = "_string"
+# keys shorter than this break the linting rules of the generated code
+MIN_KEY_LENGTH = 3
+ESCAPES = str.maketrans({'"': '\\"', '\n': '\\n', "'": "\\'"})
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+class KeyRules:
+    """
+    A class used to turn string names into iOS string keys.
+
+    Attributes
+    ----------
+    reserved : frozenset
+        words that cannot be used as keys as they are
+    keys : dict
+        memo of name -> key
+
+    Methods
+    -------
+    key(name)
+        The key of a string name, suffixed when it is reserved or too short.
+    escape(value)
+        The value with double quotes, single quotes and newlines escaped.
+    """
+    def __init__(self, reserved):
+        self.reserved = frozenset(reserved)
+        self.keys = {}
+
+    def key(self, name):
+        """
+        :param name: string name
+        :return: the iOS key of the name
+        """
+        key = self.keys.get(name)
+        if key is None:
+            key = name
+            # add suffix for reserved words
+            if key in self.reserved:
+                key += KEY_SUFFIX
+            # add suffix for short words (linting rules)
+            if len(key) < MIN_KEY_LENGTH:
+                key += KEY_SUFFIX
+            self.keys[name] = key
+        return key
+
+    @staticmethod
+    def escape(value):
+        """
+        :param value: string value
+        :return: the value escaped for a .strings file
+        """
+        return value.translate(ESCAPES)
+
+    def add(self, name, value, dictionary_data):
+        """
+        :param name: string name
+        :param value: string value
+        :param dictionary_data: the dictionary receiving the key and escaped value
+        :return: nothing
+        """
+        dictionary_data[self.key(name)] = self.escape(value)
+
+
+class LocalisationStore:
+    """
+    A class used to hold the default localisation table, indexed by language.
+
+    Attributes
+    ----------
+    path : str
+        absolute path of the default localisation file
+    rules : KeyRules
+        key rules applied to defaults and client strings
+
+    Methods
+    -------
+    has_language(lang)
+        Whether the default table has the language.
+    defaults(lang)
+        The keyed and escaped default strings of a language.
+    merged(lang, strings)
+        The client strings of a language over its defaults, as one mapping.
+    """
+    def __init__(self, path, rules):
+        self.path = path
+        self.rules = rules
+        self.languages = None
+        self.prepared = {}
+        self.lock = threading.Lock()
+
+    def has_language(self, lang):
+        """
+        :param lang: language code
+        :return: whether the default table has defaults for the language
+        """
+        return lang in config_registry.get_registry().get(self.path, LANGUAGES_TAG)
+
+    def defaults(self, lang):
+        """
+        :param lang: language as named in the default table
+        :return: read-only view of key -> escaped value, prepared once per language, raises ValueError when the
+        default table does not have the language
+        """
+        languages = config_registry.get_registry().get(self.path, LANGUAGES_TAG)
+        with self.lock:
+            if languages is not self.languages:
+                # first use, or the file changed since the languages were prepared
+                self.languages = languages
+                self.prepared = {}
+            prepared = self.prepared.get(lang)
+            if prepared is None:
+                if lang not in languages:
+                    print('Language {lang} not found in {path}'.format(lang=lang, path=self.path))
+                    raise ValueError('No default strings for language {0}'.format(lang))
+                prepared = {}
+                for name, value in languages[lang].items():
+                    self.rules.add(name, value, prepared)
+                self.prepared[lang] = prepared
+            return prepared
+
+    def merged(self, lang, strings):
+        """
+        :param lang: language as named in the default table
+        :param strings: (name, text) client strings of the language
+        :return: mapping of the client strings over the defaults, in the order defaults then new client keys
+        """
+        overrides = {}
+        for name, text in strings:
+            self.rules.add(name, text, overrides)
+        return ChainMap(overrides, self.defaults(lang))
+
+
+def get_store(path, reserved):
+    """
+    :param path: default localisation file
+    :param reserved: reserved words, used when the store of the file is created
+    :return: the process-wide store of the file
+    """
+    key = os.path.abspath(path)
+    with _STORES_LOCK:
+        store = _STORES.get(key)
+        if store is None:
+            store = LocalisationStore(key, KeyRules(reserved))
+            _STORES[key] = store
+        return store
@@ -0,0 +1,94 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+This file houses the compiled index of the build flag mutexes (FINANCIAL_APP_BUILD_FLAG_MUTEXES).
+
+The mutex definitions are compiled once per file into name <-> id maps and a symmetric conflict set per id, so
+checking a flavour or a language is one set intersection per active flag, and every conflicting pair is found in the
+same pass. The index is compiled again only when config_registry hands out a new parse of the file.
+"""
+import os
+import threading
+
+import config_registry
+
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+class MutexIndex:
+    """
+    A class used to hold the compiled mutex definitions of one file.
+
+    Attributes
+    ----------
+    ids_by_name : dict
+        mutex name -> mutex id
+    names_by_id : dict
+        mutex id -> mutex name
+    mutexes_by_id : dict
+        mutex id -> mutex_with as defined in the file
+    conflicts_by_id : dict
+        mutex id -> frozenset of the ids it conflicts with, in either direction
+
+    Methods
+    -------
+    name_of(mutex_id)
+        Name of a mutex id, the id itself when the file does not name it.
+    conflicts(active_ids)
+        Every conflicting pair among the active ids.
+    """
+    def __init__(self, mutex_configs):
+        self.ids_by_name = {}
+        self.names_by_id = {}
+        self.mutexes_by_id = {}
+        conflicts = {}
+        for mutex_config in mutex_configs:
+            mutex_id = mutex_config["mutex_id"]
+            self.ids_by_name[mutex_config["name"]] = mutex_id
+            self.names_by_id.setdefault(mutex_id, mutex_config["name"])
+            self.mutexes_by_id.setdefault(mutex_id, mutex_config["mutex_with"])
+            for other_id in mutex_config["mutex_with"]:
+                conflicts.setdefault(mutex_id, set()).add(other_id)
+                conflicts.setdefault(other_id, set()).add(mutex_id)
+        self.conflicts_by_id = dict((mutex_id, frozenset(ids)) for mutex_id, ids in conflicts.items())
+
+    def name_of(self, mutex_id):
+        """
+        :param mutex_id: the integer id that uniquely identifies the mutex
+        :return: the name of the mutex, the id when it is not named in the file
+        """
+        return self.names_by_id.get(mutex_id, mutex_id)
+
+    def conflicts(self, active_ids):
+        """
+        :param active_ids: ids of the enabled flags, in the order they were found
+        :return: list of (id, id) pairs that are mutually exclusive, each pair once, in the order of active_ids
+        """
+        active = frozenset(active_ids)
+        pairs = []
+        seen = set()
+        for mutex_id in active_ids:
+            if mutex_id in seen:
+                continue
+            seen.add(mutex_id)
+            for other_id in sorted(self.conflicts_by_id.get(mutex_id, frozenset()) & active):
+                if other_id == mutex_id or other_id not in seen:
+                    pairs.append((mutex_id, other_id))
+        return pairs
+
+
+def get_index(file, data_tag):
+    """
+    :param file: the file location where the mutexes are defined
+    :param data_tag: the root tag of the json file
+    :return: the compiled MutexIndex of the file
+    """
+    mutex_configs = config_registry.get_registry().get(file, data_tag)
+    key = (os.path.abspath(file), data_tag)
+    with _INDEXES_LOCK:
+        entry = _INDEXES.get(key)
+        if entry is None or entry[0] is not mutex_configs:
+            entry = (mutex_configs, MutexIndex(mutex_configs))
+            _INDEXES[key] = entry
+        return entry[1]
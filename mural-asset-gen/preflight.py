@@ -0,0 +1,71 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+This file houses the preflight checks run on a client bundle before anything is rendered or written.
+
+Each check returns the list of problems it found instead of raising, so process_client can report every problem of
+the bundle (image types and files, colors, strings) together and stop in well under a second, rather than on the
+first one after minutes of rendering.
+"""
+import os
+import re
+
+COLOR_PATTERN = re.compile(r'^#?(?:[0-9a-fA-F]{3}|[0-9a-fA-F]{4}|[0-9a-fA-F]{6}|[0-9a-fA-F]{8})$')
+
+
+def check_images(image_types, images, supported_types, image_path):
+    """
+    :param image_types: client image name -> type
+    :param images: images the run will render, in order, duplicates are checked once
+    :param supported_types: image types that can be rendered
+    :param image_path: callable (image, image type) -> path of the client image file
+    :return: list of problems
+    """
+    problems = []
+    for image in dict.fromkeys(images):
+        image_type = image_types.get(image)
+        if image_type is None:
+            problems.append('Image {image} has no type in app_images'.format(image=image))
+        elif image_type not in supported_types:
+            problems.append('Image {image} has unsupported type {type}, expected one of {supported}'.format(
+                image=image, type=image_type, supported=list(supported_types)))
+        elif not os.path.isfile(image_path(image, image_type)):
+            problems.append('Image {image} not found at {path}'.format(image=image,
+                                                                       path=image_path(image, image_type)))
+    return problems
+
+
+def check_colors(colors, required):
+    """
+    :param colors: client color name -> color code, None when the bundle has none
+    :param required: color names the run needs
+    :return: list of problems
+    """
+    if colors is None:
+        return ['No app_colors given']
+    problems = []
+    for name in required:
+        if not colors.get(name):
+            problems.append('Color {name} is required but not given in app_colors'.format(name=name))
+    for name, color in colors.items():
+        if color and not COLOR_PATTERN.match(color.strip()):
+            problems.append('Color {name} has value "{color}", expected #RGB, #ARGB, #RRGGBB or #AARRGGBB'.format(
+                name=name, color=color))
+    return problems
+
+
+def report(client, problems):
+    """
+    :param client: client name
+    :param problems: every problem found in the bundle
+    :return: nothing, raises ValueError when there is any problem
+    """
+    if len(problems) == 0:
+        print('Preflight passed for "{0}"'.format(client))
+        return
+    print("A configuration anomaly has been detected.")
+    print('Preflight found {count} problems in the bundle of "{client}":'.format(count=len(problems), client=client))
+    for problem in problems:
+        print('  ' + problem)
+    raise ValueError('Client bundle of {client} failed preflight with {count} problems'.format(client=client,
+                                                                                           count=len(problems)))
@@ -0,0 +1,420 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+This file houses the raster backends used by asset_gen_tools.resize_image and convert_flatten_image.
+
+The cli backend formats the shell_commands template and runs the external tool, exactly as before. The pillow backend
+performs the same ImageMagick operations (width resize, square resize, flatten, fused square resize and flatten)
+in-process for PNG/WebP inputs, which saves a process launch and a PNG re-decode per output. Both backends produce
+outputs of the same dimensions.
+
+The inkscape-shell backend sends Inkscape exports to the persistent worker pool in inkscape_shell, when enabled.
+
+The backend is picked automatically per call: pillow when it is installed and understands the command and input,
+inkscape-shell for Inkscape exports when the pool is enabled, cli otherwise. RASTER_BACKEND=cli|pillow|inkscape-shell|
+auto overrides the choice. A forced backend only takes the operations it implements (pillow the ImageMagick ones,
+inkscape-shell the Inkscape exports), the others still run through cli; it raises instead of falling back when it is
+unavailable (Pillow missing, input format Pillow cannot read, shell pool disabled).
+"""
+import os
+import shlex
+import subprocess
+
+import inkscape_shell
+import shell_commands
+import toolchain
+from environmentals import get_environ_val_default
+
+try:
+    from PIL import Image, ImageColor, features
+    HAS_PILLOW = True
+    HAS_PILLOW_WEBP = features.check('webp')
+except ImportError:
+    Image = None
+    ImageColor = None
+    HAS_PILLOW = False
+    HAS_PILLOW_WEBP = False
+
+RASTER_BACKEND_KEY = 'RASTER_BACKEND'
+BACKEND_AUTO = 'auto'
+BACKEND_CLI = 'cli'
+BACKEND_PILLOW = 'pillow'
+BACKEND_INKSCAPE_SHELL = 'inkscape-shell'
+
+OP_RESIZE_WIDTH = 'resize_width'
+OP_RESIZE_SQUARE = 'resize_square'
+OP_RESIZE_SQUARE_FLATTEN = 'resize_square_flatten'
+
+WEBP_EXTENSION = '.webp'
+PILLOW_INPUT_EXTENSIONS = ('.png', WEBP_EXTENSION)
+FLATTEN_BACKGROUND = 'white'
+
+
+def has_inkscape_actions():
+    """
+    :return: whether the installed Inkscape understands --actions (1.x), according to the toolchain registry
+    """
+    return toolchain.get_registry().supports(toolchain.TOOL_INKSCAPE, toolchain.FEATURE_ACTIONS)
+
+
+def cli_template(command_string):
+    """
+    :param command_string: commandline template from shell_commands
+    :return: the template to run with the installed tool version
+    """
+    modern = shell_commands.INKSCAPE_EXPORT_FILENAME_COMMANDS.get(command_string)
+    if modern is not None and toolchain.get_registry().supports(toolchain.TOOL_INKSCAPE,
+                                                                toolchain.FEATURE_EXPORT_FILENAME):
+        return modern
+    return command_string
+
+
+class CliBackend:
+    """
+    A class used to run image operations through the external tool named in the command template.
+
+    Methods
+    -------
+    supports(command_string, input_path)
+        Always True, the template is executed as is.
+    resize(command_string, input_path, output_path, size, background=None)
+        Runs a resize template.
+    resize_batch(command_string, input_path, outputs, background=None)
+        Writes every (output_path, size) of a density set with a single tool invocation where possible.
+    flatten(command_string, input_path, output_path)
+        Runs a flatten template.
+    version(command_string)
+        Version line of the tool, used in render cache keys.
+    """
+    name = BACKEND_CLI
+
+    def supports(self, command_string, input_path):
+        """
+        :param command_string: commandline template
+        :param input_path: the file to be converted
+        :return: True
+        """
+        return True
+
+    def resize(self, command_string, input_path, output_path, size, background=None):
+        """
+        :param command_string: commandline template to be executed
+        :param input_path: the file to be converted
+        :param output_path: the path where the output should be written
+        :param size: image size for the output image
+        :param background: background color for templates that flatten, ignored by the others
+        :return: nothing
+        """
+        command = shlex.split(cli_template(command_string).format(input=input_path, size=size, output=output_path,
+                                                                  background=background or FLATTEN_BACKGROUND))
+        subprocess.check_output(command, env=shell_commands.ENV)
+
+    def supports_batch(self, command_string):
+        """
+        :param command_string: single-output commandline template
+        :return: whether a multi-output template exists and the installed tool understands it
+        """
+        if command_string not in shell_commands.BATCH_COMMANDS:
+            return False
+        if command_string in shell_commands.INKSCAPE_BATCH_TEMPLATES:
+            return has_inkscape_actions()
+        return True
+
+    def resize_batch(self, command_string, input_path, outputs, background=None):
+        """
+        :param command_string: single-output commandline template
+        :param input_path: the file to be converted
+        :param outputs: list of (output_path, size)
+        :param background: background color for templates that flatten, ignored by the others
+        :return: nothing
+        """
+        if not self.supports_batch(command_string):
+            for output_path, size in outputs:
+                self.resize(command_string, input_path, output_path, size, background)
+            return
+
+        batch_command, fragment, separator = shell_commands.BATCH_COMMANDS[command_string]
+        formatted = separator.join(fragment.format(output=output_path, size=size,
+                                                   background=background or FLATTEN_BACKGROUND)
+                                   for output_path, size in outputs)
+        command = shlex.split(batch_command.format(input=input_path, outputs=formatted))
+        for output_path, _ in outputs:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+        try:
+            subprocess.check_output(command, env=shell_commands.ENV, stderr=subprocess.STDOUT)
+            missing = [(output_path, size) for output_path, size in outputs if not os.path.isfile(output_path)]
+        except subprocess.CalledProcessError as batch_exception:
+            print('Batch render of {input} failed: {error}'.format(
+                input=input_path, error=batch_exception.output.decode('utf-8', 'replace').strip()))
+            missing = [(output_path, size) for output_path, size in outputs
+                       if not os.path.isfile(output_path) or os.path.getsize(output_path) == 0]
+        if len(missing) > 0:
+            self._retry_outputs(command_string, input_path, missing, background)
+
+    def _retry_outputs(self, command_string, input_path, missing, background):
+        """
+        :param command_string: single-output commandline template
+        :param input_path: the file to be converted
+        :param missing: list of (output_path, size) the batch did not produce
+        :param background: background color for templates that flatten
+        :return: nothing, raises once every missing output has been retried and reported
+        """
+        failures = []
+        for output_path, size in missing:
+            try:
+                self.resize(command_string, input_path, output_path, size, background)
+            except (OSError, subprocess.CalledProcessError) as output_exception:
+                print('Failed to render {output} at size {size} from {input}: {error}'.format(
+                    output=output_path, size=size, input=input_path, error=output_exception))
+                failures.append(output_path)
+        if len(failures) > 0:
+            raise RuntimeError('{count} of the density outputs of {input} could not be rendered: {failures}'.format(
+                count=len(failures), input=input_path, failures=failures))
+
+    def flatten(self, command_string, input_path, output_path):
+        """
+        :param command_string: image flatten command template
+        :param input_path: file to be flattened
+        :param output_path: path to write flattened file to
+        :return: nothing
+        """
+        command = shlex.split(cli_template(command_string).format(input=input_path, output=output_path))
+        subprocess.check_output(command, env=shell_commands.ENV)
+
+    def version(self, command_string):
+        """
+        :param command_string: commandline template, the first token is the binary
+        :return: version line of the binary from the toolchain registry, 'unknown' if it is not installed
+        """
+        return toolchain.get_registry().version(command_string)
+
+
+class PillowBackend:
+    """
+    A class used to run the ImageMagick resize/flatten templates in-process with Pillow.
+
+    Methods
+    -------
+    supports(command_string, input_path)
+        Whether the template is a known ImageMagick operation and the input a PNG/WebP file.
+    resize(command_string, input_path, output_path, size, background=None)
+        Width resize (-resize {size}), square resize (-resize {size}x{size}!) or square resize onto a background.
+    resize_batch(command_string, input_path, outputs, background=None)
+        Decodes the input once and writes every (output_path, size).
+    flatten(command_string, input_path, output_path)
+        Removes the alpha channel onto a white background (-alpha remove -alpha off -flatten).
+    version(command_string)
+        Pillow version, used in render cache keys.
+    """
+    name = BACKEND_PILLOW
+
+    RESIZE_OPERATIONS = {shell_commands.IMAGE_MAGICK_COMMAND: OP_RESIZE_WIDTH,
+                         shell_commands.IMAGE_MAGICK_SQUARE_COMMAND: OP_RESIZE_SQUARE,
+                         shell_commands.IMAGE_MAGICK_SQUARE_FLATTEN_COMMAND: OP_RESIZE_SQUARE_FLATTEN}
+    FLATTEN_OPERATIONS = {shell_commands.IMAGE_MAGICK_FLATTEN_COMMAND}
+
+    def supports(self, command_string, input_path):
+        """
+        :param command_string: commandline template
+        :param input_path: the file to be converted
+        :return: whether this backend can perform the operation
+        """
+        if not HAS_PILLOW:
+            return False
+        extension = os.path.splitext(input_path)[1].lower()
+        if extension not in PILLOW_INPUT_EXTENSIONS or (extension == WEBP_EXTENSION and not HAS_PILLOW_WEBP):
+            return False
+        return command_string in self.RESIZE_OPERATIONS or command_string in self.FLATTEN_OPERATIONS
+
+    def resize(self, command_string, input_path, output_path, size, background=None):
+        """
+        :param command_string: commandline template, selects the resize operation
+        :param input_path: the file to be converted
+        :param output_path: the path where the output should be written
+        :param size: image size for the output image
+        :param background: background color for templates that flatten, ignored by the others
+        :return: nothing
+        """
+        self.resize_batch(command_string, input_path, [(output_path, size)], background)
+
+    def resize_batch(self, command_string, input_path, outputs, background=None):
+        """
+        :param command_string: commandline template, selects the resize operation
+        :param input_path: the file to be converted
+        :param outputs: list of (output_path, size)
+        :param background: background color for templates that flatten, ignored by the others
+        :return: nothing
+        """
+        operation = self.RESIZE_OPERATIONS[command_string]
+        with Image.open(input_path) as source:
+            image = _normalise_mode(source)
+            for output_path, size in outputs:
+                size = int(size)
+                if operation == OP_RESIZE_WIDTH:
+                    width, height = image.size
+                    target = (size, max(1, int(round(height * size / float(width)))))
+                else:
+                    target = (size, size)
+                resized = image.resize(target, Image.LANCZOS)
+                if operation == OP_RESIZE_SQUARE_FLATTEN:
+                    resized = flatten_image(resized, background)
+                resized.save(output_path)
+
+    def flatten(self, command_string, input_path, output_path):
+        """
+        :param command_string: image flatten command template
+        :param input_path: file to be flattened
+        :param output_path: path to write flattened file to
+        :return: nothing
+        """
+        with Image.open(input_path) as source:
+            flatten_image(source).save(output_path)
+
+    def version(self, command_string):
+        """
+        :param command_string: commandline template
+        :return: the Pillow version
+        """
+        return 'Pillow ' + getattr(Image, '__version__', 'unknown')
+
+
+class InkscapeShellBackend:
+    """
+    A class used to route Inkscape exports to the persistent `inkscape --shell` worker pool.
+
+    Methods
+    -------
+    supports(command_string, input_path)
+        Whether the pool is enabled and the template has a shell request equivalent.
+    resize(command_string, input_path, output_path, size, background=None)
+        Runs the export on an idle shell worker.
+    resize_batch(command_string, input_path, outputs, background=None)
+        Runs the exports one after the other, the worker startup is already amortized.
+    version(command_string)
+        Version line of Inkscape, the same line the cli backend reports.
+    """
+    name = BACKEND_INKSCAPE_SHELL
+
+    def supports(self, command_string, input_path):
+        """
+        :param command_string: commandline template
+        :param input_path: the file to be converted
+        :return: whether this backend can perform the operation
+        """
+        return command_string in shell_commands.SHELL_REQUESTS and inkscape_shell.get_pool() is not None
+
+    def resize(self, command_string, input_path, output_path, size, background=None):
+        """
+        :param command_string: Inkscape commandline template, selects the shell request
+        :param input_path: the file to be converted
+        :param output_path: the path where the output should be written
+        :param size: image size for the output image
+        :param background: background color for templates that flatten, ignored by the others
+        :return: nothing
+        """
+        legacy_request, actions_request = shell_commands.SHELL_REQUESTS[command_string]
+        request = actions_request if has_inkscape_actions() else legacy_request
+        inkscape_shell.get_pool().export(request, os.path.abspath(input_path), os.path.abspath(output_path), size,
+                                         background or FLATTEN_BACKGROUND)
+
+    def resize_batch(self, command_string, input_path, outputs, background=None):
+        """
+        :param command_string: Inkscape commandline template
+        :param input_path: the file to be converted
+        :param outputs: list of (output_path, size)
+        :param background: background color for templates that flatten, ignored by the others
+        :return: nothing
+        """
+        for output_path, size in outputs:
+            self.resize(command_string, input_path, output_path, size, background)
+
+    def version(self, command_string):
+        """
+        :param command_string: commandline template
+        :return: the Inkscape version line, render_cache keys also hold the backend name so shell renders and cli
+        renders of the same export are cached as separate entries
+        """
+        return CLI_BACKEND.version(command_string)
+
+
+def _normalise_mode(image):
+    """
+    :param image: decoded PIL image
+    :return: an image in a mode that resizes without palette artefacts
+    """
+    if image.mode in ('RGB', 'RGBA', 'L', 'LA'):
+        return image
+    return image.convert('RGBA')
+
+
+def flatten_image(image, background=None):
+    """
+    :param image: decoded PIL image
+    :param background: color the transparent pixels are composed onto ('#RRGGBB' or a color name), white by default
+    :return: RGB image without alpha channel
+    """
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        rgba = image.convert('RGBA')
+        flat = Image.new('RGB', rgba.size, ImageColor.getrgb(background or FLATTEN_BACKGROUND))
+        flat.paste(rgba, mask=rgba.split()[3])
+        return flat
+    return image.convert('RGB')
+
+
+CLI_BACKEND = CliBackend()
+PILLOW_BACKEND = PillowBackend()
+INKSCAPE_SHELL_BACKEND = InkscapeShellBackend()
+BACKENDS = {BACKEND_CLI: CLI_BACKEND, BACKEND_PILLOW: PILLOW_BACKEND, BACKEND_INKSCAPE_SHELL: INKSCAPE_SHELL_BACKEND}
+
+
+def select_backend(command_string, input_path):
+    """
+    :param command_string: commandline template
+    :param input_path: the file to be converted
+    :return: the backend that will execute the operation
+    """
+    choice = get_environ_val_default(RASTER_BACKEND_KEY, BACKEND_AUTO)
+    if choice == BACKEND_CLI:
+        return CLI_BACKEND
+    if choice == BACKEND_INKSCAPE_SHELL:
+        if command_string not in shell_commands.SHELL_REQUESTS:
+            # only Inkscape exports go to the shell pool, the other operations keep running through their tool
+            return CLI_BACKEND
+        if inkscape_shell.get_pool() is None:
+            print('{key}={value} needs {workers} set to a positive number'.format(
+                key=RASTER_BACKEND_KEY, value=choice, workers=inkscape_shell.INKSCAPE_SHELL_WORKERS_KEY))
+            raise ValueError('The Inkscape shell pool is disabled')
+        return INKSCAPE_SHELL_BACKEND
+    if choice == BACKEND_PILLOW:
+        return _require_pillow(command_string, input_path)
+    if choice != BACKEND_AUTO:
+        raise ValueError('{key} must be one of {choices}, got {value}'.format(
+            key=RASTER_BACKEND_KEY, choices=[BACKEND_AUTO, BACKEND_CLI, BACKEND_PILLOW, BACKEND_INKSCAPE_SHELL],
+            value=choice))
+    if PILLOW_BACKEND.supports(command_string, input_path):
+        return PILLOW_BACKEND
+    if INKSCAPE_SHELL_BACKEND.supports(command_string, input_path):
+        return INKSCAPE_SHELL_BACKEND
+    # pillow cannot handle this operation (svg input, unknown template or library missing), fall back
+    return CLI_BACKEND
+
+
+def _require_pillow(command_string, input_path):
+    """
+    :param command_string: commandline template
+    :param input_path: the file to be converted
+    :return: the pillow backend for the ImageMagick operations it implements, cli for the others (Inkscape exports),
+    raises ValueError when Pillow is missing or cannot read the input
+    """
+    if not HAS_PILLOW:
+        print('{key}={value} but Pillow is not installed'.format(key=RASTER_BACKEND_KEY, value=BACKEND_PILLOW))
+        raise ValueError('Pillow is not installed')
+    if command_string not in PILLOW_BACKEND.RESIZE_OPERATIONS and \
+            command_string not in PILLOW_BACKEND.FLATTEN_OPERATIONS:
+        return CLI_BACKEND
+    if not PILLOW_BACKEND.supports(command_string, input_path):
+        print('{key}={value} but Pillow cannot read {input} (webp support: {webp})'.format(
+            key=RASTER_BACKEND_KEY, value=BACKEND_PILLOW, input=input_path, webp=HAS_PILLOW_WEBP))
+        raise ValueError('Pillow does not support the input {0}'.format(input_path))
+    return PILLOW_BACKEND
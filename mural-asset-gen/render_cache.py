@@ -0,0 +1,229 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+This file houses the persistent, content-addressed render cache.
+
+A rendered PNG is stored under a key made of the input file hash, the unformatted command template from
+shell_commands, the requested size and the backend and tool version that produced it. A later run that asks for the
+same render copies the cached file instead of spawning Inkscape/ImageMagick. The cache directory is capped in size,
+the least recently used entries are evicted first.
+
+With RENDER_CACHE_LINK=1 a hit is placed as a hard link to the entry instead of a copy. That is safe because renders
+are always written to a fresh file and entries are replaced by rename, so nothing rewrites a shared inode in place.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import asset_gen_tools
+import file_copy
+import raster_backend
+from environmentals import get_environ_val_default
+
+RENDER_CACHE_DIR_KEY = 'RENDER_CACHE_DIR'
+RENDER_CACHE_MAX_MB_KEY = 'RENDER_CACHE_MAX_MB'
+RENDER_CACHE_LINK_KEY = 'RENDER_CACHE_LINK'
+
+DEFAULT_CACHE_DIR = 'cache'
+DEFAULT_CACHE_MAX_MB = 1024
+CACHE_ENTRY_EXT = '.png'
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+_FILE_HASHES = {}
+
+
+def hash_file(path):
+    """
+    :param path: file to hash
+    :return: sha256 hex digest of the file contents, memoized on path, size and modification time
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    digest = _FILE_HASHES.get(memo_key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as input_file:
+            for block in iter(lambda: input_file.read(1024 * 1024), b''):
+                sha.update(block)
+        digest = sha.hexdigest()
+        _FILE_HASHES[memo_key] = digest
+    return digest
+
+
+def render_key(command_string, input_path, size, background=None):
+    """
+    :param command_string: unformatted command template
+    :param input_path: the file to be converted
+    :param size: requested size, None for size-less operations such as flatten
+    :param background: background color of flattening commands
+    :return: the cache key for this render
+    """
+    backend = raster_backend.select_backend(command_string, input_path)
+    sha = hashlib.sha256()
+    for part in (hash_file(input_path), command_string, str(size), str(background), backend.name,
+                 backend.version(command_string)):
+        sha.update(part.encode('utf-8'))
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+class RenderCache:
+    """
+    A class used to store rendered images on disk, addressed by render key, with LRU eviction.
+
+    Attributes
+    ----------
+    hits, misses, stores, evictions
+        counters reported at the end of the run
+
+    Methods
+    -------
+    fetch(command_string, input_path, output_path, size, background=None)
+        Places the cached render at output_path, returns False on a miss.
+    store(command_string, input_path, output_path, size, background=None)
+        Adds a freshly rendered output to the cache and evicts old entries when over the size cap.
+    report()
+        Prints the hit/miss counters.
+    """
+    def __init__(self, path, max_bytes, link=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.link = link
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._load_index()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key + CACHE_ENTRY_EXT)
+
+    def _load_index(self):
+        """
+        :return: nothing, rebuilds the LRU order from the entry modification times
+        """
+        found = []
+        if os.path.isdir(self.path):
+            for root, _, files in os.walk(self.path):
+                for cache_file in files:
+                    # entries live in <key[:2]>/, other files (toolchain) are not render entries
+                    if cache_file.endswith(CACHE_ENTRY_EXT) and os.path.basename(root) == cache_file[:2]:
+                        stat = os.stat(os.path.join(root, cache_file))
+                        found.append((stat.st_mtime, cache_file[:-len(CACHE_ENTRY_EXT)], stat.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.total_bytes += size
+
+    def fetch(self, command_string, input_path, output_path, size, background=None):
+        """
+        :param command_string: unformatted command template
+        :param input_path: the file to be converted
+        :param output_path: the path where the output should be written
+        :param size: requested size
+        :param background: background color of flattening commands
+        :return: True if the output was served from the cache
+        """
+        key = render_key(command_string, input_path, size, background)
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return False
+            self.entries.move_to_end(key)
+            self.hits += 1
+        entry_path = self._entry_path(key)
+        try:
+            os.utime(entry_path)
+            asset_gen_tools.create_needed_dirs(output_path)
+            # a hard link is only placed with RENDER_CACHE_LINK=1, renders are always written to a fresh file
+            # (asset_gen_tools.prepare_output) and entries replaced by rename, so neither side is rewritten in place
+            file_copy.copy_file(entry_path, output_path, immutable=self.link)
+        except OSError:
+            # entry vanished (evicted by another run sharing the cache), render it instead
+            with self.lock:
+                self.entries.pop(key, None)
+                self.hits -= 1
+                self.misses += 1
+            return False
+        return True
+
+    def store(self, command_string, input_path, output_path, size, background=None):
+        """
+        :param command_string: unformatted command template
+        :param input_path: the file that was converted
+        :param output_path: the rendered output
+        :param size: requested size
+        :param background: background color of flattening commands
+        :return: nothing
+        """
+        if not os.path.isfile(output_path):
+            return
+        key = render_key(command_string, input_path, size, background)
+        entry_path = self._entry_path(key)
+        asset_gen_tools.create_needed_dirs(entry_path)
+        temp_path = '{path}.{thread}.tmp'.format(path=entry_path, thread=threading.get_ident())
+        file_copy.copy_file(output_path, temp_path)
+        os.replace(temp_path, entry_path)
+        entry_size = os.path.getsize(entry_path)
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries[key]
+            self.entries[key] = entry_size
+            self.entries.move_to_end(key)
+            self.total_bytes += entry_size
+            self.stores += 1
+            evicted = self._evict()
+        for evicted_key in evicted:
+            try:
+                os.remove(self._entry_path(evicted_key))
+            except OSError:
+                pass
+
+    def _evict(self):
+        """
+        :return: keys removed from the index, least recently used first; caller holds the lock
+        """
+        evicted = []
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key, entry_size = self.entries.popitem(last=False)
+            self.total_bytes -= entry_size
+            self.evictions += 1
+            evicted.append(key)
+        return evicted
+
+    def report(self):
+        """
+        :return: nothing
+        """
+        print('Render cache: {hits} hits, {misses} misses, {stores} stored, {evictions} evicted, '
+              '{size:.1f} MB in {path}'.format(hits=self.hits, misses=self.misses, stores=self.stores,
+                                               evictions=self.evictions, size=self.total_bytes / (1024 * 1024),
+                                               path=self.path))
+
+
+def get_cache():
+    """
+    :return: the process-wide render cache, None when disabled with RENDER_CACHE_MAX_MB=0
+    """
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            max_mb = int(get_environ_val_default(RENDER_CACHE_MAX_MB_KEY, DEFAULT_CACHE_MAX_MB))
+            if max_mb <= 0:
+                return None
+            path = get_environ_val_default(RENDER_CACHE_DIR_KEY, DEFAULT_CACHE_DIR)
+            link = get_environ_val_default(RENDER_CACHE_LINK_KEY, '0') == '1'
+            _CACHE = RenderCache(path, max_mb * 1024 * 1024, link)
+        return _CACHE
+
+
+def report_cache():
+    """
+    :return: nothing
+    """
+    if _CACHE is not None:
+        _CACHE.report()
@@ -0,0 +1,274 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+This file houses the render scheduler. Image stages submit rasterization jobs (resize / flatten) to a bounded pool of
+workers and get futures back, so density sets of different images are rendered concurrently instead of one by one.
+
+Every job is an external tool invocation, so each worker thread simply drives one converter process at a time; the
+worker count therefore caps the number of concurrent Inkscape/ImageMagick processes.
+Density sets are rendered with one tool invocation per source where the tool supports multi-output commands
+(RENDER_BATCH=0 disables this), or as a pyramid for the asset classes selected in image_pyramid.
+Jobs with a .webp output are rendered to a png and encoded once their set is done, see webp_encoder.
+Completion callbacks (Contents.json, Swift bookkeeping, copies of rendered files) are queued with the scheduler and run
+on the calling thread, in submission order, when the scheduler is drained.
+"""
+import os
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import asset_gen_tools
+import image_pyramid
+import render_cache
+import webp_encoder
+from environmentals import get_environ_val_default
+
+RENDER_WORKERS_KEY = 'RENDER_WORKERS'
+RENDER_BATCH_KEY = 'RENDER_BATCH'
+
+# background is only read by flattening commands such as IMAGE_MAGICK_SQUARE_FLATTEN_COMMAND
+RenderJob = namedtuple('RenderJob', ['command', 'input_path', 'output_path', 'size', 'background'],
+                       defaults=(None,))
+
+_SCHEDULER = None
+
+
+def get_render_workers():
+    """
+    :return: the number of render workers, from RENDER_WORKERS or the cpu count of the machine
+    """
+    workers = get_environ_val_default(RENDER_WORKERS_KEY, None)
+    if workers is None:
+        return os.cpu_count() or 1
+    workers = int(workers)
+    if workers < 1:
+        raise ValueError('{key} must be a positive number, got {value}'.format(key=RENDER_WORKERS_KEY,
+                                                                             value=workers))
+    return workers
+
+
+def use_batch():
+    """
+    :return: whether density sets are rendered with multi-output commands
+    """
+    return get_environ_val_default(RENDER_BATCH_KEY, '1') != '0'
+
+
+def run_job(job):
+    """
+    :param job: the render job to execute, a job without a size is a flatten job
+    :return: the output path of the job
+    """
+    cache = render_cache.get_cache()
+    if cache is not None and cache.fetch(job.command, job.input_path, job.output_path, job.size, job.background):
+        return job.output_path
+
+    if job.size is None:
+        asset_gen_tools.convert_flatten_image(job.command, job.input_path, job.output_path)
+    else:
+        asset_gen_tools.resize_image(job.command, job.input_path, job.output_path, job.size, job.background)
+
+    if cache is not None:
+        cache.store(job.command, job.input_path, job.output_path, job.size, job.background)
+    return job.output_path
+
+
+def run_pyramid(jobs):
+    """
+    :param jobs: render jobs of one density set sharing command and input
+    :return: the output path of the largest job
+    """
+    largest, derived = image_pyramid.split_largest(jobs)
+    run_job(largest)
+    if len(derived) == 0:
+        return largest.output_path
+
+    cache = render_cache.get_cache()
+    source = None
+    try:
+        for job in derived:
+            command = image_pyramid.cache_command(job.command, largest.size)
+            if cache is not None and cache.fetch(command, job.input_path, job.output_path, job.size, job.background):
+                continue
+            if source is None:
+                source = image_pyramid.open_render(largest.output_path)
+            asset_gen_tools.prepare_output(largest.output_path, job.output_path)
+            image_pyramid.downscale(source, job.output_path, job.size)
+            if cache is not None:
+                cache.store(command, job.input_path, job.output_path, job.size, job.background)
+    finally:
+        if source is not None:
+            source.close()
+    return largest.output_path
+
+
+def run_batch(jobs):
+    """
+    :param jobs: render jobs of one density set, grouped per command and input into one invocation each
+    :return: the output path of the last job
+    """
+    cache = render_cache.get_cache()
+    groups = OrderedDict()
+    for job in jobs:
+        if cache is not None and cache.fetch(job.command, job.input_path, job.output_path, job.size, job.background):
+            continue
+        groups.setdefault((job.command, job.input_path, job.background), []).append(job)
+
+    for (command, input_path, background), pending in groups.items():
+        asset_gen_tools.resize_image_batch(command, input_path, [(job.output_path, job.size) for job in pending],
+                                           background)
+        if cache is not None:
+            for job in pending:
+                cache.store(job.command, job.input_path, job.output_path, job.size, job.background)
+    return jobs[-1].output_path
+
+
+def run_chain(jobs):
+    """
+    :param jobs: render jobs that depend on each other, executed in order
+    :return: the output path of the last job
+    """
+    output_path = None
+    for job in jobs:
+        output_path = run_job(job)
+    return output_path
+
+
+def run_webp(run_set, jobs):
+    """
+    :param run_set: run_chain, run_pyramid or run_batch
+    :param jobs: render jobs, outputs ending in .webp are rendered to a png intermediate and encoded afterwards
+    :return: the output path returned by run_set, as requested by the job
+    """
+    intermediates = dict((job.output_path, webp_encoder.intermediate_path(job.output_path)) for job in jobs
+                         if webp_encoder.is_webp(job.output_path))
+    if len(intermediates) == 0:
+        return run_set(jobs)
+
+    def rewrite(job):
+        return job._replace(input_path=intermediates.get(job.input_path, job.input_path),
+                            output_path=intermediates.get(job.output_path, job.output_path))
+
+    output_path = run_set([rewrite(job) for job in jobs])
+    webp_encoder.get_encoder().encode_set([(png_path, webp_path) for webp_path, png_path in intermediates.items()])
+    requested = dict((png_path, webp_path) for webp_path, png_path in intermediates.items())
+    return requested.get(output_path, output_path)
+
+
+class RenderScheduler:
+    """
+    A class used to queue rasterization jobs on a bounded worker pool.
+
+    Attributes
+    ----------
+    workers
+        the maximum number of jobs executed concurrently
+
+    Methods
+    -------
+    submit(job)
+        Queues a single render job, returns its future.
+    submit_set(jobs, on_complete=None, asset_class=None)
+        Queues a density set (pyramid, batched or one job per density), on_complete runs once it has finished.
+    after(futures, callback)
+        Registers a callback that runs once the given futures (or everything submitted so far) have finished.
+    drain()
+        Waits for every submitted job and runs the completion callbacks in submission order.
+    shutdown()
+        Drains the queue and stops the workers.
+    """
+    def __init__(self, workers=None):
+        self.workers = workers if workers else get_render_workers()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.submitted = []
+        self.callbacks = []
+
+    def submit(self, job):
+        """
+        :param job: the render job
+        :return: future resolving to the output path
+        """
+        future = self.executor.submit(run_webp, run_chain, [job])
+        self.submitted.append(future)
+        return future
+
+    def submit_set(self, jobs, on_complete=None, asset_class=None):
+        """
+        :param jobs: render jobs of one density set
+        :param on_complete: callable without arguments, run once the whole set has been rendered
+        :param asset_class: asset class of the set, see image_pyramid.ASSET_CLASSES
+        :return: list of futures, one per job (a single future when the set is rendered as a whole)
+        """
+        if len(jobs) > 1 and image_pyramid.use_pyramid(asset_class):
+            futures = [self._submit_whole_set(run_pyramid, jobs)]
+        elif len(jobs) > 1 and use_batch():
+            futures = [self._submit_whole_set(run_batch, jobs)]
+        else:
+            futures = [self.submit(job) for job in jobs]
+        if on_complete is not None:
+            self.after(futures, on_complete)
+        return futures
+
+    def _submit_whole_set(self, run_set, jobs):
+        """
+        :param run_set: run_pyramid or run_batch
+        :param jobs: render jobs of one density set
+        :return: future resolving to the output path returned by run_set
+        """
+        future = self.executor.submit(run_webp, run_set, jobs)
+        self.submitted.append(future)
+        return future
+
+    def after(self, futures, callback):
+        """
+        :param futures: futures to wait for, None waits for every job submitted so far
+        :param callback: callable without arguments
+        :return: nothing
+        """
+        if futures is None:
+            futures = list(self.submitted)
+        self.callbacks.append((futures, callback))
+
+    def drain(self):
+        """
+        :return: nothing
+        """
+        while self.callbacks or self.submitted:
+            callbacks = self.callbacks
+            submitted = self.submitted
+            self.callbacks = []
+            self.submitted = []
+            for futures, callback in callbacks:
+                for future in futures:
+                    future.result()
+                callback()
+            for future in submitted:
+                future.result()
+
+    def shutdown(self):
+        """
+        :return: nothing
+        """
+        try:
+            self.drain()
+        finally:
+            self.executor.shutdown(wait=True)
+
+
+def get_scheduler():
+    """
+    :return: the process-wide render scheduler, created on first use
+    """
+    global _SCHEDULER
+    if _SCHEDULER is None:
+        _SCHEDULER = RenderScheduler()
+    return _SCHEDULER
+
+
+def shutdown_scheduler():
+    """
+    :return: nothing
+    """
+    global _SCHEDULER
+    if _SCHEDULER is not None:
+        _SCHEDULER.shutdown()
+        _SCHEDULER = None
@@ -2,13 +2,22 @@
 Author/Engineer: Lerato Mokoena
 
 This file houses shell commands that are frequently required during the process of asset generation.
+
+Besides the string templates used with shlex, it offers an asyncio runner for argv templates: lists of arguments whose
+items are formatted one by one, so no shell-string round trip is needed. The runner bounds the number of concurrent
+processes, applies a timeout per call, streams stderr into a bounded buffer while the process runs and raises
+CommandError carrying the failing argv. run_commands() awaits a whole batch from synchronous code such as
+process_client.
 """
+import asyncio
 import shlex
 import subprocess
 import sys
 import os
+from collections import deque, namedtuple
 
 import windows
+from environmentals import get_environ_val_default
 
 IS_WIN = (sys.platform == 'win32')
 
@@ -23,11 +32,33 @@ def find_bin(command_name):
         return command_name
 
 
+RENDER_MEMORY_MB_KEY = 'RENDER_MEMORY_MB'
+
+
+def get_render_memory_mb():
+    """
+    :return: per-process memory budget of the render tools in MB, None when unbounded
+    """
+    memory_mb = get_environ_val_default(RENDER_MEMORY_MB_KEY, None)
+    if memory_mb is None:
+        return None
+    memory_mb = int(memory_mb)
+    if memory_mb < 1:
+        raise ValueError('{key} must be a positive number, got {value}'.format(key=RENDER_MEMORY_MB_KEY,
+                                                                             value=memory_mb))
+    return memory_mb
+
+
 def update_env():
     """
     :return: a copy of the environment variables
     """
     env = os.environ.copy()
+    memory_mb = get_render_memory_mb()
+    if memory_mb is not None:
+        # ImageMagick spills its pixel cache to disk beyond these, explicit MAGICK_ variables win
+        env.setdefault('MAGICK_MEMORY_LIMIT', '{0}MiB'.format(memory_mb))
+        env.setdefault('MAGICK_MAP_LIMIT', '{0}MiB'.format(memory_mb * 2))
     if IS_WIN:
         return windows.update_env(env)
     else:
@@ -51,12 +82,227 @@ IMAGE_MAGICK_COMMAND = CONVERT_BIN + ' "{input}" -resize {size} "{output}"'
 IMAGE_MAGICK_COLOR_COMMAND = CONVERT_BIN + ' "{input}" +level-colors "{color}" "{output}"'
 IMAGE_MAGICK_COMBINE_COMMAND = COMPOSITE_BIN + ' "{output}" "{input}" "{output}"'
 IMAGE_MAGICK_FLATTEN_COMMAND = CONVERT_BIN + ' "{input}" -alpha remove -alpha off -flatten "{output}"'
+IMAGE_MAGICK_REDUCE_COMMAND = CONVERT_BIN + ' "{input}" -resize "{size}x{size}>" "{output}"'
+IMAGE_MAGICK_SQUARE_FLATTEN_COMMAND = CONVERT_BIN + ' "{input}" -resize {size}x{size}! -background "{background}" ' \
+                                                    '-alpha remove -alpha off "{output}"'
 
 INKSCAPE_SQUARE_COMMAND = INKSCAPE_BIN + ' -z -e "{output}" -w {size} -h {size} "{input}"'
 INKSCAPE_COMMAND = INKSCAPE_BIN + ' -z -e "{output}" -w {size} "{input}"'
 INKSCAPE_CONVERT = INKSCAPE_BIN + ' -z -e "{output}" "{input}"'
+INKSCAPE_SQUARE_FLATTEN_COMMAND = INKSCAPE_BIN + ' -z -e "{output}" -w {size} -h {size} -b "{background}" -y 1 ' \
+                                                 '"{input}"'
+
+# Inkscape 1.x dropped -z -e, the cli backend swaps these in when the toolchain registry reports export-filename
+INKSCAPE_1_SQUARE_COMMAND = INKSCAPE_BIN + ' --export-filename="{output}" -w {size} -h {size} "{input}"'
+INKSCAPE_1_COMMAND = INKSCAPE_BIN + ' --export-filename="{output}" -w {size} "{input}"'
+INKSCAPE_1_CONVERT = INKSCAPE_BIN + ' --export-filename="{output}" "{input}"'
+INKSCAPE_1_SQUARE_FLATTEN_COMMAND = INKSCAPE_BIN + ' --export-filename="{output}" -w {size} -h {size} ' \
+                                                   '--export-background="{background}" --export-background-opacity=1 ' \
+                                                   '--export-png-color-mode=RGB_8 "{input}"'
+INKSCAPE_EXPORT_FILENAME_COMMANDS = {INKSCAPE_SQUARE_COMMAND: INKSCAPE_1_SQUARE_COMMAND,
+                                     INKSCAPE_COMMAND: INKSCAPE_1_COMMAND,
+                                     INKSCAPE_CONVERT: INKSCAPE_1_CONVERT,
+                                     INKSCAPE_SQUARE_FLATTEN_COMMAND: INKSCAPE_1_SQUARE_FLATTEN_COMMAND}
 
 WEBP_COMMAND = WEBP_BIN + ' -q 75 "{input}" -o "{output}"'
+WEBP_QUALITY_COMMAND = WEBP_BIN + ' -quiet -q {quality} "{input}" -o "{output}"'
+
+# square resize command -> the same resize fused with flattening onto {background}
+FLATTEN_FUSED_COMMANDS = {IMAGE_MAGICK_SQUARE_COMMAND: IMAGE_MAGICK_SQUARE_FLATTEN_COMMAND,
+                          INKSCAPE_SQUARE_COMMAND: INKSCAPE_SQUARE_FLATTEN_COMMAND}
+
+# Multi-output commands: one decode of {input}, one {outputs} entry per density written.
+IMAGE_MAGICK_BATCH_COMMAND = CONVERT_BIN + ' "{input}" {outputs} null:'
+IMAGE_MAGICK_BATCH_OUTPUT = '( +clone -resize {size} -write "{output}" +delete )'
+IMAGE_MAGICK_SQUARE_BATCH_OUTPUT = '( +clone -resize {size}x{size}! -write "{output}" +delete )'
+IMAGE_MAGICK_SQUARE_FLATTEN_BATCH_OUTPUT = '( +clone -resize {size}x{size}! -background "{background}" ' \
+                                           '-alpha remove -alpha off -write "{output}" +delete )'
+
+# Inkscape 1.x only, 0.92 has no actions.
+INKSCAPE_BATCH_COMMAND = INKSCAPE_BIN + ' --actions="{outputs}" "{input}"'
+INKSCAPE_BATCH_OUTPUT = 'export-width:{size};export-filename:{output};export-do;'
+INKSCAPE_SQUARE_BATCH_OUTPUT = 'export-width:{size};export-height:{size};export-filename:{output};export-do;'
+INKSCAPE_SQUARE_FLATTEN_BATCH_OUTPUT = 'export-width:{size};export-height:{size};export-background:{background};' \
+                                       'export-background-opacity:1;export-png-color-mode:RGB_8;' \
+                                       'export-filename:{output};export-do;'
+
+# single-output command -> (batch command, per-output fragment, fragment separator)
+BATCH_COMMANDS = {IMAGE_MAGICK_COMMAND: (IMAGE_MAGICK_BATCH_COMMAND, IMAGE_MAGICK_BATCH_OUTPUT, ' '),
+                  IMAGE_MAGICK_SQUARE_COMMAND: (IMAGE_MAGICK_BATCH_COMMAND, IMAGE_MAGICK_SQUARE_BATCH_OUTPUT, ' '),
+                  IMAGE_MAGICK_SQUARE_FLATTEN_COMMAND: (IMAGE_MAGICK_BATCH_COMMAND,
+                                                        IMAGE_MAGICK_SQUARE_FLATTEN_BATCH_OUTPUT, ' '),
+                  INKSCAPE_COMMAND: (INKSCAPE_BATCH_COMMAND, INKSCAPE_BATCH_OUTPUT, ''),
+                  INKSCAPE_SQUARE_COMMAND: (INKSCAPE_BATCH_COMMAND, INKSCAPE_SQUARE_BATCH_OUTPUT, ''),
+                  INKSCAPE_SQUARE_FLATTEN_COMMAND: (INKSCAPE_BATCH_COMMAND, INKSCAPE_SQUARE_FLATTEN_BATCH_OUTPUT, '')}
+INKSCAPE_BATCH_TEMPLATES = (INKSCAPE_COMMAND, INKSCAPE_SQUARE_COMMAND, INKSCAPE_SQUARE_FLATTEN_COMMAND)
+
+# Requests fed to a persistent `inkscape --shell` worker (inkscape_shell.py), one line per export.
+INKSCAPE_SHELL_REQUEST = '"{input}" -e "{output}" -w {size}'
+INKSCAPE_SHELL_SQUARE_REQUEST = '"{input}" -e "{output}" -w {size} -h {size}'
+INKSCAPE_SHELL_ACTIONS = 'file-open:{input};export-width:{size};export-height:0;export-filename:{output};' \
+                         'export-do;file-close'
+INKSCAPE_SHELL_SQUARE_ACTIONS = 'file-open:{input};export-width:{size};export-height:{size};' \
+                                'export-filename:{output};export-do;file-close'
+INKSCAPE_SHELL_SQUARE_FLATTEN_REQUEST = '"{input}" -e "{output}" -w {size} -h {size} -b "{background}" -y 1'
+INKSCAPE_SHELL_SQUARE_FLATTEN_ACTIONS = 'file-open:{input};export-width:{size};export-height:{size};' \
+                                        'export-background:{background};export-background-opacity:1;' \
+                                        'export-png-color-mode:RGB_8;export-filename:{output};export-do;file-close'
+
+# single-output command -> (Inkscape 0.92 shell request, Inkscape 1.x shell actions)
+SHELL_REQUESTS = {INKSCAPE_COMMAND: (INKSCAPE_SHELL_REQUEST, INKSCAPE_SHELL_ACTIONS),
+                  INKSCAPE_SQUARE_COMMAND: (INKSCAPE_SHELL_SQUARE_REQUEST, INKSCAPE_SHELL_SQUARE_ACTIONS),
+                  INKSCAPE_SQUARE_FLATTEN_COMMAND: (INKSCAPE_SHELL_SQUARE_FLATTEN_REQUEST,
+                                                    INKSCAPE_SHELL_SQUARE_FLATTEN_ACTIONS)}
+
+
+SHELL_CONCURRENCY_KEY = 'SHELL_CONCURRENCY'
+SHELL_TIMEOUT_KEY = 'SHELL_TIMEOUT'
+DEFAULT_SHELL_TIMEOUT = 300
+STDERR_TAIL_LINES = 50
+
+# one call of a batch: argv (already formatted), working directory, timeout in seconds (None for SHELL_TIMEOUT)
+ShellCall = namedtuple('ShellCall', ['argv', 'cwd', 'timeout'], defaults=(None, None))
+
+
+class CommandError(RuntimeError):
+    """
+    Raised by the async runner when a command cannot be started, exits with an error or runs past its timeout.
+
+    Attributes
+    ----------
+    argv
+        the failing command
+    returncode
+        exit code, None when the command could not be started or timed out
+    stderr
+        the last lines written to stderr
+    """
+    def __init__(self, argv, message, returncode=None, stderr=''):
+        super().__init__('{command}: {message}'.format(command=' '.join(shlex.quote(arg) for arg in argv),
+                                                       message=message))
+        self.argv = argv
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+def format_argv(template, **values):
+    """
+    :param template: list of arguments, each may contain {placeholders}
+    :param values: placeholder values
+    :return: the formatted argument list, values with spaces stay a single argument
+    """
+    return [argument.format(**values) for argument in template]
+
+
+def get_shell_concurrency():
+    """
+    :return: maximum number of processes started concurrently by the async runner
+    """
+    concurrency = int(get_environ_val_default(SHELL_CONCURRENCY_KEY, os.cpu_count() or 1))
+    if concurrency < 1:
+        raise ValueError('{key} must be a positive number, got {value}'.format(key=SHELL_CONCURRENCY_KEY,
+                                                                             value=concurrency))
+    return concurrency
+
+
+async def _stream_lines(stream, lines):
+    """
+    :param stream: stderr of a running process
+    :param lines: bounded deque receiving the decoded lines
+    :return: nothing
+    """
+    while True:
+        line = await stream.readline()
+        if not line:
+            return
+        lines.append(line.decode('utf-8', 'replace').rstrip())
+
+
+class AsyncRunner:
+    """
+    A class used to run argv commands as asyncio subprocesses with bounded concurrency.
+
+    Methods
+    -------
+    run(argv, cwd=None, timeout=None)
+        Coroutine, runs one command and returns its stdout, raises CommandError.
+    run_all(calls)
+        Coroutine, runs ShellCalls concurrently and returns their stdout in order; every failure is reported before
+        the first one is raised, or returned in place with return_exceptions.
+    """
+    def __init__(self, concurrency=None, timeout=None):
+        self.concurrency = concurrency if concurrency else get_shell_concurrency()
+        self.timeout = timeout if timeout else int(get_environ_val_default(SHELL_TIMEOUT_KEY, DEFAULT_SHELL_TIMEOUT))
+        self.semaphore = None
+
+    async def run(self, argv, cwd=None, timeout=None):
+        """
+        :param argv: the command, a list of arguments
+        :param cwd: working directory, None for the current one
+        :param timeout: seconds before the process is killed, None for the runner default
+        :return: stdout of the command, bytes
+        """
+        if self.semaphore is None:
+            # created lazily, it belongs to the event loop running the first call
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        async with self.semaphore:
+            try:
+                process = await asyncio.create_subprocess_exec(*argv, cwd=cwd, env=ENV, stdin=subprocess.DEVNULL,
+                                                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            except OSError as start_exception:
+                raise CommandError(argv, 'could not be started ({0})'.format(start_exception))
+            stderr_lines = deque(maxlen=STDERR_TAIL_LINES)
+            stderr_task = asyncio.ensure_future(_stream_lines(process.stderr, stderr_lines))
+
+            async def communicate():
+                output = await process.stdout.read()
+                await process.wait()
+                await stderr_task
+                return output
+
+            try:
+                stdout = await asyncio.wait_for(communicate(), timeout or self.timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                stderr_task.cancel()
+                raise CommandError(argv, 'timed out after {0}s'.format(timeout or self.timeout),
+                                   stderr='\n'.join(stderr_lines))
+            stderr = '\n'.join(stderr_lines)
+            if process.returncode != 0:
+                raise CommandError(argv, 'exited with code {0}: {1}'.format(process.returncode, stderr),
+                                   process.returncode, stderr)
+            return stdout
+
+    async def run_all(self, calls, return_exceptions=False):
+        """
+        :param calls: list of ShellCall
+        :param return_exceptions: return the CommandError of a failed call in its place instead of raising
+        :return: list of stdout, in the order of calls
+        """
+        results = await asyncio.gather(*[self.run(call.argv, call.cwd, call.timeout) for call in calls],
+                                       return_exceptions=True)
+        if return_exceptions:
+            return results
+        failures = [result for result in results if isinstance(result, Exception)]
+        for failure in failures:
+            print(failure)
+        if len(failures) > 0:
+            raise failures[0]
+        return results
+
+
+def run_commands(calls, concurrency=None, return_exceptions=False):
+    """
+    :param calls: list of ShellCall
+    :param concurrency: maximum number of concurrent processes, None for SHELL_CONCURRENCY
+    :param return_exceptions: return the CommandError of a failed call in its place instead of raising
+    :return: list of stdout, in the order of calls; raises CommandError once the whole batch has finished
+    """
+    if IS_WIN:
+        # the default selector loop of python 3.7 on windows cannot start subprocesses
+        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+    return asyncio.run(AsyncRunner(concurrency).run_all(calls, return_exceptions))
 
 
 def has_command(command_string, error_message=None):
@@ -65,14 +311,17 @@ def has_command(command_string, error_message=None):
     :param error_message: message supplied for indicating absence of software
     :return: boolean indicating whether or not the application is present
     """
-    command = shlex.split(command_string)
-    try:
-        subprocess.check_output(command)
-        return True
-    except OSError:
-        if error_message is not None:
-            print(error_message)
-        return False
+    # imported here, the registry reads the binaries defined in this module
+    import toolchain
+    registry = toolchain.get_registry()
+    binary = toolchain.binary_name(command_string)
+    if binary in registry.binaries:
+        present = registry.for_command(binary) is not None
+    else:
+        present = toolchain.resolve(binary) is not None
+    if not present and error_message is not None:
+        print(error_message)
+    return present
 
 
 def has_image_magick():
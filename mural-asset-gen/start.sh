@@ -243,11 +243,33 @@ echo_spacer
 docker run --rm \
 	-e CLIENT_KEY=${client} \
 	-e PLATFORM=${platform} \
+	-e RENDER_WORKERS=${RENDER_WORKERS} \
+	-e RENDER_CACHE_MAX_MB=${RENDER_CACHE_MAX_MB} \
+	-e INKSCAPE_SHELL_WORKERS=${INKSCAPE_SHELL_WORKERS} \
+	-e INCREMENTAL_BUILD=${INCREMENTAL_BUILD} \
+	-e WEBP_QUALITY=${WEBP_QUALITY} \
+	-e RENDER_UPSCALE=${RENDER_UPSCALE} \
+	-e RENDER_MEMORY_MB=${RENDER_MEMORY_MB} \
+	-e CLIENT_SNAPSHOT=${CLIENT_SNAPSHOT} \
+	-e RASTER_BACKEND=${RASTER_BACKEND} \
+	-e RENDER_BATCH=${RENDER_BATCH} \
+	-e RENDER_PYRAMID=${RENDER_PYRAMID} \
+	-e RENDER_CACHE_DIR=${RENDER_CACHE_DIR} \
+	-e RENDER_CACHE_LINK=${RENDER_CACHE_LINK} \
+	-e INKSCAPE_SHELL_TIMEOUT=${INKSCAPE_SHELL_TIMEOUT} \
+	-e SHELL_CONCURRENCY=${SHELL_CONCURRENCY} \
+	-e SHELL_TIMEOUT=${SHELL_TIMEOUT} \
+	-e TOOLCHAIN_CACHE=${TOOLCHAIN_CACHE} \
+	-e RENDER_REDUCE_PX=${RENDER_REDUCE_PX} \
+	-e COPY_STRATEGIES=${COPY_STRATEGIES} \
+	-e WEBP_WORKERS=${WEBP_WORKERS} \
+	-e ZIP_WORKERS=${ZIP_WORKERS} \
 	-e BUILD=${BUILD} \
 	-e ANDROID_BRANCH=${ANDROID_BRANCH} \
 	-e IOS_BRANCH=${IOS_BRANCH} \
 	-v $path/$reponame:/usr/src/app/$reponame \
 	-v $path/output:/usr/src/app/output \
+	-v $path/cache:/usr/src/app/cache \
 	-v $path/input:/usr/src/app/input \
 	-v $path/$targetname:/usr/src/app/$targetname \
 	-v $path/${IOS_PROJECT}/Financial:/usr/src/app/Financial \
@@ -0,0 +1,184 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+Tests of the data.json loader against json.load: the byte scanner must give the same strings, faqs and colors as
+decoding the whole document, for any layout of the file.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import client_data_json  # noqa: E402
+from client_data_json import ClientData  # noqa: E402
+
+ESCAPES = {
+    'version': 3,
+    'default_language': 'en',
+    'app_images': {'launcher': 'svg', 'home': 'png'},
+    'app_colors': {'primary': '#123456', 'secondary': None, 'quote': '"#fff"'},
+    'languages': [
+        {'language': 'en',
+         'app_strings': {'app_name': ' Bank "Plus" ', 'brackets': 'a [b] {c} ] } [ {', 'slash': 'C:\\path\\',
+                         'empty': None, 'escaped_key_\"': 'x', 'unicode': 'caf\u00e9 \u2603 \U0001f600'},
+         'faqs': [{'question': ' What is "[this]"? ', 'answer': 'It is {that}.'},
+                  {'question': 'Second', 'answer': None},
+                  {'question': None, 'answer': 'ignored, the faqs stop at a null question'},
+                  {'question': 'After the stop', 'answer': 'ignored'}]},
+        {'language': 'af',
+         'app_strings': {'app_name': 'Bank', 'brackets': '[[[', 'slash': '\\"', 'empty': '', 'escaped_key_\"': 'y',
+                         'unicode': '\u00eb'},
+         'faqs': []}]}
+
+UNKNOWN_SECTIONS = {
+    'build': {'nested': [{'deep': [[1, 2, {'x': None}], {'y': '[}'}]}], 'flag': True},
+    'version': 1.5,
+    'languages': [
+        {'extra': {'ignored': [{'language': 'zz'}]},
+         'language': 'en',
+         'faqs': [{'question': 'Q', 'answer': 'A', 'tags': ['a', {'b': []}]}],
+         'app_strings': {'title': 'Title', 'body': 'Body'},
+         'trailer': [None, False, -1.25e-3]}],
+    'app_images': {},
+    'default_language': 'en',
+    'app_colors': {'primary': '#000'},
+    'footer': None}
+
+NULL_LANGUAGES = {'version': 1, 'app_images': {'launcher': 'svg'}, 'app_colors': None, 'default_language': None,
+                  'languages': None}
+
+# every language lists its keys in its own order, the loader keeps that order per language
+KEY_ORDER = '''{
+  "languages": [
+    {"language": "en", "app_strings": {"a": "1", "b": "2", "c": "3"}, "faqs": []},
+    {"app_strings": {"c": "three", "a": "one", "b": "two"}, "faqs": [], "language": "fr"},
+    {"faqs": [{"answer": "antwoord", "question": "vraag"}], "language": "af", "app_strings": {"b": "twee", "a": ""}}
+  ],
+  "default_language": "fr",
+  "app_colors": {},
+  "app_images": {},
+  "version": 2
+}'''
+
+
+def expected_strings(document):
+    """
+    :param document: data.json decoded with json.load
+    :return: the strings ClientData.get_strings() must give
+    """
+    if document['languages'] is None:
+        return None
+    return [(entry['language'], [(name, text.strip() if text is not None else '')
+                                 for name, text in entry['app_strings'].items()],
+             entry['language'] == document['default_language']) for entry in document['languages']]
+
+
+def expected_faqs(document):
+    """
+    :param document: data.json decoded with json.load
+    :return: the faqs ClientData.get_faqs() must give
+    """
+    if document['languages'] is None:
+        return None
+    localised = []
+    for entry in document['languages']:
+        faqs = []
+        for faq in entry['faqs']:
+            if faq['question'] is None:
+                break
+            faqs.append((faq['question'].strip(), faq['answer']))
+        localised.append((entry['language'], faqs, entry['language'] == document['default_language']))
+    return localised
+
+
+def expected_colors(document):
+    """
+    :param document: data.json decoded with json.load
+    :return: the colors ClientData.get_colors() must give
+    """
+    if document['app_colors'] is None:
+        return None
+    return dict((name, text if text is not None else '') for name, text in document['app_colors'].items())
+
+
+class ClientDataJsonTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.snapshot = os.environ.get('CLIENT_SNAPSHOT')
+        os.environ['CLIENT_SNAPSHOT'] = '0'
+
+    def tearDown(self):
+        if self.snapshot is None:
+            os.environ.pop('CLIENT_SNAPSHOT', None)
+        else:
+            os.environ['CLIENT_SNAPSHOT'] = self.snapshot
+        shutil.rmtree(self.directory)
+
+    def write(self, text, name='data.json'):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as data_file:
+            data_file.write(text)
+        return path
+
+    def assert_matches_json_load(self, text):
+        path = self.write(text)
+        with open(path, encoding='utf-8') as data_file:
+            document = json.load(data_file)
+        client_data = ClientData(path, 'client')
+        strings = client_data.get_strings()
+        faqs = client_data.get_faqs()
+        self.assertEqual(list(strings) if strings is not None else None, expected_strings(document))
+        self.assertEqual(list(faqs) if faqs is not None else None, expected_faqs(document))
+        self.assertEqual(client_data.get_colors(), expected_colors(document))
+        self.assertEqual(client_data.get_version(), document['version'])
+        self.assertEqual(client_data.get_image_types(), document['app_images'])
+
+    def assert_all_layouts(self, document):
+        for layout in ({}, {'separators': (',', ':')}, {'indent': 2}, {'indent': '\t'}, {'ensure_ascii': False}):
+            with self.subTest(layout=layout):
+                self.assert_matches_json_load(json.dumps(document, **layout))
+
+    def test_escaped_quotes_and_brackets_in_strings(self):
+        self.assert_all_layouts(ESCAPES)
+
+    def test_nested_unknown_sections(self):
+        self.assert_all_layouts(UNKNOWN_SECTIONS)
+
+    def test_null_languages(self):
+        self.assert_all_layouts(NULL_LANGUAGES)
+
+    def test_key_order_per_language(self):
+        self.assert_matches_json_load(KEY_ORDER)
+        self.assert_matches_json_load(KEY_ORDER.replace('\n', '\r\n').replace('  ', '\t'))
+
+    def test_file_changed_after_load(self):
+        path = self.write(json.dumps(ESCAPES))
+        client_data = ClientData(path, 'client')
+        changed = dict(ESCAPES, version=4)
+        changed['padding'] = 'the file is longer now'
+        self.write(json.dumps(changed))
+        with self.assertRaisesRegex(RuntimeError, 'changed after it was loaded'):
+            client_data.get_strings()
+
+    def test_truncated_input(self):
+        text = json.dumps(UNKNOWN_SECTIONS, indent=2)
+        for length in (len(text) // 3, len(text) // 2, len(text) - 2):
+            with self.subTest(length=length):
+                with self.assertRaisesRegex(ValueError, 'Malformed JSON at byte'):
+                    ClientData(self.write(text[:length]), 'client')
+
+    def test_truncated_after_key(self):
+        with self.assertRaisesRegex(ValueError, r'Malformed JSON at byte \d+: expected ":"'):
+            ClientData(self.write('{"version": 1, "app_images"'), 'client')
+
+    def test_syntax_error_names_the_position(self):
+        error = client_data_json._syntax_error(b'{"a": ]', 6, 'a value')
+        self.assertEqual(str(error), "Malformed JSON at byte 6: expected a value, found b']'")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+Tests of the Inkscape shell worker pool against a fake `inkscape --shell` worker.
+
+The fake worker is a small Python script that prints a banner and the prompt, then answers every request line
+"<input> <output> <size>" by writing the output and printing the prompt again. Its mode argument makes it crash,
+hang or skip the output, so restarts, timeouts and protocol failures can be checked without Inkscape.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import inkscape_shell  # noqa: E402
+
+REQUEST = '{input} {output} {size}'
+
+FAKE_WORKER = r'''
+import os
+import sys
+import time
+
+mode, marker = sys.argv[1], sys.argv[2]
+
+
+def prompt():
+    sys.stdout.write('>')
+    sys.stdout.flush()
+
+
+sys.stdout.write('Inkscape interactive shell mode\n')
+prompt()
+for line in sys.stdin:
+    input_path, output_path, size = line.split()
+    if mode == 'crash_once' and not os.path.exists(marker):
+        open(marker, 'w').close()
+        sys.exit(3)
+    if mode == 'hang':
+        time.sleep(30)
+    if mode != 'no_output':
+        with open(output_path, 'w') as output_file:
+            output_file.write(size)
+    # the prompt may arrive in a chunk of its own
+    sys.stdout.write('export done\n')
+    sys.stdout.flush()
+    prompt()
+'''
+
+
+class InkscapeShellPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.script = os.path.join(self.directory, 'fake_inkscape.py')
+        with open(self.script, 'w') as script_file:
+            script_file.write(FAKE_WORKER)
+        self.marker = os.path.join(self.directory, 'crashed')
+        self.pools = []
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.shutdown()
+        shutil.rmtree(self.directory)
+
+    def make_pool(self, mode, workers=1, timeout=5):
+        pool = inkscape_shell.InkscapeShellPool(workers, command=[sys.executable, self.script, mode, self.marker],
+                                                timeout=timeout)
+        self.pools.append(pool)
+        return pool
+
+    def output(self, name):
+        return os.path.join(self.directory, name)
+
+    def test_export_writes_output(self):
+        pool = self.make_pool('ok')
+        for size in (20, 40, 60):
+            pool.export(REQUEST, self.script, self.output('{0}.png'.format(size)), size)
+            with open(self.output('{0}.png'.format(size))) as output_file:
+                self.assertEqual(output_file.read(), str(size))
+        self.assertEqual(pool.restarts, 0)
+
+    def test_crashed_worker_is_restarted(self):
+        pool = self.make_pool('crash_once')
+        pool.export(REQUEST, self.script, self.output('icon.png'), 20)
+        self.assertTrue(os.path.isfile(self.output('icon.png')))
+        self.assertEqual(pool.restarts, 1)
+
+    def test_hung_worker_times_out(self):
+        pool = self.make_pool('hang', timeout=1)
+        with self.assertRaisesRegex(RuntimeError, 'did not answer within 1s'):
+            pool.export(REQUEST, self.script, self.output('icon.png'), 20)
+        self.assertEqual(pool.restarts, 1)
+
+    def test_missing_output_fails_the_export(self):
+        pool = self.make_pool('no_output')
+        with self.assertRaisesRegex(RuntimeError, 'did not write'):
+            pool.export(REQUEST, self.script, self.output('icon.png'), 20)
+        self.assertEqual(pool.restarts, 1)
+
+    def test_stale_output_is_not_accepted(self):
+        pool = self.make_pool('no_output')
+        with open(self.output('icon.png'), 'w') as output_file:
+            output_file.write('previous run')
+        with self.assertRaises(RuntimeError):
+            pool.export(REQUEST, self.script, self.output('icon.png'), 20)
+        self.assertFalse(os.path.exists(self.output('icon.png')))
+
+    def test_worker_is_recycled_after_job_budget(self):
+        budget = inkscape_shell.MAX_JOBS_PER_WORKER
+        inkscape_shell.MAX_JOBS_PER_WORKER = 2
+        try:
+            pool = self.make_pool('ok')
+            for size in range(5):
+                pool.export(REQUEST, self.script, self.output('{0}.png'.format(size)), size)
+        finally:
+            inkscape_shell.MAX_JOBS_PER_WORKER = budget
+        self.assertEqual(pool.restarts, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
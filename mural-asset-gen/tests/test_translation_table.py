@@ -0,0 +1,58 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+Tests of the cross-language queries and the snapshot round trip of the translation table.
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import translation_table  # noqa: E402
+
+LOCALISED = [('en', [('support_phone', '0800 000 000'), ('support_email', 'help@example.com'), ('title', 'Bank')],
+              True),
+             ('af', [('title', 'Bank'), ('support_phone', '0800 000 000'), ('support_email', '')], False),
+             ('zu', [('support_email', 'help@example.com')], False)]
+
+
+class TranslationTableTest(unittest.TestCase):
+    def setUp(self):
+        self.table = translation_table.from_localised(LOCALISED)
+
+    def test_localised_keeps_language_order_and_texts(self):
+        self.assertEqual(list(self.table.localised()), LOCALISED)
+
+    def test_texts_are_pooled(self):
+        self.assertEqual(len(self.table.texts), len({''} | set(text for _, strings, _ in LOCALISED
+                                                                 for _, text in strings)))
+
+    def test_empty_keys_lists_empty_and_missing_keys_per_language(self):
+        self.assertEqual(self.table.empty_keys(), {'af': ['support_email'], 'zu': ['support_phone', 'title']})
+
+    def test_empty_keys_of_a_subset(self):
+        self.assertEqual(self.table.empty_keys(['support_phone']), {'zu': ['support_phone']})
+        self.assertEqual(self.table.empty_keys(['title', 'unknown']),
+                         {'en': ['unknown'], 'af': ['unknown'], 'zu': ['title', 'unknown']})
+
+    def test_all_present(self):
+        self.assertFalse(self.table.all_present(['support_phone', 'support_email']))
+        self.assertTrue(translation_table.from_localised(LOCALISED[:1]).all_present(['support_phone',
+                                                                                      'support_email']))
+
+    def test_row_view(self):
+        row = self.table.row('support_email')
+        self.assertEqual(row.name, 'support_email')
+        self.assertEqual(row.text('af'), '')
+        self.assertEqual(row.texts(), {'en': 'help@example.com', 'af': '', 'zu': 'help@example.com'})
+        self.assertIsNone(self.table.row('unknown'))
+
+    def test_state_round_trip(self):
+        restored = translation_table.from_state(self.table.to_state())
+        self.assertEqual(list(restored.localised()), LOCALISED)
+        self.assertEqual(restored.empty_keys(), self.table.empty_keys())
+
+
+if __name__ == '__main__':
+    unittest.main()
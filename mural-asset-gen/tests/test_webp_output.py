@@ -0,0 +1,76 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+Tests of WebP output through the render scheduler: .webp jobs are rendered to png intermediates, encoded on the
+encoder pool and the intermediates removed.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import render_scheduler  # noqa: E402
+import shell_commands  # noqa: E402
+import webp_encoder  # noqa: E402
+from raster_backend import HAS_PILLOW, Image  # noqa: E402
+from render_scheduler import RenderJob  # noqa: E402
+
+SIZES = (20, 40, 60)
+ENVIRONMENT = {'RENDER_CACHE_MAX_MB': '0', 'RASTER_BACKEND': 'pillow', 'RENDER_PYRAMID': 'none'}
+
+
+@unittest.skipUnless(HAS_PILLOW, 'Pillow is required to render without ImageMagick')
+class WebpOutputTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environment = dict((key, os.environ.get(key)) for key in list(ENVIRONMENT) + ['RENDER_BATCH'])
+        os.environ.update(ENVIRONMENT)
+        self.source = os.path.join(self.directory, 'icon.png')
+        Image.new('RGBA', (120, 120), (200, 40, 40, 128)).save(self.source)
+        self.scheduler = render_scheduler.RenderScheduler(workers=2)
+
+    def tearDown(self):
+        self.scheduler.shutdown()
+        webp_encoder.shutdown_encoder()
+        for key, value in self.environment.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        shutil.rmtree(self.directory)
+
+    def jobs(self):
+        return [RenderJob(shell_commands.IMAGE_MAGICK_SQUARE_COMMAND, self.source,
+                          os.path.join(self.directory, 'out', '{0}.webp'.format(size)), size) for size in SIZES]
+
+    def assert_encoded(self, jobs):
+        for job in jobs:
+            self.assertTrue(os.path.isfile(job.output_path))
+            self.assertFalse(os.path.exists(webp_encoder.intermediate_path(job.output_path)))
+            with Image.open(job.output_path) as image:
+                self.assertEqual(image.format, 'WEBP')
+                self.assertEqual(image.size, (job.size, job.size))
+
+    def submit_and_drain(self, jobs):
+        futures = self.scheduler.submit_set(jobs)
+        self.scheduler.drain()
+        return [future.result() for future in futures]
+
+    def test_batched_set_is_encoded(self):
+        os.environ['RENDER_BATCH'] = '1'
+        jobs = self.jobs()
+        self.assertEqual(self.submit_and_drain(jobs), [jobs[-1].output_path])
+        self.assert_encoded(jobs)
+
+    def test_per_job_set_is_encoded(self):
+        os.environ['RENDER_BATCH'] = '0'
+        jobs = self.jobs()
+        self.assertEqual(self.submit_and_drain(jobs), [job.output_path for job in jobs])
+        self.assert_encoded(jobs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+This file houses the toolchain capability registry.
+
+The external tools (ImageMagick, Inkscape, cwebp, git) are resolved and probed once per process, all version checks
+running concurrently through the shell_commands async runner. The registry exposes the resolved binary, the version
+line, the major version and the supported features of every tool: render stages pick their command templates from it
+and render cache keys carry the version that produced an output.
+
+The probe results are persisted to TOOLCHAIN_CACHE (cache/toolchain.json by default, 'none' disables it), keyed on
+PATH and on the path and modification time of every binary, so an unchanged toolchain is not probed again.
+"""
+import json
+import os
+import re
+import shlex
+import shutil
+import threading
+from collections import namedtuple
+
+import asset_gen_tools
+import shell_commands
+from environmentals import get_environ_val_default
+
+TOOLCHAIN_CACHE_KEY = 'TOOLCHAIN_CACHE'
+DEFAULT_TOOLCHAIN_CACHE = os.path.join('cache', 'toolchain.json')
+TOOLCHAIN_CACHE_NONE = 'none'
+TOOLCHAIN_CACHE_VERSION = 1
+PROBE_TIMEOUT = 30
+
+TOOL_CONVERT = 'convert'
+TOOL_COMPOSITE = 'composite'
+TOOL_INKSCAPE = 'inkscape'
+TOOL_CWEBP = 'cwebp'
+TOOL_GIT = 'git'
+
+# Inkscape 0.92 exports with -z -e, 1.x with --export-filename and understands --actions
+FEATURE_EXPORT_PNG = 'export-png'
+FEATURE_EXPORT_FILENAME = 'export-filename'
+FEATURE_ACTIONS = 'actions'
+FEATURE_WEBP = 'webp'
+
+# tool -> (binary as used in the command templates, version flag)
+TOOLS = {TOOL_CONVERT: (shell_commands.CONVERT_BIN, '-version'),
+         TOOL_COMPOSITE: (shell_commands.COMPOSITE_BIN, '-version'),
+         TOOL_INKSCAPE: (shell_commands.INKSCAPE_BIN, '--version'),
+         TOOL_CWEBP: (shell_commands.WEBP_BIN, '-version'),
+         TOOL_GIT: ('git', '--version')}
+
+VERSION_PATTERN = re.compile(r'(\d+)\.(\d+)')
+IMAGE_MAGICK_DELEGATES_PATTERN = re.compile(r'^Delegates[^:]*:(.*)$', re.MULTILINE)
+
+Capability = namedtuple('Capability', ['name', 'path', 'version', 'major', 'features'])
+
+_REGISTRY = None
+_REGISTRY_LOCK = threading.Lock()
+
+
+def binary_name(command_string):
+    """
+    :param command_string: commandline template or binary
+    :return: the binary of the command, unquoted
+    """
+    return shlex.split(command_string)[0]
+
+
+def resolve(binary):
+    """
+    :param binary: binary name or path
+    :return: absolute path of the binary on the tool PATH, None when it is not installed
+    """
+    return shutil.which(binary, path=shell_commands.ENV.get('PATH'))
+
+
+def _features(name, version_output, major):
+    """
+    :param name: tool name
+    :param version_output: full output of the version check
+    :param major: major version, 0 when unknown
+    :return: sorted list of supported features
+    """
+    features = []
+    if name == TOOL_INKSCAPE:
+        features = [FEATURE_EXPORT_FILENAME, FEATURE_ACTIONS] if major >= 1 else [FEATURE_EXPORT_PNG]
+    elif name == TOOL_CONVERT:
+        match = IMAGE_MAGICK_DELEGATES_PATTERN.search(version_output)
+        if match is not None and FEATURE_WEBP in match.group(1).split():
+            features = [FEATURE_WEBP]
+    return sorted(features)
+
+
+class ToolchainRegistry:
+    """
+    A class used to hold the capabilities of the external tools, probed once.
+
+    Methods
+    -------
+    get(name)
+        Capability of a tool, None when it is not installed.
+    for_command(command_string)
+        Capability of the tool a command template runs.
+    version(command_string)
+        Version line of the tool a command template runs, 'unknown' when not installed.
+    supports(name, feature)
+        Whether an installed tool has the feature.
+    report()
+        Prints the resolved toolchain.
+    """
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path
+        self.capabilities = {}
+        self.binaries = dict((binary_name(binary), name) for name, (binary, _) in TOOLS.items() if binary)
+        paths = dict((name, resolve(binary) if binary else None) for name, (binary, _) in TOOLS.items())
+        self.key = self._cache_key(paths)
+        if not self._load():
+            self._probe(paths)
+            self._save()
+
+    @staticmethod
+    def _cache_key(paths):
+        """
+        :param paths: tool name -> resolved path
+        :return: json serialisable key, changes with PATH or any binary being replaced
+        """
+        binaries = {}
+        for name, path in paths.items():
+            binaries[name] = [path, os.stat(path).st_mtime_ns] if path is not None else None
+        return {'version': TOOLCHAIN_CACHE_VERSION, 'path': shell_commands.ENV.get('PATH', ''), 'binaries': binaries}
+
+    def _probe(self, paths):
+        """
+        :param paths: tool name -> resolved path
+        :return: nothing, runs every version check concurrently
+        """
+        installed = [name for name in sorted(paths) if paths[name] is not None]
+        calls = [shell_commands.ShellCall([paths[name], TOOLS[name][1]], None, PROBE_TIMEOUT) for name in installed]
+        results = shell_commands.run_commands(calls, return_exceptions=True) if len(calls) > 0 else []
+        for name, result in zip(installed, results):
+            if isinstance(result, Exception):
+                continue
+            output = result.decode('utf-8', 'replace').strip()
+            match = VERSION_PATTERN.search(output)
+            major = int(match.group(1)) if match is not None else 0
+            self.capabilities[name] = Capability(name, paths[name], output.split('\n')[0], major,
+                                                 _features(name, output, major))
+
+    def _load(self):
+        """
+        :return: True when the persisted probe results match the current toolchain
+        """
+        if self.cache_path is None or not os.path.isfile(self.cache_path):
+            return False
+        try:
+            cached = json.loads(asset_gen_tools.read(self.cache_path))
+        except ValueError:
+            return False
+        if cached.get('key') != self.key:
+            return False
+        for name, values in cached.get('capabilities', {}).items():
+            self.capabilities[name] = Capability(*values)
+        return True
+
+    def _save(self):
+        """
+        :return: nothing
+        """
+        if self.cache_path is None:
+            return
+        output = json.dumps({'key': self.key, 'capabilities': self.capabilities}, indent=2, sort_keys=True)
+        asset_gen_tools.save(self.cache_path, output)
+
+    def get(self, name):
+        """
+        :param name: tool name, see TOOLS
+        :return: Capability, None when the tool is not installed
+        """
+        return self.capabilities.get(name)
+
+    def for_command(self, command_string):
+        """
+        :param command_string: commandline template or binary
+        :return: Capability of the tool it runs, None when unknown or not installed
+        """
+        return self.get(self.binaries.get(binary_name(command_string)))
+
+    def version(self, command_string):
+        """
+        :param command_string: commandline template or binary
+        :return: version line of the tool it runs, 'unknown' when it is not installed
+        """
+        capability = self.for_command(command_string)
+        return capability.version if capability is not None else 'unknown'
+
+    def supports(self, name, feature):
+        """
+        :param name: tool name
+        :param feature: one of the FEATURE_ constants
+        :return: whether the tool is installed and has the feature
+        """
+        capability = self.get(name)
+        return capability is not None and feature in capability.features
+
+    def report(self):
+        """
+        :return: nothing
+        """
+        for name in sorted(TOOLS):
+            capability = self.get(name)
+            if capability is None:
+                print('toolchain: {0} not found'.format(name))
+            else:
+                print('toolchain: {name} "{version}" {features}'.format(name=name, version=capability.version,
+                                                                      features=capability.features))
+
+
+def get_registry():
+    """
+    :return: the process-wide toolchain registry, probed on first use
+    """
+    global _REGISTRY
+    with _REGISTRY_LOCK:
+        if _REGISTRY is None:
+            cache_path = get_environ_val_default(TOOLCHAIN_CACHE_KEY, DEFAULT_TOOLCHAIN_CACHE)
+            _REGISTRY = ToolchainRegistry(None if cache_path == TOOLCHAIN_CACHE_NONE else cache_path)
+        return _REGISTRY
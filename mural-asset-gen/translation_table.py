@@ -0,0 +1,302 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+This file houses the compact translation table shared by the ClientData loaders.
+
+Key names are interned once and given integer ids, texts are pooled so a text repeated across languages is held once,
+and every language is an array column of text ids indexed by key id, plus the key order of that language. Per
+language bitsets of present and empty keys make cross-language questions ("which of these keys are empty in which
+languages") a few integer operations per language instead of a scan over every string.
+"""
+import sys
+from array import array
+
+# text id of the empty string, and of a key the language does not have
+EMPTY = 0
+MISSING = 0xFFFFFFFF
+
+
+class TranslationRow:
+    """
+    A class used to view one key of the table across languages.
+
+    Methods
+    -------
+    name
+        The key name.
+    text(lang)
+        The text of the key in a language, None when the language does not have it.
+    texts()
+        Dictionary of language -> text for every language that has the key.
+    """
+    __slots__ = ('table', 'key_id')
+
+    def __init__(self, table, key_id):
+        self.table = table
+        self.key_id = key_id
+
+    @property
+    def name(self):
+        """
+        :return: the key name
+        """
+        return self.table.keys[self.key_id]
+
+    def text(self, lang):
+        """
+        :param lang: language code
+        :return: text of the key in the language, None when the language does not have the key
+        """
+        text_id = self.table.text_id(self.table.language_ids[lang], self.key_id)
+        return self.table.texts[text_id] if text_id != MISSING else None
+
+    def texts(self):
+        """
+        :return: dictionary of language -> text, for the languages that have the key
+        """
+        texts = {}
+        for lang in self.table.languages:
+            text = self.text(lang)
+            if text is not None:
+                texts[lang] = text
+        return texts
+
+
+class TranslationTable:
+    """
+    A class used to hold the strings of every language as columns over shared, interned keys.
+
+    Attributes
+    ----------
+    keys : list
+        key id -> interned key name
+    texts : list
+        text id -> text, EMPTY is the empty string
+    languages : list
+        language codes in document order
+
+    Methods
+    -------
+    add_language(lang, strings, default)
+        Adds the (name, text) strings of a language as a column.
+    items(lang)
+        The (name, text) strings of a language in its own order.
+    localised()
+        Generator of (language, strings, is default), the shape ClientData.get_strings() returns.
+    row(name)
+        TranslationRow of a key, None when no language has it.
+    empty_keys(names=None)
+        Dictionary of language -> keys that are empty or missing in it.
+    all_present(names)
+        Whether every key of names has a text in every language.
+    to_state()
+        The table as builtin values, for client_snapshot.
+    """
+    def __init__(self):
+        self.keys = []
+        self.key_ids = {}
+        self.texts = ['']
+        self.text_ids = {'': EMPTY}
+        self.languages = []
+        self.language_ids = {}
+        self.defaults = []
+        self.columns = []
+        self.orders = []
+        self.present_masks = []
+        self.empty_masks = []
+
+    def _key_id(self, name):
+        """
+        :param name: key name
+        :return: id of the key, interned on first use
+        """
+        key_id = self.key_ids.get(name)
+        if key_id is None:
+            key_id = len(self.keys)
+            name = sys.intern(name)
+            self.keys.append(name)
+            self.key_ids[name] = key_id
+        return key_id
+
+    def _text_id(self, text):
+        """
+        :param text: text
+        :return: id of the text in the pool
+        """
+        text_id = self.text_ids.get(text)
+        if text_id is None:
+            text_id = len(self.texts)
+            self.texts.append(text)
+            self.text_ids[text] = text_id
+        return text_id
+
+    def add_language(self, lang, strings, default):
+        """
+        :param lang: language code
+        :param strings: (name, text) strings of the language
+        :param default: whether the language is the default of the client
+        :return: nothing
+        """
+        column = array('I')
+        order = array('I')
+        present = bytearray()
+        empty = bytearray()
+        for name, text in strings:
+            key_id = self._key_id(name)
+            text_id = self._text_id(text)
+            if key_id >= len(column):
+                column.extend([MISSING] * (key_id + 1 - len(column)))
+                flags_size = (key_id >> 3) + 1
+                present.extend(bytes(flags_size - len(present)))
+                empty.extend(bytes(flags_size - len(empty)))
+            if column[key_id] == MISSING:
+                order.append(key_id)
+            column[key_id] = text_id
+            present[key_id >> 3] |= 1 << (key_id & 7)
+            if text_id == EMPTY:
+                empty[key_id >> 3] |= 1 << (key_id & 7)
+            else:
+                empty[key_id >> 3] &= ~(1 << (key_id & 7)) & 0xFF
+        self.language_ids[lang] = len(self.languages)
+        self.languages.append(lang)
+        self.defaults.append(default)
+        self.columns.append(column)
+        self.orders.append(order)
+        self.present_masks.append(int.from_bytes(bytes(present), 'little'))
+        self.empty_masks.append(int.from_bytes(bytes(empty), 'little'))
+
+    def text_id(self, language_id, key_id):
+        """
+        :param language_id: index of the language
+        :param key_id: id of the key
+        :return: text id of the key in the language, MISSING when the language does not have it
+        """
+        column = self.columns[language_id]
+        return column[key_id] if key_id < len(column) else MISSING
+
+    def items(self, lang):
+        """
+        :param lang: language code
+        :return: list of (name, text) of the language, in its own order
+        """
+        return self._items(self.language_ids[lang])
+
+    def _items(self, language_id):
+        """
+        :param language_id: index of the language
+        :return: list of (name, text) of the language, in its own order
+        """
+        column = self.columns[language_id]
+        return [(self.keys[key_id], self.texts[column[key_id]]) for key_id in self.orders[language_id]]
+
+    def localised(self):
+        """
+        :return: generator of (language, [(name, text)], is default) per language
+        """
+        return ((lang, self._items(language_id), self.defaults[language_id])
+                for language_id, lang in enumerate(self.languages))
+
+    def row(self, name):
+        """
+        :param name: key name
+        :return: TranslationRow of the key, None when no language has it
+        """
+        key_id = self.key_ids.get(name)
+        return TranslationRow(self, key_id) if key_id is not None else None
+
+    def _mask(self, names):
+        """
+        :param names: key names, None for every key
+        :return: (bitset of the known keys among names, names no language has)
+        """
+        if names is None:
+            return (1 << len(self.keys)) - 1, []
+        mask = 0
+        unknown = []
+        for name in names:
+            key_id = self.key_ids.get(name)
+            if key_id is None:
+                unknown.append(name)
+            else:
+                mask |= 1 << key_id
+        return mask, unknown
+
+    def empty_keys(self, names=None):
+        """
+        :param names: key names to check, None for every key
+        :return: dictionary of language -> names that are empty or missing in it, for the languages that have any
+        """
+        mask, unknown = self._mask(names)
+        result = {}
+        for lang, present, empty in zip(self.languages, self.present_masks, self.empty_masks):
+            hits = (empty | ~present) & mask
+            if hits == 0 and len(unknown) == 0:
+                continue
+            found = []
+            for byte_index, byte in enumerate(hits.to_bytes((hits.bit_length() + 7) // 8, 'little')):
+                for bit in range(8) if byte else ():
+                    if byte & (1 << bit):
+                        found.append(self.keys[(byte_index << 3) + bit])
+            result[lang] = found + unknown
+        return result
+
+    def all_present(self, names):
+        """
+        :param names: key names to check
+        :return: whether every key has a non-empty text in every language
+        """
+        return len(self.empty_keys(names)) == 0
+
+    def to_state(self):
+        """
+        :return: dictionary of builtin values (lists, bytes, ints) holding the whole table
+        """
+        return {'keys': self.keys, 'texts': self.texts, 'languages': self.languages, 'defaults': self.defaults,
+                'columns': [column.tobytes() for column in self.columns],
+                'orders': [order.tobytes() for order in self.orders],
+                'present': self.present_masks, 'empty': self.empty_masks}
+
+
+def from_state(state):
+    """
+    :param state: dictionary made by TranslationTable.to_state(), None when there are no strings
+    :return: the TranslationTable, None when there are no strings
+    """
+    if state is None:
+        return None
+    table = TranslationTable()
+    table.keys = [sys.intern(name) for name in state['keys']]
+    table.key_ids = dict((name, key_id) for key_id, name in enumerate(table.keys))
+    table.texts = state['texts']
+    table.text_ids = dict((text, text_id) for text_id, text in enumerate(table.texts))
+    table.languages = state['languages']
+    table.language_ids = dict((lang, language_id) for language_id, lang in enumerate(table.languages))
+    table.defaults = state['defaults']
+    table.columns = [_array(column) for column in state['columns']]
+    table.orders = [_array(order) for order in state['orders']]
+    table.present_masks = state['present']
+    table.empty_masks = state['empty']
+    return table
+
+
+def _array(data):
+    """
+    :param data: bytes of an array('I')
+    :return: the array
+    """
+    values = array('I')
+    values.frombytes(data)
+    return values
+
+
+def from_localised(localised_strings):
+    """
+    :param localised_strings: iterable of (language, [(name, text)], is default), None when there are no strings
+    :return: TranslationTable of the strings, None when there are no strings
+    """
+    if localised_strings is None:
+        return None
+    table = TranslationTable()
+    for lang, strings, default in localised_strings:
+        table.add_language(lang, strings, default)
+    return table
@@ -0,0 +1,148 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+This file houses the WebP encoder pool used for WebP output.
+
+A render job whose output path ends in .webp is rendered to a PNG intermediate as usual (cache, batching and pyramids
+all apply) and, once its density set is complete, the intermediates are encoded to WebP concurrently on a dedicated
+pool of encoder threads at WEBP_QUALITY. Encoding goes through Pillow when it was built with WebP support and through
+cwebp otherwise.
+
+A platform opts in by giving its render jobs .webp output paths. The iOS asset catalogs keep PNG, so no platform in
+this tree does yet; tests/test_webp_output.py exercises the path through the scheduler.
+"""
+import os
+import shlex
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import shell_commands
+from environmentals import get_environ_val_default
+from raster_backend import HAS_PILLOW_WEBP, Image
+
+WEBP_QUALITY_KEY = 'WEBP_QUALITY'
+WEBP_WORKERS_KEY = 'WEBP_WORKERS'
+
+WEBP_EXT = '.webp'
+INTERMEDIATE_EXT = '.png'
+DEFAULT_QUALITY = 75
+
+_ENCODER = None
+_ENCODER_LOCK = threading.Lock()
+
+
+def is_webp(path):
+    """
+    :param path: output path
+    :return: whether the output has to be encoded to WebP
+    """
+    return path is not None and path.lower().endswith(WEBP_EXT)
+
+
+def intermediate_path(path):
+    """
+    :param path: .webp output path
+    :return: path of the png rendered before encoding
+    """
+    return path + INTERMEDIATE_EXT
+
+
+def get_quality():
+    """
+    :return: WebP quality, from WEBP_QUALITY
+    """
+    quality = int(get_environ_val_default(WEBP_QUALITY_KEY, DEFAULT_QUALITY))
+    if quality < 0 or quality > 100:
+        raise ValueError('{key} must be between 0 and 100, got {value}'.format(key=WEBP_QUALITY_KEY, value=quality))
+    return quality
+
+
+def encode(input_path, output_path, quality):
+    """
+    :param input_path: png to be encoded
+    :param output_path: the path where the WebP image should be written
+    :param quality: WebP quality, 0 - 100
+    :return: nothing
+    """
+    if HAS_PILLOW_WEBP:
+        with Image.open(input_path) as source:
+            source.save(output_path, 'WEBP', quality=quality)
+        return
+    command = shlex.split(shell_commands.WEBP_QUALITY_COMMAND.format(input=input_path, output=output_path,
+                                                                      quality=quality))
+    subprocess.check_output(command, env=shell_commands.ENV, stderr=subprocess.STDOUT)
+
+
+class WebpEncoder:
+    """
+    A class used to encode rendered density sets to WebP on a bounded pool of encoder threads.
+
+    Attributes
+    ----------
+    quality
+        WebP quality applied to every image
+
+    Methods
+    -------
+    encode_set(outputs)
+        Encodes every (png_path, webp_path) concurrently and removes the png intermediates.
+    shutdown()
+        Stops the encoder threads.
+    """
+    def __init__(self, workers, quality):
+        self.quality = quality
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def encode_set(self, outputs):
+        """
+        :param outputs: list of (png_path, webp_path)
+        :return: nothing, raises once every output has been encoded or reported
+        """
+        futures = [(self.executor.submit(encode, png_path, webp_path, self.quality), png_path, webp_path)
+                   for png_path, webp_path in outputs]
+        failures = []
+        for future, png_path, webp_path in futures:
+            try:
+                future.result()
+            except (OSError, subprocess.CalledProcessError) as encode_exception:
+                print('Failed to encode {input} to {output}: {error}'.format(input=png_path, output=webp_path,
+                                                                             error=encode_exception))
+                failures.append(webp_path)
+                continue
+            os.remove(png_path)
+        if len(failures) > 0:
+            raise RuntimeError('{count} WebP outputs could not be encoded: {failures}'.format(count=len(failures),
+                                                                                             failures=failures))
+
+    def shutdown(self):
+        """
+        :return: nothing
+        """
+        self.executor.shutdown(wait=True)
+
+
+def get_encoder():
+    """
+    :return: the process-wide WebP encoder, created on first use
+    """
+    global _ENCODER
+    with _ENCODER_LOCK:
+        if _ENCODER is None:
+            workers = int(get_environ_val_default(WEBP_WORKERS_KEY, os.cpu_count() or 1))
+            if workers < 1:
+                raise ValueError('{key} must be a positive number, got {value}'.format(key=WEBP_WORKERS_KEY,
+                                                                                     value=workers))
+            _ENCODER = WebpEncoder(workers, get_quality())
+        return _ENCODER
+
+
+def shutdown_encoder():
+    """
+    :return: nothing
+    """
+    global _ENCODER
+    with _ENCODER_LOCK:
+        if _ENCODER is not None:
+            _ENCODER.shutdown()
+            _ENCODER = None
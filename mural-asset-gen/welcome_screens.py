@@ -0,0 +1,72 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+This file houses the welcome screen engine, used for clients that do not supply their own welcome images.
+
+Each shared welcome template is read from disk once per process and recoloured in memory with a substitution map
+compiled once per client palette: every template color token is replaced by the matching client color in a single
+regex pass. The recoloured SVG is written once per image and its whole density set is then rendered as one set by the
+render scheduler (rendered once at the largest density and downsampled, or one batched tool invocation).
+"""
+import re
+
+import asset_gen_tools
+
+# template color token -> name of the client palette color that replaces it
+WELCOME_TEMPLATE_TOKENS = {'#DD4814': 'primary',
+                           '#002244': 'secondary'}
+
+_TEMPLATES = {}
+
+
+def load_template(path):
+    """
+    :param path: path to a welcome svg template
+    :return: the template text, read from disk only the first time
+    """
+    template = _TEMPLATES.get(path)
+    if template is None:
+        template = asset_gen_tools.read(path)
+        _TEMPLATES[path] = template
+    return template
+
+
+class WelcomeScreenEngine:
+    """
+    A class used to recolour the shared welcome screen templates with a client palette.
+
+    Attributes
+    ----------
+    substitutions
+        template token (upper case) -> client color
+
+    Methods
+    -------
+    recolor(template)
+        Replaces every palette token of the template in one pass.
+    write_recolored(template_path, output_path)
+        Recolours a template and saves the resulting svg.
+    """
+    def __init__(self, palette, tokens=None):
+        tokens = tokens if tokens is not None else WELCOME_TEMPLATE_TOKENS
+        self.substitutions = dict((token.upper(), palette[name]) for token, name in tokens.items()
+                                  if palette.get(name))
+        pattern = '|'.join(re.escape(token) for token in sorted(self.substitutions, key=len, reverse=True))
+        self.pattern = re.compile(pattern, re.IGNORECASE) if pattern else None
+
+    def recolor(self, template):
+        """
+        :param template: svg text
+        :return: the svg text with the client colors applied
+        """
+        if self.pattern is None:
+            return template
+        return self.pattern.sub(lambda match: self.substitutions[match.group(0).upper()], template)
+
+    def write_recolored(self, template_path, output_path):
+        """
+        :param template_path: path to the shared template
+        :param output_path: path of the recoloured svg
+        :return: nothing
+        """
+        asset_gen_tools.save(output_path, self.recolor(load_template(template_path)))
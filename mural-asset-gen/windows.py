@@ -11,12 +11,25 @@ COMMANDS = {'convert': 'ImageMagick',
             'composite': 'ImageMagick',
             'inkscape': 'Inkscape'}
 
+# program -> install folder, the Program Files directories are listed once per program
+_PATHS = {}
+
 
 def get_windows_path(program):
     """
     :param program:
     :return:
     """
+    if program not in _PATHS:
+        _PATHS[program] = _find_windows_path(program)
+    return _PATHS[program]
+
+
+def _find_windows_path(program):
+    """
+    :param program: prefix of the install folder
+    :return: the first matching folder in the Program Files directories, None when not installed
+    """
     for location in ['ProgramW6432', 'ProgramFiles', 'ProgramFiles(x86)']:
         program_files = get_environ_val(location)
         path = [os.path.join(program_files, folder) for
@@ -0,0 +1,169 @@
+"""
+Author/Engineer: Lerato Mokoena
+
+This file houses the deterministic, streaming zip writer behind asset_gen_tools.zip_directory.
+
+Entries are written in sorted order with a fixed timestamp and the permission bits of each file (as a regular
+file, without the other st_mode bits), so the same tree always gives the same archive. Already-compressed formats
+(png, webp, jpg, ...) are stored; every other file is deflated on a pool of ZIP_WORKERS threads (zlib releases the
+GIL) and kept stored when deflating does not make it smaller. The archive is written to its destination as the
+entries complete: stored files are streamed in blocks, only the deflated text assets of the in-flight window are held
+in memory.
+
+The writer produces plain (non zip64) archives, which is ample for asset packs.
+"""
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from environmentals import get_environ_val_default
+
+ZIP_WORKERS_KEY = 'ZIP_WORKERS'
+
+STORED_EXTENSIONS = ('.png', '.webp', '.jpg', '.jpeg', '.gif', '.zip', '.gz', '.jar', '.aar', '.mp3', '.mp4')
+COMPRESS_LEVEL = 6
+BLOCK_SIZE = 1024 * 1024
+
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+VERSION_NEEDED = 20
+# made by unix (3), zip spec 3.0, so the external attributes carry unix permissions
+VERSION_MADE_BY = (3 << 8) | 30
+FLAG_UTF8 = 0x800
+# 1980-01-01 00:00:00, the zip epoch
+DOS_TIME = 0
+DOS_DATE = (1 << 5) | 1
+# unix file type of every entry, a regular file, combined with the permission bits of the file
+REGULAR_FILE = 0o100000
+PERMISSION_BITS = 0o777
+ZIP_LIMIT = 0xFFFFFFFF
+ENTRY_LIMIT = 0xFFFF
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+END_RECORD = struct.Struct('<IHHHHIIH')
+
+
+def get_zip_workers():
+    """
+    :return: number of deflate workers, from ZIP_WORKERS or the cpu count of the machine
+    """
+    workers = int(get_environ_val_default(ZIP_WORKERS_KEY, os.cpu_count() or 1))
+    if workers < 1:
+        raise ValueError('{key} must be a positive number, got {value}'.format(key=ZIP_WORKERS_KEY, value=workers))
+    return workers
+
+
+def list_entries(path):
+    """
+    :param path: directory to be archived
+    :return: sorted list of (archive name, file path)
+    """
+    entries = []
+    for root, _, files in os.walk(path):
+        for name in files:
+            file_path = os.path.join(root, name)
+            entries.append((os.path.relpath(file_path, path).replace(os.sep, '/'), file_path))
+    return sorted(entries)
+
+
+def _prepare(file_path):
+    """
+    :param file_path: file to be archived
+    :return: (method, crc, size, deflated data or None for stored entries)
+    """
+    if file_path.lower().endswith(STORED_EXTENSIONS):
+        crc = 0
+        size = 0
+        with open(file_path, 'rb') as input_file:
+            for block in iter(lambda: input_file.read(BLOCK_SIZE), b''):
+                crc = zlib.crc32(block, crc)
+                size += len(block)
+        return METHOD_STORED, crc, size, None
+
+    with open(file_path, 'rb') as input_file:
+        data = input_file.read()
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = compressor.compress(data) + compressor.flush()
+    if len(deflated) >= len(data):
+        return METHOD_STORED, zlib.crc32(data), len(data), None
+    return METHOD_DEFLATED, zlib.crc32(data), len(data), deflated
+
+
+def write_zip(path, zip_path, workers=None):
+    """
+    :param path: directory to be archived
+    :param zip_path: archive to write
+    :param workers: number of deflate workers, None for ZIP_WORKERS
+    :return: number of entries written
+    """
+    entries = list_entries(path)
+    if len(entries) > ENTRY_LIMIT:
+        raise ValueError('{0} holds {1} files, more than a zip without zip64 can hold'.format(path, len(entries)))
+    workers = workers if workers else get_zip_workers()
+    central = []
+    with ThreadPoolExecutor(max_workers=workers) as executor, open(zip_path, 'wb') as output_file:
+        # bounded read-ahead, only the deflated entries of this window are held in memory
+        window = deque()
+        window_size = workers * 4
+        for name, file_path in entries:
+            window.append((name, file_path, executor.submit(_prepare, file_path)))
+            if len(window) >= window_size:
+                central.append(_write_entry(output_file, *window.popleft()))
+        while window:
+            central.append(_write_entry(output_file, *window.popleft()))
+
+        directory_offset = output_file.tell()
+        for record in central:
+            output_file.write(record)
+        directory_size = output_file.tell() - directory_offset
+        if directory_offset > ZIP_LIMIT:
+            raise ValueError('{0} is too large for a zip without zip64'.format(zip_path))
+        output_file.write(END_RECORD.pack(0x06054b50, 0, 0, len(central), len(central), directory_size,
+                                          directory_offset, 0))
+    return len(central)
+
+
+def external_attributes(file_path):
+    """
+    :param file_path: file to be archived
+    :return: zip external attributes carrying the unix permissions of the file
+    """
+    return (REGULAR_FILE | os.stat(file_path).st_mode & PERMISSION_BITS) << 16
+
+
+def _write_entry(output_file, name, file_path, future):
+    """
+    :param output_file: the archive being written
+    :param name: archive name of the entry
+    :param file_path: file to be archived
+    :param future: future of _prepare for the file
+    :return: the central directory record of the entry
+    """
+    method, crc, size, deflated = future.result()
+    compressed_size = len(deflated) if deflated is not None else size
+    offset = output_file.tell()
+    if size > ZIP_LIMIT or offset > ZIP_LIMIT:
+        raise ValueError('{0} is too large for a zip without zip64'.format(file_path))
+    encoded_name = name.encode('utf-8')
+    flags = FLAG_UTF8 if encoded_name != name.encode('ascii', 'replace') else 0
+
+    output_file.write(LOCAL_HEADER.pack(0x04034b50, VERSION_NEEDED, flags, method, DOS_TIME, DOS_DATE, crc,
+                                        compressed_size, size, len(encoded_name), 0))
+    output_file.write(encoded_name)
+    if deflated is not None:
+        output_file.write(deflated)
+    else:
+        written = 0
+        with open(file_path, 'rb') as input_file:
+            for block in iter(lambda: input_file.read(BLOCK_SIZE), b''):
+                output_file.write(block)
+                written += len(block)
+        if written != size:
+            raise RuntimeError('{0} changed while it was being archived'.format(file_path))
+
+    return CENTRAL_HEADER.pack(0x02014b50, VERSION_MADE_BY, VERSION_NEEDED, flags, method, DOS_TIME, DOS_DATE, crc,
+                               compressed_size, size, len(encoded_name), 0, 0, 0, 0,
+                               external_attributes(file_path), offset) + encoded_name